@@ -0,0 +1,106 @@
+"""Local card metadata index for deck imports.
+
+A SQLite file (server/data/cards.sqlite) holding the Scryfall JSON of every
+card deck_download.py has resolved, keyed by scryfall id and by normalized
+name (each face of a double-faced card too). It can also be filled from a
+Scryfall bulk-data file, after which it knows every card and misspelled
+names are matched locally:
+
+    python card_index.py import default-cards.json
+"""
+import difflib, json, sqlite3, sys, threading, unicodedata
+from pathlib import Path
+
+DEFAULT_PATH = Path(__file__).resolve().parent / "server" / "data" / "cards.sqlite"
+
+def normalize(name: str) -> str:
+    """Case-, accent- and whitespace-insensitive lookup key ("Lim-Dûl's  Vault" -> "lim-dul's vault")."""
+    decomposed = unicodedata.normalize("NFKD", name)
+    plain = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return " ".join(plain.lower().split())
+
+def _names(card_json: dict):
+    yield card_json.get("name", "")
+    for face in card_json.get("card_faces") or []:
+        yield face.get("name", "")
+
+class CardIndex:
+    """Thread-safe: deck_download.py looks cards up from a pool of workers."""
+
+    def __init__(self, path: Path | str = DEFAULT_PATH):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(path), check_same_thread=False)
+        self.lock = threading.Lock()
+        # name keys for fuzzy matching, loaded on first use; replaced whole, never edited in place
+        self._keys: tuple[str, ...] | None = None
+        with self.lock, self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS cards (id TEXT PRIMARY KEY, json TEXT NOT NULL)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS names (key TEXT PRIMARY KEY, id TEXT NOT NULL)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT)")
+
+    @property
+    def complete(self) -> bool:
+        """True once a bulk file was imported: a name missing from the index is then a misspelling."""
+        with self.lock:
+            return self.db.execute("SELECT 1 FROM meta WHERE k = 'bulk'").fetchone() is not None
+
+    def by_id(self, scryfall_id: str) -> dict | None:
+        with self.lock:
+            row = self.db.execute("SELECT json FROM cards WHERE id = ?", (scryfall_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get(self, name: str) -> dict | None:
+        with self.lock:
+            row = self.db.execute("SELECT c.json FROM names n JOIN cards c ON c.id = n.id WHERE n.key = ?",
+                                  (normalize(name),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def fuzzy(self, name: str, cutoff: float = 0.8) -> dict | None:
+        """Closest indexed name (difflib ratio >= cutoff), like Scryfall's fuzzy search but offline."""
+        keys = self._keys  # one read: a concurrent _store may reset it meanwhile
+        if keys is None:
+            with self.lock:
+                keys = self._keys = tuple(k for (k,) in self.db.execute("SELECT key FROM names"))
+        match = difflib.get_close_matches(normalize(name), keys, n=1, cutoff=cutoff)
+        return self.get(match[0]) if match else None
+
+    def put(self, card_json: dict):
+        """Remember a card from a live lookup; it wins over whatever printing was indexed before."""
+        self._store([card_json], replace=True)
+
+    def import_bulk(self, path: Path | str) -> int:
+        """Index a Scryfall bulk-data file (oracle_cards or default_cards); returns cards added."""
+        with open(path, encoding="utf-8") as f:
+            cards = {}
+            for c in json.load(f):
+                # default_cards lists every printing; the first one with an image will do
+                if c.get("image_uris") or c.get("card_faces"):
+                    cards.setdefault(normalize(c.get("name", "")), c)
+        self._store(list(cards.values()), replace=False)
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('bulk', ?)", (str(path),))
+        return len(cards)
+
+    def _store(self, cards: list[dict], replace: bool):
+        # bulk imports keep the first printing of each name; live lookups replace it
+        verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+        with self.lock, self.db:
+            self.db.executemany("INSERT OR REPLACE INTO cards VALUES (?, ?)",
+                                ((c["id"], json.dumps(c)) for c in cards))
+            self.db.executemany(f"{verb} INTO names VALUES (?, ?)",
+                                ((normalize(n), c["id"]) for c in cards for n in _names(c) if n))
+            self._keys = None
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM cards").fetchone()[0]
+
+def main(argv: list[str]):
+    if len(argv) == 2 and argv[0] == "import":
+        n = CardIndex().import_bulk(argv[1])
+        print(f"Indexed {n} cards from {argv[1]}")
+    else:
+        print(__doc__)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
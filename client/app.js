@@ -1,11 +1,20 @@
 const $  = (s, r=document) => r.querySelector(s);
 const $$ = (s, r=document) => [...r.querySelectorAll(s)];
 
-let ws, roomId, me = { id:"A", name:"", deck:"" }, state = null;
+let ws, roomId, me = { id:"A", name:"", deck:"", spectator:false }, state = null;
+let binaryWire = false;  // true once the server answers in MessagePack
+let retryMs = 0;  // reconnect backoff; reset once a connection gets its first frame
+let session = null;  // this join's id; only automatic reconnects reuse it, so a rejoin from the lobby reseats
+
+// Send a message in the encoding the server settled on
+function wsSend(msg) {
+  ws.send(binaryWire ? MsgPack.encode(msg) : JSON.stringify(msg));
+}
 
 // ---- boot
 document.addEventListener("DOMContentLoaded", () => {
   joinFlow();
+  importFlow();
   setupDnD();
   wireButtons();
   wireZoneClicks();
@@ -14,6 +23,14 @@ document.addEventListener("DOMContentLoaded", () => {
   document.addEventListener("keydown", e => {
     if (e.target.tagName === 'INPUT' || e.target.tagName === 'TEXTAREA') return;
     const key = e.key.toLowerCase();
+    if (e.ctrlKey || e.metaKey) {
+      // Undo / redo the table's last action: Ctrl+Z, Ctrl+Shift+Z or Ctrl+Y
+      if (key === 'z' || key === 'y') {
+        e.preventDefault();
+        sendAction(key === 'y' || e.shiftKey ? "redo" : "undo", {});
+      }
+      return;
+    }
     if (key === 'd') sendAction("draw", { player_id: me.id, n: 1 });
     if (key === 'p') sendAction("pass_turn", {});
     if (key === 'h') sendAction("toggle_show_hand", { player_id: me.id });
@@ -54,63 +71,202 @@ async function loadDecks() {
   }
 }
 
+// ---- deck import: the server runs it as a job; poll until the deck is saved
+function importFlow() {
+  const btn = $("#importBtn");
+  if (!btn) return;
+  const status = $("#importStatus");
+  btn.onclick = async () => {
+    const name = $("#importName").value.trim(), text = $("#importText").value.trim();
+    if (!name || !text) { status.textContent = "Give the deck a name and a decklist."; return; }
+    btn.disabled = true;
+    status.textContent = "Starting import…";
+    try {
+      const res = await fetch("/api/decks/import", {
+        method: "POST", headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ name, text })
+      });
+      const data = await res.json();
+      if (!res.ok) throw new Error((data && data.detail && (data.detail[0]?.msg || data.detail)) || res.statusText);
+      let job = data.job;
+      while (job.status === "queued" || job.status === "running") {
+        status.textContent = job.total ? `Importing… ${job.done}/${job.total} cards` : "Resolving cards…";
+        await new Promise(r => setTimeout(r, 700));
+        job = await (await fetch(`/api/decks/import/${job.id}`)).json();
+      }
+      if (job.status === "error") throw new Error(job.error);
+      status.textContent = `Imported "${job.name}".`;
+      await loadDecks();
+      const sel = $("#deck"); if (sel) sel.value = job.name;
+    } catch (err) {
+      status.textContent = `Import failed: ${err.message}`;
+    } finally {
+      btn.disabled = false;
+    }
+  };
+}
+
 // ---- join
 function joinFlow() {
   const btn = $("#joinBtn");
   if (!btn) return;
   btn.onclick = () => {
     roomId = $("#room").value.trim() || "TEST";
-    me.id = $("#seat").value || "A";
+    // Spectators watch from seat A's side of the table
+    me.spectator = $("#seat").value === "spectator";
+    me.id = me.spectator ? "A" : ($("#seat").value || "A");
+    document.body.classList.toggle("spectating", me.spectator);
     me.name = $("#pname").value.trim();
     const deckSel = $("#deck");
     me.deck = deckSel && deckSel.value ? deckSel.value : "";
 
     $("#join").classList.add("hidden");
     $("#app").classList.remove("hidden");
-    connect();
+    session = Math.random().toString(36).slice(2) + Date.now().toString(36);
+    state = null;
+    connect(false);
   };
 }
 
-function connect() {
+function connect(resume) {
   const proto = location.protocol === "https:" ? "wss" : "ws";
   ws = new WebSocket(`${proto}://${location.host}/ws/${encodeURIComponent(roomId)}`);
+  ws.binaryType = "arraybuffer";
 
   ws.onopen = () => {
-    ws.send(JSON.stringify({
+    // The hello is always JSON; everything after it uses the encoding we ask for
+    ws.send(JSON.stringify(me.spectator ? {
+      kind: "hello",
+      room_id: roomId,
+      role: "spectator",
+      encoding: window.MsgPack ? "msgpack" : "json"
+    } : {
       kind: "hello",
       room_id: roomId,
       player_id: me.id,
       name: me.name || undefined,
-      deck: me.deck || undefined
+      deck: me.deck || undefined,
+      encoding: window.MsgPack ? "msgpack" : "json",
+      // a new id claims the seat; sent again on a reconnect, the server keeps the seat as it is
+      // and sends only what we missed, or a snapshot if it no longer can
+      session,
+      last_version: resume && state ? state.version : undefined
     }));
   };
 
+  // Dropped connections come back on their own: right away when the server restarted or moved
+  // the room (1012), after a pause when it shed us for falling behind (1013), else with backoff.
+  ws.onclose = ev => {
+    if (ev.code === 1008) {  // turned away for good, e.g. spectating a room that does not exist
+      alert("Cannot join this room.");
+      location.reload();
+      return;
+    }
+    document.body.classList.add("reconnecting");
+    const wait = ev.code === 1012 ? 100 : ev.code === 1013 ? 2000 : retryMs;
+    retryMs = Math.min(Math.max(retryMs * 2, 500), 10000);
+    setTimeout(() => connect(true), wait);
+  };
+
   ws.onmessage = ev => {
-    const msg = JSON.parse(ev.data);
+    // Binary frames are MessagePack, text frames JSON (servers without msgpack answer in JSON)
+    const msg = typeof ev.data === "string" ? JSON.parse(ev.data) : MsgPack.decode(ev.data);
+    binaryWire = typeof ev.data !== "string";
+    retryMs = 0;
+    document.body.classList.remove("reconnecting");
     if (msg.kind === "state") { state = msg.state; render(); }
+    if (msg.kind === "patch") applyPatch(msg);
+    if (msg.kind === "drag" || msg.kind === "ack") checkVersion(msg);
+    if (msg.kind === "drag") showDragPreview(msg);
+    if (msg.kind === "ack" && !msg.ok) console.warn("server rejected message:", msg.msg);
   };
 }
 
+// Every frame carries the room version; one ahead of ours means a patch went missing.
+function checkVersion(msg) {
+  if (state && msg.version != null && msg.version > state.version) wsSend({ kind: "resync" });
+}
+
+// Another player's drag in progress: move their card without touching state.
+function showDragPreview(msg) {
+  const el = document.querySelector(`#oppBattlefield .card[data-id="${CSS.escape(msg.card_id)}"]`);
+  if (!el) return;
+  el.classList.add("dragPreview");
+  applyCardPos(el, msg);
+}
+
+// Patches only apply on top of the version they were built from; on a gap ask for a full snapshot.
+function applyPatch(msg) {
+  if (state && msg.version <= state.version) return;  // already covered by a newer snapshot
+  if (!state || msg.base !== state.version) {
+    wsSend({ kind: "resync" });
+    return;
+  }
+  Object.assign(state, msg.room);
+  Object.assign(state.defs, msg.defs);
+  for (const [cid, card] of Object.entries(msg.cards)) {
+    if (card) state.cards[cid] = card; else delete state.cards[cid];
+  }
+  for (const [pid, fields] of Object.entries(msg.players)) {
+    Object.assign(state.players[pid], fields);
+  }
+  state.version = msg.version;
+  render();
+}
+
+// ---- drag previews: at most one per animation frame while dragging over my battlefield
+let dragging = null, dragFrame = 0;
+function sendDragPreview(e) {
+  if (!dragging || dragFrame || !ws || ws.readyState !== 1 || me.spectator) return;
+  const zone = e.target.closest && e.target.closest('#myBattlefield');
+  if (!zone) return;
+  const rect = zone.getBoundingClientRect();
+  const x = Math.round(e.clientX - rect.left), y = Math.round(e.clientY - rect.top);
+  dragFrame = requestAnimationFrame(() => {
+    dragFrame = 0;
+    if (dragging) wsSend({ kind: "drag", card_id: dragging, x, y, z: 999999 });
+  });
+}
+document.addEventListener("dragover", sendDragPreview);
+document.addEventListener("dragend", () => { dragging = null; });
+
 // ---- actions
 function sendAction(type, payload) {
-  if (!ws || ws.readyState !== 1) return;
-  ws.send(JSON.stringify({ kind: "action", type, payload }));
+  if (!ws || ws.readyState !== 1 || me.spectator) return;
+  wsSend({ kind: "action", type, payload });
+}
+
+// Placeholder id the server sends in zone lists for cards hidden from this seat.
+const HIDDEN = "?";
+
+// A card as the UI sees it: its shared definition (name, image, ...) plus per-copy state.
+function cardOf(cid) {
+  const c = state.cards[cid];
+  if (!c) return c;
+  const d = c.def_id ? state.defs[c.def_id] : null;
+  return d ? Object.assign({}, d, c, { name: c.name || d.name }) : c;
 }
 
 // Make image URLs robust to backslashes and stray prefixes.
-function imgUrlFor(card) {
+// size: "thumb" (zone piles), "bf" (cards on the table) or omitted for the full image.
+function imgUrlFor(card, size) {
   if (!card || !card.image) return null;
   let p = String(card.image).replace(/\\/g, "/");
   const i = p.toLowerCase().lastIndexOf("images/");
   if (i >= 0) p = p.slice(i);            // keep from "images/..."
   if (!p.startsWith("/")) p = "/" + p;   // ensure absolute
-  return p;
+  return size ? `${p}?size=${size}` : p;
 }
 
 function makeCardEl(cid, ownerPid) {
-  const c = state.cards[cid];
+  const c = cardOf(cid);
   const el = document.createElement("div");
   el.className = "card";
+  // Cards this seat may not see arrive as HIDDEN placeholders with no card entry
+  if (cid === HIDDEN || !c) {
+    el.classList.add("faceDown");
+    return el;
+  }
   // token styling: token_kind is 'creature' or 'chip'
   if (c.is_token) {
     el.classList.add("token", c.token_kind);
@@ -126,7 +282,7 @@ function makeCardEl(cid, ownerPid) {
 
   const url = imgUrlFor(c);
   if (url) {
-    el.style.backgroundImage = `url("${url}")`;
+    el.style.backgroundImage = `url("${imgUrlFor(c, "bf")}")`;
     el.classList.add("hasImage");
     el.ondblclick = () => showZoom(url);
     el.addEventListener("wheel", e => { e.preventDefault(); showZoom(url); });
@@ -137,6 +293,7 @@ function makeCardEl(cid, ownerPid) {
   el.draggable = true;
   el.addEventListener("dragstart", e => {
     e.dataTransfer.setData("text/plain", JSON.stringify({ card_id: cid, owner: ownerPid }));
+    dragging = cid;
   });
   // for chip tokens, reposition on drag end
   if (c.is_token && c.token_kind === 'chip') {
@@ -187,7 +344,7 @@ function makeCardEl(cid, ownerPid) {
 
 // Create a non-draggable display-only version of a card element
 function makeDisplayCardEl(cid) {
-  const c = state.cards[cid];
+  const c = cardOf(cid);
   const el = document.createElement("div");
   el.className = "card displayOnly";
   // token styling: token_kind is 'creature' or 'chip'
@@ -205,7 +362,7 @@ function makeDisplayCardEl(cid) {
 
   const url = imgUrlFor(c);
   if (url) {
-    el.style.backgroundImage = `url("${url}")`;
+    el.style.backgroundImage = `url("${imgUrlFor(c, "bf")}")`;
     el.classList.add("hasImage");
     el.ondblclick = () => showZoom(url);
     el.addEventListener("wheel", e => { e.preventDefault(); showZoom(url); });
@@ -260,8 +417,8 @@ function zoneThumb(el, ids, _label, {showBack=false, clickable=false} = {}) {
     el.style.backgroundSize = "cover";
     el.style.backgroundPosition = "center";
   } else if (ids.length) {
-    const last = state.cards[ids[ids.length - 1]];
-    const u = imgUrlFor(last);
+    const last = cardOf(ids[ids.length - 1]);
+    const u = imgUrlFor(last, "thumb");
     if (u) {
       el.style.backgroundImage = `url("${u}")`;
       el.style.backgroundSize = "cover";
@@ -370,7 +527,7 @@ function render() {
   const tray = document.getElementById('myTokenTray');
   clearZone(tray);
   state.players[me.id].token_tray.forEach(cid => {
-    const tok = state.cards[cid];
+    const tok = cardOf(cid);
     const el = document.createElement('div');
     el.className = 'card token chip';
     // add content label
@@ -429,7 +586,7 @@ function setupDnD() {
           const py = e.clientY - rect.top;
           let anchor = null, bestD = Infinity;
           const radius = 36;
-          const name = (window.state && window.state.cards && window.state.cards[data.card_id] && window.state.cards[data.card_id].name) || '';
+          const name = (state && state.cards[data.card_id] && cardOf(data.card_id).name) || '';
 
           for (const c of cards) {
             // Skip if it's the same card being moved within BF before DOM updates
@@ -484,6 +641,8 @@ function wireButtons() {
     sendAction("set_phase", { phase: next });
   };
   by('pass').onclick     = () => sendAction("pass_turn", {});
+  by('undo').onclick     = () => sendAction("undo", {});
+  by('redo').onclick     = () => sendAction("redo", {});
   by('shuffle').onclick  = () => {
     sendAction("shuffle_library", { player_id: me.id });
     const lib = $("#myLibrary"); lib.classList.add("shuffled");
@@ -0,0 +1,89 @@
+// Minimal MessagePack codec for the table protocol (maps, arrays, strings, numbers, bools, nil).
+(() => {
+  const te = new TextEncoder(), td = new TextDecoder();
+
+  function decode(buf) {
+    const bytes = new Uint8Array(buf);
+    const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+    let pos = 0;
+    const str = n => { const s = td.decode(bytes.subarray(pos, pos + n)); pos += n; return s; };
+    const arr = n => { const a = new Array(n); for (let i = 0; i < n; i++) a[i] = read(); return a; };
+    const map = n => { const o = {}; for (let i = 0; i < n; i++) { const k = read(); o[k] = read(); } return o; };
+    function read() {
+      const t = bytes[pos++];
+      if (t < 0x80) return t;
+      if (t < 0x90) return map(t & 0x0f);
+      if (t < 0xa0) return arr(t & 0x0f);
+      if (t < 0xc0) return str(t & 0x1f);
+      if (t >= 0xe0) return t - 0x100;
+      let v;
+      switch (t) {
+        case 0xc0: return null;
+        case 0xc2: return false;
+        case 0xc3: return true;
+        case 0xc4: v = bytes[pos]; pos += 1; pos += v; return bytes.slice(pos - v, pos);
+        case 0xc5: v = view.getUint16(pos); pos += 2; pos += v; return bytes.slice(pos - v, pos);
+        case 0xc6: v = view.getUint32(pos); pos += 4; pos += v; return bytes.slice(pos - v, pos);
+        case 0xca: v = view.getFloat32(pos); pos += 4; return v;
+        case 0xcb: v = view.getFloat64(pos); pos += 8; return v;
+        case 0xcc: return bytes[pos++];
+        case 0xcd: v = view.getUint16(pos); pos += 2; return v;
+        case 0xce: v = view.getUint32(pos); pos += 4; return v;
+        case 0xcf: v = Number(view.getBigUint64(pos)); pos += 8; return v;
+        case 0xd0: v = view.getInt8(pos); pos += 1; return v;
+        case 0xd1: v = view.getInt16(pos); pos += 2; return v;
+        case 0xd2: v = view.getInt32(pos); pos += 4; return v;
+        case 0xd3: v = Number(view.getBigInt64(pos)); pos += 8; return v;
+        case 0xd9: v = bytes[pos]; pos += 1; return str(v);
+        case 0xda: v = view.getUint16(pos); pos += 2; return str(v);
+        case 0xdb: v = view.getUint32(pos); pos += 4; return str(v);
+        case 0xdc: v = view.getUint16(pos); pos += 2; return arr(v);
+        case 0xdd: v = view.getUint32(pos); pos += 4; return arr(v);
+        case 0xde: v = view.getUint16(pos); pos += 2; return map(v);
+        case 0xdf: v = view.getUint32(pos); pos += 4; return map(v);
+      }
+      throw new Error("msgpack: unsupported type 0x" + t.toString(16));
+    }
+    return read();
+  }
+
+  function encode(value) {
+    const out = [];
+    const u8 = b => out.push(b & 0xff);
+    const u16 = n => { u8(n >> 8); u8(n); };
+    const u32 = n => { u8(n >>> 24); u8(n >>> 16); u8(n >>> 8); u8(n); };
+    function write(v) {
+      if (v === null || v === undefined) return u8(0xc0);
+      if (v === true) return u8(0xc3);
+      if (v === false) return u8(0xc2);
+      if (typeof v === "number") {
+        if (Number.isInteger(v) && v >= -0x80000000 && v <= 0xffffffff) {
+          if (v >= 0 && v < 0x80) return u8(v);
+          if (v < 0 && v >= -32) return u8(v);
+          if (v >= 0) { u8(0xce); return u32(v); }
+          u8(0xd2); return u32(v);
+        }
+        const b = new Uint8Array(new Float64Array([v]).buffer).reverse();
+        u8(0xcb); b.forEach(u8); return;
+      }
+      if (typeof v === "string") {
+        const b = te.encode(v);
+        if (b.length < 32) u8(0xa0 | b.length);
+        else if (b.length < 0x10000) { u8(0xda); u16(b.length); }
+        else { u8(0xdb); u32(b.length); }
+        b.forEach(u8); return;
+      }
+      if (Array.isArray(v)) {
+        if (v.length < 16) u8(0x90 | v.length); else { u8(0xdd); u32(v.length); }
+        v.forEach(write); return;
+      }
+      const keys = Object.keys(v).filter(k => v[k] !== undefined);
+      if (keys.length < 16) u8(0x80 | keys.length); else { u8(0xdf); u32(keys.length); }
+      keys.forEach(k => { write(k); write(v[k]); });
+    }
+    write(value);
+    return new Uint8Array(out);
+  }
+
+  window.MsgPack = { encode, decode };
+})();
@@ -1,9 +1,12 @@
-import json, os, re, time, hashlib
+import json, os, re, threading, time, hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from urllib.parse import quote_plus
 import requests
 from tqdm import tqdm
 
+from card_index import CardIndex, normalize
+
 # 1) List your deck URLs here (Archidekt, Moxfield, Deckstats, Goldfish, etc.). WARNING: it includes sideboard cards.
 DECK_URLS = [
     #"https://www.mtggoldfish.com/deck/7287036#paper",
@@ -31,36 +34,158 @@ OUT_DIR.mkdir(parents=True, exist_ok=True)
 IMG_DIR.mkdir(parents=True, exist_ok=True)
 
 # 3) Scryfall helpers
-SCRYFALL_SEARCH = "https://api.scryfall.com/cards/search?q="  # fulltext search
+# Base URL of the API; point it at a local stand-in for testing
+SCRYFALL_API = os.environ.get("SCRYFALL_API", "https://api.scryfall.com")
+SCRYFALL_SEARCH = f"{SCRYFALL_API}/cards/search?q="  # fulltext search
 # Prefer 'png' or 'large' image; 'normal' is smaller. Use 'png' if you want transparent crops on DFCs.
 PREFERRED_IMAGE_KEYS = ["normal","large","png"]
 
-# polite rate limit to avoid hammering Scryfall
-LAST_REQ = 0.0
-MIN_GAP = 0.2  # ~1/MIN_GAP req/s max; 
+# Scryfall asks for no more than ~10 requests/s; every thread shares one bucket
+RATE = 10       # requests per second
+BURST = 10      # requests allowed back to back after a quiet spell
+WORKERS = 8     # concurrent lookups / image downloads
+RETRIES = 4     # extra attempts on 429, 5xx and connection errors
+BATCH = 75      # identifiers per /cards/collection request (Scryfall's maximum)
+
+class TokenBucket:
+    """Thread-safe token bucket: take() blocks until a request may go out."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+                self.stamp = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
 
-def polite_get(url, **kw):
-    global LAST_REQ
-    wait = MIN_GAP - (time.time() - LAST_REQ)
-    if wait > 0:
-        time.sleep(wait)
-    r = requests.get(url, timeout=20, **kw)
-    LAST_REQ = time.time()
-    r.raise_for_status()
-    return r
+LIMITER = TokenBucket(RATE, BURST)
+_local = threading.local()
+
+def _session() -> requests.Session:
+    # one keep-alive session per worker thread
+    if not hasattr(_local, "session"):
+        _local.session = requests.Session()
+    return _local.session
+
+def polite_get(url, method="GET", **kw):
+    """Rate-limited request with retries and exponential backoff; raises for 4xx and exhausted retries."""
+    for attempt in range(RETRIES + 1):
+        LIMITER.take()
+        try:
+            r = _session().request(method, url, timeout=20, **kw)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == RETRIES:
+                raise
+            time.sleep(0.5 * 2 ** attempt)
+            continue
+        if (r.status_code == 429 or r.status_code >= 500) and attempt < RETRIES:
+            retry_after = r.headers.get("Retry-After", "")
+            time.sleep(float(retry_after) if retry_after.isdigit() else 0.5 * 2 ** attempt)
+            continue
+        r.raise_for_status()
+        return r
 
 def slugify(name: str) -> str:
     return re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-")
 
+_INDEX = None
+
+def card_index() -> CardIndex:
+    """The local card index every lookup checks first (opened on first use)."""
+    global _INDEX
+    if _INDEX is None:
+        _INDEX = CardIndex()
+    return _INDEX
+
 def scryfall_find_card(name: str):
-    exact_url = f"https://api.scryfall.com/cards/named?exact={quote_plus(name)}"
-    r = polite_get(exact_url)
-    if r.status_code == 200:
-        return r.json()
+    index = card_index()
+    hit = index.get(name)
+    if hit is None and index.complete:
+        # the index holds every card, so a miss is a misspelling: match it locally
+        hit = index.fuzzy(name)
+    if hit is not None:
+        return hit
+    try:
+        card_json = _remote_find_card(name)
+    except requests.RequestException:
+        # offline (or not found): the closest card we already know beats nothing
+        hit = index.fuzzy(name)
+        if hit is None:
+            raise
+        return hit
+    index.put(card_json)
+    return card_json
+
+def _remote_find_card(name: str):
+    exact_url = f"{SCRYFALL_API}/cards/named?exact={quote_plus(name)}"
+    try:
+        return polite_get(exact_url).json()
+    except requests.HTTPError as e:
+        if e.response is None or e.response.status_code != 404:
+            raise
     # fallback to fuzzy
-    fuzzy_url = f"https://api.scryfall.com/cards/named?fuzzy={quote_plus(name)}"
+    fuzzy_url = f"{SCRYFALL_API}/cards/named?fuzzy={quote_plus(name)}"
     return polite_get(fuzzy_url).json()
 
+def scryfall_collection(names: list[str]) -> dict[str, dict]:
+    """Look names up BATCH at a time via /cards/collection; returns normalized name -> card JSON.
+
+    Names Scryfall could not match exactly are missing from the result.
+    """
+    found = {}
+    for i in range(0, len(names), BATCH):
+        chunk = names[i:i + BATCH]
+        r = polite_get(f"{SCRYFALL_API}/cards/collection", method="POST",
+                       json={"identifiers": [{"name": n} for n in chunk]})
+        for card_json in r.json().get("data", []):
+            card_index().put(card_json)
+            # a double-faced card comes back as "Front // Back"; the deck may name either
+            faces = card_json.get("card_faces") or []
+            for n in [card_json.get("name", "")] + [f.get("name", "") for f in faces]:
+                found.setdefault(normalize(n), card_json)
+    return found
+
+def resolve_cards(names: list[str]) -> dict[str, dict]:
+    """Card JSON for every name: local index, then batched lookups, then exact/fuzzy search for the rest."""
+    index = card_index()
+    result = {}
+    for n in names:
+        hit = index.get(n)
+        if hit is not None:
+            result[n] = hit
+    missing = [n for n in names if n not in result]
+    if missing:
+        try:
+            found = scryfall_collection(missing)
+        except requests.RequestException as e:
+            print(f"  Batch lookup failed ({e}); trying one by one")
+            found = {}
+        result.update((n, found[normalize(n)]) for n in missing if normalize(n) in found)
+        missing = [n for n in missing if n not in result]
+    with ThreadPoolExecutor(WORKERS) as pool:
+        for name, card_json in zip(missing, pool.map(_find_or_none, missing)):
+            if card_json is not None:
+                result[name] = card_json
+    return result
+
+def _find_or_none(name: str):
+    try:
+        return scryfall_find_card(name)
+    except requests.RequestException as e:
+        print(f"  Could not resolve {name!r}: {e}")
+        return None
+
 def pick_image_uri(card_json: dict) -> str | None:
     # Single-faced
     if "image_uris" in card_json:
@@ -100,10 +225,21 @@ def download_image(card_json: dict, info: dict) -> str:
     fpath = IMG_DIR / fname
     if not fpath.exists():
         img = polite_get(info["url"]).content
-        with open(fpath, "wb") as f:
+        tmp = fpath.with_suffix(fpath.suffix + ".part")
+        with open(tmp, "wb") as f:
             f.write(img)
+        os.replace(tmp, fpath)
+        _make_variants(fpath)
     return str(fpath)
 
+def _make_variants(fpath: Path):
+    # Pre-build the small sizes the table asks for (needs Pillow; the server can also do it lazily)
+    try:
+        from server.images import make_variants
+        make_variants(fpath)
+    except Exception:
+        pass
+
 def parse_deck_any(url_or_text: str):
     import mtg_parser as mp
     cards_iter = mp.parse_deck(url_or_text)  # generator of Card objects
@@ -125,33 +261,64 @@ def parse_deck_any(url_or_text: str):
     return [{"name": n, "qty": q} for n, q in sorted(counts.items())]
 
 
-def fetch_and_save_deck(url: str, deck_name: str = None):
+def fetch_and_save_deck(url: str, deck_name: str = None, progress=None, overwrite: bool = True):
+    """Resolve, download and save one deck. progress(done, total) is called as images arrive.
+
+    With overwrite=False an existing deck of the same name raises FileExistsError instead.
+    """
+    if not deck_name:
+        deck_name = slugify(url.split("/")[-1] or "deck")
+    out_path = OUT_DIR / f"{deck_name}.json"
+    if not overwrite and out_path.exists():
+        raise FileExistsError(out_path)
 
     print(f"\nProcessing deck: {url}")
     cards = parse_deck_any(url)
     print(f"  Found {sum(c['qty'] for c in cards)} cards, {len(cards)} unique names")
 
-    # Resolve images once per unique name
+    # Resolve every unique name in a few batched lookups, then fetch images concurrently
+    found = resolve_cards([c["name"] for c in cards])
+    images = {}
+    with ThreadPoolExecutor(WORKERS) as pool, tqdm(total=len(cards), desc="Downloading images") as bar:
+        futures = {}
+        for c in cards:
+            card_json = found.get(c["name"])
+            info = pick_image_info(card_json) if card_json else None
+            if info:
+                futures[pool.submit(download_image, card_json, info)] = c["name"]
+        bar.update(len(cards) - len(futures))
+        for fut in as_completed(futures):
+            try:
+                images[futures[fut]] = fut.result()
+            except requests.RequestException as e:
+                print(f"  Image for {futures[fut]!r} failed: {e}")
+            bar.update(1)
+            if progress:
+                progress(bar.n, len(cards))
+
     resolved = []
-    for c in tqdm(cards, desc="Resolving images"):
-        card_json = scryfall_find_card(c["name"])
-        info = pick_image_info(card_json)
-        local_img = download_image(card_json, info) if info else None
+    for c in cards:
+        card_json = found.get(c["name"], {})
         resolved.append({
             "name": c["name"],
             "qty": c["qty"],
-            "image": local_img,
+            "image": images.get(c["name"]),
             "scryfall_id": card_json.get("id"),
             "set": card_json.get("set"),
             "collector_number": card_json.get("collector_number")
         })
 
     # Save deck JSON alongside a manifest of images
-    if not deck_name:
-        deck_name = slugify(url.split("/")[-1] or "deck")
-    out_path = OUT_DIR / f"{deck_name}.json"
-    with open(out_path, "w", encoding="utf-8") as f:
+    tmp_path = out_path.with_suffix(".json.part")  # the server lists *.json; only show finished decks
+    with open(tmp_path, "w", encoding="utf-8") as f:
         json.dump({"source": url, "cards": resolved}, f, ensure_ascii=False, indent=2)
+    if overwrite:
+        os.replace(tmp_path, out_path)
+    else:
+        try:
+            os.link(tmp_path, out_path)  # unlike replace, fails if a deck of that name appeared meanwhile
+        finally:
+            os.unlink(tmp_path)
     print(f"  Saved deck JSON -> {out_path}")
     return out_path
 
@@ -1,18 +1,28 @@
 # server/app.py
-import json
+import asyncio, hashlib
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Dict
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response
 from fastapi.staticfiles import StaticFiles
 
-from .models import ClientHello, ClientAction, ServerState
-from .state import new_room, apply_action
-from .persistence import save_room, load_room, load_deck
+from . import config, images, metrics
+from .host import RoomHost
+from .imports import DeckExists, ImportJobs, deck_slug
+from .models import DeckImport
+from .sharding import make_broker
 
-app = FastAPI(title="CardGameRoom")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    sweeper = asyncio.create_task(host.sweep())
+    yield
+    sweeper.cancel()
+    imports.shutdown()
+    await host.writer.flush()
+
+app = FastAPI(title="CardGameRoom", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -33,28 +43,12 @@ def _find_client_dir() -> Path:
 CLIENT = _find_client_dir()
 app.mount("/static", StaticFiles(directory=CLIENT), name="static")
 
-# Serve card images saved under server/data/images as /images/...
-IMG_DIR = ROOT / "server" / "data" / "images"
-if IMG_DIR.exists():
-    app.mount("/images", StaticFiles(directory=IMG_DIR), name="images")
-
-rooms: Dict[str, Dict[str, object]] = {}
 
-def _model_dump(m):
-    return m.model_dump() if hasattr(m, "model_dump") else m.dict()
-
-async def _broadcast(room_id: str):
-    if room_id not in rooms:
-        return
-    payload = _model_dump(ServerState(kind="state", state=rooms[room_id]["state"]))
-    for peer in list(rooms[room_id]["peers"]):
-        try:
-            await peer.send_json(payload)
-        except Exception:
-            try:
-                rooms[room_id]["peers"].discard(peer)  # type: ignore[arg-type]
-            except Exception:
-                pass
+# Rooms live either here or, in sharded mode, in the worker that owns them
+host = RoomHost()
+rooms = host.rooms
+broker = make_broker() if config.SHARDS else None
+imports = ImportJobs()
 
 @app.get("/")
 async def index():
@@ -66,100 +60,73 @@ async def list_decks():
     decks = [p.stem for p in decks_dir.glob("*.json")] if decks_dir.exists() else []
     return {"decks": decks}
 
+# Card images saved under server/data/images, as /images/<file>?size=thumb|bf|zoom
+@app.get("/images/{path:path}")
+async def card_image(path: str, size: str | None = None):
+    f = await asyncio.to_thread(images.image_file, path, size)
+    if f is None:
+        raise HTTPException(status_code=404)
+    return FileResponse(f, headers={"Cache-Control": "public, max-age=604800"})
+
+@app.post("/api/decks/import")
+async def import_deck(req: DeckImport):
+    if not deck_slug(req.name):
+        raise HTTPException(status_code=422, detail="Deck name needs letters or digits")
+    try:
+        job = imports.submit(req.name, req.text)
+    except DeckExists as e:
+        raise HTTPException(status_code=409, detail=f"A deck named {e} already exists") from None
+    return {"ok": True, "job": job.as_dict()}
+
+@app.get("/api/decks/import/{job_id}")
+async def import_status(job_id: str):
+    job = imports.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="No such import job")
+    return job.as_dict()
+
+async def _room_call(room_id: str, op: str) -> dict:
+    if broker:
+        return await broker.call(room_id, op)
+    return await getattr(host, op)(room_id)
+
 @app.post("/api/save/{room_id}")
 async def http_save(room_id: str):
-    ctx = rooms.get(room_id)
-    if not ctx:
-        return {"ok": False, "msg": "Room not found"}
-    save_room(ctx["state"])  # type: ignore[arg-type]
-    return {"ok": True}
+    return await _room_call(room_id, "save")
 
 @app.post("/api/load/{room_id}")
 async def http_load(room_id: str):
-    st = load_room(room_id)
-    if not st:
-        return {"ok": False, "msg": "No saved state"}
-    rooms[room_id] = {"state": st, "peers": set()}
-    await _broadcast(room_id)
-    return {"ok": True}
+    return await _room_call(room_id, "load")
+
+@app.get("/api/state/{room_id}")
+async def http_state(room_id: str, request: Request):
+    result = await _room_call(room_id, "state")
+    if not result["ok"]:
+        return JSONResponse(result, status_code=404)
+    # the version alone can repeat: a room reloaded from an older snapshot counts up again
+    digest = hashlib.blake2b(result["snapshot"].encode("utf-8"), digest_size=8).hexdigest()
+    etag = f'"{result["version"]}-{digest}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(result["snapshot"], media_type="application/json", headers={"ETag": etag})
+
+@app.get("/metrics")
+async def http_metrics():
+    """Prometheus scrape target; in sharded mode each worker's samples carry a shard label."""
+    families = (await host.scrape())["metrics"]
+    if broker:
+        for shard in range(config.SHARDS):
+            try:
+                result = await broker.call("", "scrape", shard)
+            except OSError:
+                continue  # a worker that is down just has no samples this time
+            families += metrics.relabel(result["metrics"], shard=str(shard))
+    return PlainTextResponse(metrics.render(families), media_type="text/plain; version=0.0.4")
 
 @app.websocket("/ws/{room_id}")
 async def ws_room(ws: WebSocket, room_id: str):
     await ws.accept()
-    try:
-        # First message must be the hello payload
-        hello = ClientHello(**json.loads(await ws.receive_text()))
-
-        ctx = rooms.get(room_id)
-        if ctx is None:
-            # First joiner: only load a deck for the seat that joined (no placeholders)
-            deckA = load_deck(hello.deck) if (hello.player_id == "A" and hello.deck) else None
-            deckB = load_deck(hello.deck) if (hello.player_id == "B" and hello.deck) else None
-            st = new_room(room_id, deckA, deckB)
-            if hello.name:
-                st.players[hello.player_id].name = hello.name
-            ctx = rooms[room_id] = {"state": st, "peers": set()}
-        else:
-            # Later joiners: if they provide a deck, replace their zones with the real deck
-            if hello.deck:
-                st = ctx["state"]  # type: ignore[assignment]
-                pl = st.players[hello.player_id]
-                deck = load_deck(hello.deck)
-
-                # Clear player zones
-                pl.library = []
-                pl.hand = []
-                pl.battlefield = []
-                pl.graveyard = []
-                pl.exile = []
-
-                # Fill their library with new CardInstances and shuffle
-                from .state import _mk_card
-                for d in deck:
-                    c = _mk_card(d)
-                    st.cards[c.id] = c
-                    pl.library.append(c.id)
-
-                import random
-                random.shuffle(pl.library)
-
-            if hello.name:
-                try:
-                    ctx["state"].players[hello.player_id].name = hello.name  # type: ignore[index]
-                except Exception:
-                    pass
-
-        # Register, send current state, then serve the loop
-        ctx["peers"].add(ws)  # type: ignore[index]
-        await ws.send_json(_model_dump(ServerState(kind="state", state=ctx["state"])))
-
-        async def _broadcast(room_id: str):
-            data = _model_dump(ServerState(kind="state", state=rooms[room_id]["state"]))  # type: ignore[index]
-            dead = []
-            for peer in list(rooms[room_id]["peers"]):  # type: ignore[index]
-                try:
-                    await peer.send_json(data)
-                except Exception:
-                    dead.append(peer)
-            for d in dead:
-                try:
-                    rooms[room_id]["peers"].discard(d)  # type: ignore[index]
-                except Exception:
-                    pass
-
-        while True:
-            raw = await ws.receive_text()
-            act = ClientAction(**json.loads(raw))
-            apply_action(ctx["state"], act.type, act.payload)  # type: ignore[index]
-            await _broadcast(room_id)
-
-    except WebSocketDisconnect:
-        pass
-    except Exception:
-        pass
-    finally:
-        try:
-            rooms.get(room_id, {}).get("peers", set()).discard(ws)  # type: ignore[union-attr]
-        except Exception:
-            pass
-
+    if broker:
+        await broker.relay(ws, room_id)
+    else:
+        await host.serve(ws, room_id)
@@ -0,0 +1,191 @@
+"""Microbenchmarks for the state engine.
+
+Times new_room, _mk_card, every action type, serialization (full dumps,
+per-seat projections, patches), load_deck and save_room/load_room on
+generated boards from a fresh 40-card game to a 300-token board with full
+libraries. Each case reports the best per-call time over several repeats and
+the memory it allocates (tracemalloc peak of one call).
+
+    python -m server.bench                         # all boards
+    python -m server.bench --board extreme --filter move
+    python -m server.bench --save bench.json       # record a baseline
+    python -m server.bench --compare bench.json --threshold 25   # exit 1 on regressions
+"""
+import argparse, json, sys, tempfile, timeit, tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Tuple
+
+from . import config, persistence
+from .models import ServerState
+from .projection import project_patch, project_state
+from .state import Changes, _mk_card, apply_action, build_patch, new_room
+
+def _deck(n: int, tag: str) -> List[dict]:
+    # about a third of a real deck is basic lands: many copies of few definitions
+    return [{"name": f"{tag} Land {i % 3}" if i % 3 == 0 else f"{tag} Spell {i}",
+             "image": f"images/{tag}-{i}.jpg", "scryfall_id": f"{tag}{i}", "set": "bch",
+             "collector_number": str(i)} for i in range(n)]
+
+def _board(deck_size: int, battlefield: int, tokens: int, graveyard: int):
+    s = new_room("BENCH", _deck(deck_size, "a"), _deck(deck_size, "b"))
+    for pid in ("A", "B"):
+        pl = s.players[pid]
+        for _ in range(battlefield):
+            apply_action(s, "draw", {"player_id": pid})
+            apply_action(s, "move", {"player_id": pid, "card_id": pl.hand[-1], "to": "battlefield"})
+        for _ in range(graveyard):
+            apply_action(s, "draw", {"player_id": pid})
+            apply_action(s, "move", {"player_id": pid, "card_id": pl.hand[-1], "to": "graveyard"})
+        for i in range(tokens):
+            apply_action(s, "create_token", {"player_id": pid, "name": f"Token {i}", "creature": i % 2 == 0})
+    return s
+
+# name -> (deck size, cards on battlefield, tokens, graveyard) per seat
+BOARDS = {
+    "small": (40, 0, 0, 0),          # opening hands, nothing played
+    "midgame": (60, 12, 4, 10),
+    "extreme": (100, 20, 300, 40),   # token swarm with full libraries
+}
+
+def _pairs(s) -> Dict[str, Callable[[], None]]:
+    """One callable per action type. Actions that would exhaust or reshape the board are
+    paired with their inverse so every repeat sees the same state; the time is per pair."""
+    a = s.players["A"]
+    card = a.battlefield[0] if len(a.battlefield) else a.hand[0]
+    hand_card = a.hand[0]
+    token = next((cid for cid in a.battlefield if s.cards[cid].is_token), None)
+    deck = _deck(len(a.library) + len(a.hand) + len(a.battlefield), "a")
+    spare = s.model_copy(deep=True)  # seat_deck rebuilds the seat, so it gets its own board
+
+    def act(t, p):
+        apply_action(s, t, p)
+
+    cases = {
+        "draw+put_on_bottom": lambda: (act("draw", {"player_id": "A"}),
+                                       act("put_on_bottom", {"player_id": "A", "card_id": a.hand[-1]})),
+        "move x2": lambda: (act("move", {"player_id": "A", "card_id": hand_card, "to": "graveyard"}),
+                            act("move", {"player_id": "A", "card_id": hand_card, "to": "hand"})),
+        "tap_toggle": lambda: act("tap_toggle", {"card_id": card}),
+        "life": lambda: act("life", {"player_id": "A", "delta": 1}),
+        "wins": lambda: act("wins", {"player_id": "A", "delta": 1}),
+        "pass_turn": lambda: act("pass_turn", {}),
+        "set_phase": lambda: act("set_phase", {"phase": "Combat"}),
+        "shuffle_library": lambda: act("shuffle_library", {"player_id": "A"}),
+        "mulligan": lambda: act("mulligan", {"player_id": "A", "n": 7}),
+        "swap_zone_with_hand x2": lambda: (act("swap_zone_with_hand", {"player_id": "A", "zone": "graveyard"}),
+                                           act("swap_zone_with_hand", {"player_id": "A", "zone": "graveyard"})),
+        "swap_opponent_zone_with_hand x2": lambda: (
+            act("swap_opponent_zone_with_hand", {"player_id": "A", "zone": "exile"}),
+            act("swap_opponent_zone_with_hand", {"player_id": "A", "zone": "exile"})),
+        "set_card_pos": lambda: act("set_card_pos", {"card_id": card, "x": 10, "y": 20}),
+        "create_token+remove_token": lambda: (act("create_token", {"player_id": "B", "name": "Bench"}),
+                                              act("remove_token", {"card_id": s.players["B"].battlefield[-1]})),
+        "toggle_show_hand": lambda: act("toggle_show_hand", {"player_id": "A"}),
+        "set_name": lambda: act("set_name", {"player_id": "A", "name": "Bench"}),
+        "toggle_show_top": lambda: act("toggle_show_top", {"player_id": "A"}),
+        "seat_deck": lambda: apply_action(spare, "seat_deck", {"player_id": "A", "deck": deck}),
+    }
+    if token is not None:
+        cases["update_token"] = lambda: act("update_token", {"card_id": token, "text": "+1/+1"})
+    # takes back whichever case ran last and puts it back again
+    cases["undo+redo"] = lambda: (act("undo", {}), act("redo", {}))
+    return {f"action {name}": fn for name, fn in cases.items()}
+
+def _cases(board: str, tmp: Path) -> Iterator[Tuple[str, Callable[[], None]]]:
+    size, battlefield, tokens, graveyard = BOARDS[board]
+    deck_a, deck_b = _deck(size, "a"), _deck(size, "b")
+    yield "new_room", lambda: new_room("NEW", deck_a, deck_b)
+    s = _board(size, battlefield, tokens, graveyard)
+    yield "_mk_card", lambda: _mk_card(s, deck_a[1])
+
+    yield "dump RoomState", lambda: s.model_dump_json()
+    yield "snapshot per seat", lambda: ServerState(kind="state", state=project_state(s, "A")).model_dump_json()
+    ch = Changes()
+    apply_action(s, "move", {"player_id": "A", "card_id": s.players["A"].hand[0], "to": "battlefield"}, ch)
+    yield "patch (one move)", lambda: build_patch(s, ch, s.version - 1).model_dump_json()
+    yield "patch per seat (one move)", lambda: project_patch(s, ch, s.version - 1, "B").model_dump_json()
+
+    (tmp / "bench.json").write_text(json.dumps({"cards": [{**c, "qty": 1} for c in deck_a]}))
+    yield "load_deck (cached)", lambda: persistence.load_deck("bench")
+    yield "load_deck (cold)", lambda: (persistence._DECKS.clear(), persistence.load_deck("bench"))
+    yield "save_room", lambda: persistence.save_room(s)
+    yield "load_room", lambda: persistence.load_room(s.room_id)
+
+    yield from _pairs(s).items()
+
+def measure(fn: Callable[[], None], repeat: int, min_time: float) -> dict:
+    timer = timeit.Timer(fn)
+    number = 1
+    while True:  # calibrate so one repeat takes at least min_time
+        t = timer.timeit(number)
+        if t >= min_time or number >= 1 << 20:
+            break
+        number *= 2 if t == 0 else max(2, min(10, int(min_time / t) + 1))
+    best = min([t] + timer.repeat(repeat - 1, number)) / number
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"us": round(best * 1e6, 2), "alloc_kb": round(peak / 1024, 1)}
+
+def run(boards: List[str], pattern: str = "", repeat: int = 5, min_time: float = 0.05) -> Dict[str, dict]:
+    results = {}
+    saved = persistence.DECKS_DIR, persistence.ROOMS_DIR, config.ROOMS_DIR, persistence._STORE
+    with tempfile.TemporaryDirectory(prefix="cgr-bench-") as tmp:
+        # decks and rooms written by the benchmarks stay out of server/data
+        persistence.DECKS_DIR = persistence.ROOMS_DIR = Path(tmp)
+        config.ROOMS_DIR = tmp
+        persistence._STORE = None
+        try:
+            for board in boards:
+                for name, fn in _cases(board, Path(tmp)):
+                    if pattern in name:
+                        results[f"{board}: {name}"] = measure(fn, repeat, min_time)
+        finally:
+            persistence.DECKS_DIR, persistence.ROOMS_DIR, config.ROOMS_DIR, persistence._STORE = saved
+            persistence._DECKS.clear()
+    return results
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float) -> List[str]:
+    """Print results next to the baseline; return the cases slower by more than threshold %."""
+    slower = []
+    print(f"{'case':<52}{'base us':>11}{'now us':>11}{'change':>9}{'alloc KB':>10}")
+    for name, r in results.items():
+        old = baseline.get(name)
+        if old is None:
+            print(f"{name:<52}{'-':>11}{r['us']:>11}{'new':>9}{r['alloc_kb']:>10}")
+            continue
+        change = (r["us"] - old["us"]) / old["us"] * 100 if old["us"] else 0.0
+        flag = " <-" if change > threshold else ""
+        print(f"{name:<52}{old['us']:>11}{r['us']:>11}{change:>+8.1f}%{r['alloc_kb']:>10}{flag}")
+        if change > threshold:
+            slower.append(name)
+    return slower
+
+def main(argv: List[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m server.bench", description=__doc__.split("\n\n")[0])
+    ap.add_argument("--board", choices=list(BOARDS), action="append", help="repeatable; default: all")
+    ap.add_argument("--filter", default="", help="only cases whose name contains this")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--min-time", type=float, default=0.05, help="seconds per repeat")
+    ap.add_argument("--save", metavar="FILE", help="write the results as a baseline")
+    ap.add_argument("--compare", metavar="FILE", help="compare against a saved baseline")
+    ap.add_argument("--threshold", type=float, default=20, help="%% slowdown that fails --compare")
+    args = ap.parse_args(argv)
+
+    results = run(args.board or list(BOARDS), args.filter, args.repeat, args.min_time)
+    if args.compare:
+        slower = compare(results, json.loads(Path(args.compare).read_text()), args.threshold)
+        if slower:
+            print(f"{len(slower)} case(s) slower than the baseline by more than {args.threshold}%")
+            return 1
+    else:
+        print(f"{'case':<52}{'us/call':>11}{'alloc KB':>10}")
+        for name, r in results.items():
+            print(f"{name:<52}{r['us']:>11}{r['alloc_kb']:>10}")
+    if args.save:
+        Path(args.save).write_text(json.dumps(results, indent=1) + "\n")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
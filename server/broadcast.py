@@ -0,0 +1,94 @@
+import asyncio, logging
+from typing import Callable, Iterable
+
+from . import config
+from .codec import Frame
+from .metrics import PEERS_DROPPED
+
+log = logging.getLogger(__name__)
+
+# Queued in place of a dropped backlog; the writer swaps it for a fresh snapshot
+RESYNC = object()
+
+class Peer:
+    """One websocket with its own bounded outbound queue and writer task.
+
+    Frames are encoded once by the caller and only enqueued here, so a slow
+    socket never delays the rest of the room. When the queue overflows the
+    backlog is merged into a single snapshot; a peer that keeps overflowing
+    is disconnected.
+
+    viewer is the seat whose redacted view this peer receives (None: public).
+    """
+
+    def __init__(self, ws, snapshot: Callable[[], Frame], encoding: str = "json",
+                 queue_size: int | None = None, max_overflows: int | None = None,
+                 viewer: str | None = None):
+        self.ws = ws
+        self.snapshot = snapshot
+        self.encoding = encoding
+        self.viewer = viewer
+        self.queue: asyncio.Queue = asyncio.Queue(queue_size or config.PEER_QUEUE_SIZE)
+        self.max_overflows = config.PEER_MAX_OVERFLOWS if max_overflows is None else max_overflows
+        self.overflows = 0
+        self.closed = False
+        self.task = asyncio.create_task(self._writer())
+
+    def push(self, frame) -> bool:
+        """Enqueue a Frame (or pre-encoded text); False means the peer was dropped."""
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            pass
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.overflows += 1
+        if self.overflows > self.max_overflows:
+            PEERS_DROPPED.inc("overflow")
+            self.close(code=1013)  # try again later
+            return False
+        self.queue.put_nowait(RESYNC)
+        return True
+
+    async def _writer(self):
+        try:
+            while True:
+                frame = await self.queue.get()
+                if frame is RESYNC:
+                    frame = self.snapshot()
+                if not isinstance(frame, Frame):
+                    await self.ws.send_text(frame)
+                elif self.encoding == "msgpack":
+                    await self.ws.send_bytes(frame.msgpack())
+                else:
+                    await self.ws.send_text(frame.json())
+                if self.queue.empty():
+                    self.overflows = 0
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # usually the client went away mid-send
+            PEERS_DROPPED.inc("send_failed")
+            log.debug("peer send failed: %r", e)
+            self.close()
+
+    def close(self, code: int = 1000):
+        if self.closed:
+            return
+        self.closed = True
+        self.task.cancel()
+        if code != 1000:
+            asyncio.ensure_future(self._close_ws(code))
+
+    async def _close_ws(self, code: int):
+        try:
+            await self.ws.close(code=code)
+        except Exception as e:
+            log.debug("closing peer with %d failed: %r", code, e)
+
+def fan_out(peers: Iterable[Peer], frame) -> list:
+    """Push one frame to every peer and return the ones that were dropped."""
+    return [peer for peer in list(peers) if not peer.push(frame)]
@@ -0,0 +1,54 @@
+"""Wire formats. JSON text frames are the default; clients may ask for
+MessagePack binary frames in their hello when the msgpack package is installed."""
+from pydantic import BaseModel
+
+from .metrics import FRAME_BYTES
+from .models import ClientMessage
+
+try:
+    import msgpack
+except ImportError:  # optional: clients asking for it get JSON instead
+    msgpack = None
+
+ENCODINGS = ("json", "msgpack") if msgpack else ("json",)
+
+class Frame:
+    """One outgoing message, encoded at most once per wire format however many peers get it."""
+    __slots__ = ("msg", "_json", "_msgpack")
+
+    def __init__(self, msg: BaseModel):
+        self.msg = msg
+        self._json = None
+        self._msgpack = None
+
+    def json(self) -> str:
+        if self._json is None:
+            self._json = self.msg.model_dump_json()
+            FRAME_BYTES.observe(len(self._json), "json")
+        return self._json
+
+    def msgpack(self) -> bytes:
+        if self._msgpack is None:
+            self._msgpack = msgpack.packb(self.msg.model_dump(mode="json"))
+            FRAME_BYTES.observe(len(self._msgpack), "msgpack")
+        return self._msgpack
+
+    def __len__(self):
+        return len(self.json())
+
+def negotiate(requested: str | None) -> str:
+    return requested if requested in ENCODINGS else "json"
+
+def decode(message: dict):
+    """Turn an ASGI websocket.receive message into a validated ClientMessage.
+
+    Raises ValueError (pydantic's ValidationError included) for anything
+    malformed and ConnectionError once the client has gone away.
+    """
+    if message.get("bytes") is not None:
+        if msgpack is None:
+            raise ValueError("binary frame but msgpack is not installed")
+        return ClientMessage.validate_python(msgpack.unpackb(message["bytes"]))
+    if message.get("text") is not None:
+        return ClientMessage.validate_json(message["text"])
+    raise ConnectionError("client went away")
@@ -0,0 +1,39 @@
+"""Server tunables, overridable through CGR_* environment variables."""
+import os, tempfile
+
+def _int(name: str, default: int) -> int:
+    return int(os.environ.get(name, default))
+
+def _str(name: str, default: str) -> str:
+    return os.environ.get(name, default)
+
+# Frames a peer may have waiting before it counts as lagging
+PEER_QUEUE_SIZE = _int("CGR_PEER_QUEUE_SIZE", 32)
+# Consecutive overflows (queue full, backlog replaced by one snapshot) before the peer is dropped
+PEER_MAX_OVERFLOWS = _int("CGR_PEER_MAX_OVERFLOWS", 3)
+# set_card_pos and drag previews for the same card within this window are merged into one broadcast
+POS_COALESCE_MS = _int("CGR_POS_COALESCE_MS", 50)
+# Logged actions between two compacting snapshots of a room
+SNAPSHOT_EVERY = _int("CGR_SNAPSHOT_EVERY", 200)
+# Room persistence backend: "file" (one snapshot + log per room) or "sqlite" (WAL database)
+ROOM_STORE = _str("CGR_ROOM_STORE", "file")
+# Where room snapshots and logs (or rooms.sqlite3) live; empty = server/data
+ROOMS_DIR = _str("CGR_ROOMS_DIR", "")
+# How long room writes are batched before the write-behind thread picks them up
+PERSIST_FLUSH_MS = _int("CGR_PERSIST_FLUSH_MS", 200)
+# Shard worker processes owning rooms (0 = rooms live in the web process itself)
+SHARDS = _int("CGR_SHARDS", 0)
+# Where shard workers put their Unix sockets and the room -> shard pin file
+SHARD_DIR = _str("CGR_SHARD_DIR", os.path.join(tempfile.gettempdir(), "cardgameroom-shards"))
+# Spectators get the public view at most this many times per second, one shared frame per tick
+SPECTATOR_FPS = _int("CGR_SPECTATOR_FPS", 4)
+# Rooms nobody is connected to are snapshotted and dropped from memory after this many seconds...
+ROOM_IDLE_S = _int("CGR_ROOM_IDLE_S", 900)
+# ...or sooner, least recently used first, while live rooms are estimated to exceed this budget
+ROOM_BUDGET_MB = _int("CGR_ROOM_BUDGET_MB", 256)
+# Worker threads running lobby deck imports (each one also fans out its own Scryfall requests)
+IMPORT_WORKERS = _int("CGR_IMPORT_WORKERS", 2)
+# Broadcasts a room remembers so a reconnecting player gets what they missed instead of a snapshot
+RESUME_BUFFER = _int("CGR_RESUME_BUFFER", 256)
+# Actions a room can take back with undo; a seat can only take back its own, latest first
+UNDO_DEPTH = _int("CGR_UNDO_DEPTH", 50)
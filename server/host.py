@@ -0,0 +1,244 @@
+import asyncio, logging, time
+from collections import OrderedDict
+from typing import Dict
+
+from starlette.websockets import WebSocketDisconnect
+
+from . import config, metrics
+from .codec import Frame, decode, negotiate
+from .models import ClientHello, ServerAck
+from .persistence import RoomJournal, WriteBehind, load_deck_async, load_room
+from .room import Room
+from .state import new_room
+
+log = logging.getLogger(__name__)
+
+# How a client leaving shows up, on a Starlette WebSocket or a shard's StreamConnection
+DISCONNECTS = (WebSocketDisconnect, ConnectionError, EOFError)
+
+# Rough live footprint of a room (measured with tracemalloc: ~1 KB per card with its zone and index entries)
+ROOM_BYTES = 4096
+CARD_BYTES = 1024
+
+def room_bytes(room: Room) -> int:
+    return ROOM_BYTES + CARD_BYTES * len(room.state.cards)
+
+class RoomHost:
+    """Owns a set of live rooms and serves the connections that play in them.
+
+    ws may be a Starlette WebSocket or anything with the same receive /
+    receive_text / send_text / send_bytes / close coroutines (see
+    sharding.StreamConnection).
+
+    Rooms nobody is connected to are evicted (snapshotted, then dropped) by
+    evict_idle(); the next join or load() restores them from that snapshot.
+    """
+
+    def __init__(self, writer: WriteBehind | None = None):
+        self.rooms: Dict[str, Room] = {}
+        # Rooms handed to another host; connections for them are turned away until readmit()
+        self.released: set = set()
+        # Room journals queue their writes here; a worker thread does the disk I/O
+        self.writer = writer or WriteBehind()
+        # Rooms without connections, least recently used first: room_id -> when it went idle
+        self.idle: "OrderedDict[str, float]" = OrderedDict()
+
+    def _open_room(self, st) -> Room:
+        """Register a live room whose actions are journaled on top of a fresh snapshot."""
+        journal = RoomJournal(st.room_id, self.writer)
+        journal.start(st)
+        room = self.rooms[st.room_id] = Room(st, journal)
+        self.evict_idle()  # make room for it if the budget is now exceeded
+        return room
+
+    def _evict(self, room_id: str):
+        """Snapshot a room and drop it from memory; it comes back from the store on demand."""
+        self.idle.pop(room_id, None)
+        room = self.rooms.pop(room_id, None)
+        if room:
+            room.close()
+            room.journal.start(room.state)
+            metrics.ROOMS_EVICTED.inc()
+
+    def evict_idle(self, now: float | None = None) -> list:
+        """Evict rooms idle past config.ROOM_IDLE_S, then LRU rooms while over config.ROOM_BUDGET_MB."""
+        now = time.monotonic() if now is None else now
+        evicted = [rid for rid, since in self.idle.items() if now - since >= config.ROOM_IDLE_S]
+        for rid in evicted:
+            self._evict(rid)
+        budget = config.ROOM_BUDGET_MB * 1024 * 1024
+        used = sum(room_bytes(room) for room in self.rooms.values())
+        while used > budget and self.idle:
+            rid = next(iter(self.idle))
+            used -= room_bytes(self.rooms[rid])
+            self._evict(rid)
+            evicted.append(rid)
+        return evicted
+
+    async def sweep(self, interval: float = 30):
+        """Run evict_idle() every interval seconds until cancelled."""
+        while True:
+            await asyncio.sleep(interval)
+            if self.evict_idle():
+                await self.writer.flush()
+
+    async def save(self, room_id: str) -> dict:
+        room = self.rooms.get(room_id)
+        if not room:
+            return {"ok": False, "msg": "Room not found"}
+        room.drain()
+        room.flush()
+        room.journal.start(room.state)
+        await self.writer.flush()
+        return {"ok": True}
+
+    async def load(self, room_id: str) -> dict:
+        if room_id in self.released:
+            return {"ok": False, "msg": "Room is moving"}
+        await self.writer.flush()
+        st = await asyncio.to_thread(load_room, room_id)
+        if not st:
+            return {"ok": False, "msg": "No saved state"}
+        room = self.rooms.get(room_id)
+        if room:
+            room.drain()
+            room.flush()
+            room.state = st
+            room.forget_history()
+            room.journal.start(st)
+        else:
+            room = self._open_room(st)
+            self.idle[room_id] = time.monotonic()
+        room.broadcast()
+        return {"ok": True}
+
+    async def state(self, room_id: str) -> dict:
+        """The public snapshot of a live room, as the same cached JSON its spectators get."""
+        room = self.rooms.get(room_id)
+        if not room:
+            return {"ok": False, "msg": "Room not found"}
+        return {"ok": True, "version": room.state.version, "snapshot": room.snapshot().json()}
+
+    async def scrape(self, room_id: str = "") -> dict:
+        """This process's metrics (room_id is ignored; ops are addressed by room)."""
+        self.update_gauges()
+        return {"ok": True, "metrics": metrics.collect()}
+
+    def update_gauges(self):
+        idle = sum(1 for room in self.rooms.values() if not room.peers and not room.spectators)
+        metrics.ROOMS.set(len(self.rooms) - idle, "active")
+        metrics.ROOMS.set(idle, "idle")
+        metrics.PEERS.set(sum(len(r.peers) for r in self.rooms.values()), "player")
+        metrics.PEERS.set(sum(len(r.spectators) for r in self.rooms.values()), "spectator")
+
+    async def release(self, room_id: str) -> dict:
+        """Persist a room and forget it, so another host can pick it up from its snapshot."""
+        self.released.add(room_id)
+        self.idle.pop(room_id, None)
+        room = self.rooms.pop(room_id, None)
+        if room:
+            room.close()
+            room.journal.start(room.state)
+            for peer in [*room.peers.values(), *room.spectators.values()]:
+                peer.close(code=1012)  # service restart: clients should reconnect
+            room.peers.clear()
+            room.spectators.clear()
+        await self.writer.flush()
+        return {"ok": True}
+
+    async def readmit(self, room_id: str) -> dict:
+        self.released.discard(room_id)
+        return {"ok": True}
+
+    async def serve(self, ws, room_id: str):
+        """Run one already-accepted connection until it goes away."""
+        if room_id in self.released:
+            await ws.close(code=1012)
+            return
+        try:
+            # First message must be the hello payload
+            hello = ClientHello.model_validate_json(await ws.receive_text())
+
+            spectator = hello.role == "spectator"
+            room = self.rooms.get(room_id)
+            # A player coming back to a live room keeps their seat as it is: no new deck, no rename
+            resuming = not spectator and room is not None and room.resumes(hello.player_id, hello.session)
+            deck = await load_deck_async(hello.deck) if hello.deck and not spectator and not resuming else None
+            room = self.rooms.get(room_id)
+            if room is None:
+                # Pick up where a previous run (or another host) left off, if it did
+                await self.writer.flush()  # an evicted room's snapshot may still be queued
+                st = await asyncio.to_thread(load_room, room_id)
+                room = self.rooms.get(room_id)  # someone else may have opened it meanwhile
+            if room is None and st is None and spectator:
+                # nothing to watch; spectators never create rooms
+                await ws.send_text(ServerAck(kind="ack", ok=False, msg="no such room").model_dump_json())
+                await ws.close(code=1008)
+                return
+            if room is None:
+                if st is not None:
+                    room = self._open_room(st)
+                    # Keep the cards of a seat that was already playing
+                    if not spectator:
+                        room.seat(hello.player_id, deck if room.seat_is_empty(hello.player_id) else None,
+                                  hello.name)
+                else:
+                    # First joiner: only load a deck for the seat that joined (no placeholders)
+                    deckA = deck if hello.player_id == "A" else None
+                    deckB = deck if hello.player_id == "B" else None
+                    st = new_room(room_id, deckA, deckB)
+                    if hello.name and not spectator:
+                        st.players[hello.player_id].name = hello.name
+                    room = self._open_room(st)
+            elif not spectator and not resuming:
+                # Later joiners: if they provide a deck, replace their zones with the real deck
+                room.seat(hello.player_id, deck, hello.name)
+
+            # Register (queues the current state for us), then serve the loop
+            self.idle.pop(room_id, None)
+            if spectator:
+                peer = room.watch(ws, negotiate(hello.encoding))
+            else:
+                room.resumes(hello.player_id, hello.session)  # the seat's latest join from now on
+                first = None
+                if resuming:
+                    if hello.last_version is not None:
+                        first = room.catch_up(hello.player_id, hello.last_version)
+                    metrics.RESUMES.inc("patch" if first is not None else "snapshot")
+                peer = room.join(ws, negotiate(hello.encoding), hello.player_id, first)
+
+            while True:
+                message = await ws.receive()
+                try:
+                    msg = decode(message)
+                except ValueError:
+                    # rejected before it gets anywhere near the room
+                    peer.push(Frame(ServerAck(kind="ack", ok=False, msg="malformed message",
+                                              version=room.state.version)))
+                    continue
+                if msg.kind == "resync":
+                    peer.push(room.snapshot(None if spectator else hello.player_id))
+                elif spectator:
+                    peer.push(Frame(ServerAck(kind="ack", ok=False, msg="spectators cannot act",
+                                              version=room.state.version)))
+                elif msg.kind == "drag":
+                    room.drag(peer, hello.player_id, msg)
+                else:
+                    room.submit(msg.type, msg.payload, peer)
+
+        except DISCONNECTS:
+            pass
+        except ValueError as e:
+            # a hello that does not validate
+            metrics.CONNECTION_ERRORS.inc("bad_hello")
+            log.info("room %s: rejected hello: %s", room_id, e)
+        except Exception as e:
+            metrics.CONNECTION_ERRORS.inc(type(e).__name__)
+            log.exception("room %s: connection failed", room_id)
+        finally:
+            room = self.rooms.get(room_id)
+            if room:
+                room.leave(ws)
+                if not room.peers and not room.spectators:
+                    self.idle[room_id] = time.monotonic()
+                    self.idle.move_to_end(room_id)
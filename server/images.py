@@ -0,0 +1,65 @@
+"""Downscaled card image variants.
+
+Deck imports save Scryfall "normal" images (488px wide). Zone thumbnails and
+table cards are shown far smaller, so /images/... also answers ?size=thumb|bf
+with a resized WebP copy, made on first request (or at import) and cached
+next to the originals. Needs Pillow; without it every size is the original.
+"""
+import os
+from pathlib import Path
+
+try:
+    from PIL import Image
+except ImportError:  # optional: originals are served as they are
+    Image = None
+
+IMG_DIR = Path(__file__).parent / "data" / "images"
+
+# size name -> width in px; anything else (e.g. "zoom") is the original file
+SIZES = {"thumb": 120, "bf": 244}
+
+def _original(rel: str) -> Path | None:
+    root = IMG_DIR.resolve()
+    p = (root / rel).resolve()
+    if root not in p.parents or not p.is_file():
+        return None
+    return p
+
+def variant_path(original: Path, size: str) -> Path:
+    rel = original.relative_to(IMG_DIR.resolve())
+    return IMG_DIR / ".variants" / size / rel.with_suffix(".webp")
+
+def make_variant(original: Path, size: str) -> Path:
+    """Write (or refresh) one resized copy of original and return its path."""
+    out = variant_path(original, size)
+    if out.exists() and out.stat().st_mtime_ns >= original.stat().st_mtime_ns:
+        return out
+    width = SIZES[size]
+    with Image.open(original) as im:
+        if im.width > width:
+            im = im.resize((width, round(im.height * width / im.width)), Image.LANCZOS)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        tmp = out.with_suffix(".tmp")
+        im.save(tmp, "WEBP", quality=80, method=4)
+    os.replace(tmp, out)
+    return out
+
+def make_variants(path) -> None:
+    """Pre-build every size for a freshly downloaded image (no-op without Pillow)."""
+    original = Path(path).resolve()
+    if Image is None or not original.is_file():
+        return
+    for size in SIZES:
+        make_variant(original, size)
+
+def image_file(rel: str, size: str | None = None) -> Path | None:
+    """The file to serve for /images/{rel}?size=...; None when there is no such image."""
+    original = _original(rel)
+    if original is None:
+        return None
+    if Image is None or size not in SIZES:
+        return original
+    try:
+        return make_variant(original, size)
+    except OSError:
+        return original  # not an image Pillow can read; send it untouched
@@ -0,0 +1,152 @@
+"""Deck imports run as background jobs, so the lobby can add decks without stalling rooms.
+
+Each job runs deck_download.fetch_and_save_deck on a small thread pool and
+records its progress in a SQLite file next to the decks, so with several
+uvicorn workers any of them can answer the poll. The finished deck lands in
+server/data/decks and is listed by /api/decks right away; an import never
+replaces a deck that is already there.
+"""
+import sqlite3, threading, time, uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from . import config, persistence
+
+class ImportJob:
+    __slots__ = ("id", "name", "status", "done", "total", "error")
+
+    def __init__(self, name: str, id: str | None = None, status: str = "queued",
+                 done: int = 0, total: int = 0, error: str | None = None):
+        self.id = id or uuid.uuid4().hex[:12]
+        self.name = name
+        self.status = status  # queued -> running -> done | error
+        self.done = done
+        self.total = total
+        self.error = error
+
+    def as_dict(self) -> dict:
+        return {k: getattr(self, k) for k in self.__slots__}
+
+def deck_slug(name: str) -> str:
+    """The file name (without .json) an import of name saves to."""
+    from deck_download import slugify  # the importer script at the project root
+    return slugify(name)
+
+class DeckExists(Exception):
+    """An import would replace a deck that exists or is being imported."""
+
+class ImportJobs:
+    """Runs imports on this process's pool; their rows live in a SQLite file every worker shares.
+
+    A worker holds a lease on its unfinished jobs and renews it while it is
+    alive. shutdown() marks its own unfinished jobs "interrupted"; jobs of a
+    worker that died that way are marked once their lease runs out, so the
+    deck name can be imported again.
+    """
+
+    def __init__(self, workers: int | None = None, keep: int = 100, path: Path | None = None,
+                 lease_s: float = 30.0):
+        self.pool = ThreadPoolExecutor(workers or config.IMPORT_WORKERS, thread_name_prefix="deck-import")
+        self.keep = keep  # finished jobs remembered for polling
+        self.path = path or persistence.DATA_DIR / "imports.sqlite3"
+        self.lease_s = lease_s
+        self.owner = uuid.uuid4().hex
+        self._local = threading.local()
+        self._stop = threading.Event()
+        self._beat: threading.Thread | None = None
+
+    def _db(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, name TEXT NOT NULL, status TEXT NOT NULL,"
+                       " done INTEGER NOT NULL, total INTEGER NOT NULL, error TEXT,"
+                       " owner TEXT NOT NULL, lease REAL NOT NULL)")
+            # at most one unfinished import per deck name, across every process sharing the file
+            db.execute("CREATE UNIQUE INDEX IF NOT EXISTS jobs_active ON jobs (name)"
+                       " WHERE status IN ('queued', 'running')")
+            self._expire(db)
+        return db
+
+    def _expire(self, db: sqlite3.Connection, owner: str | None = None):
+        """Give up on unfinished jobs whose worker stopped renewing them (or on all of owner's)."""
+        with db:
+            if owner is None:
+                db.execute("UPDATE jobs SET status = 'error', error = 'interrupted'"
+                           " WHERE status IN ('queued', 'running') AND lease < ?", (time.time(),))
+            else:
+                db.execute("UPDATE jobs SET status = 'error', error = 'interrupted'"
+                           " WHERE status IN ('queued', 'running') AND owner = ?", (owner,))
+
+    def _renew(self):
+        while not self._stop.wait(self.lease_s / 3):
+            db = self._db()
+            with db:
+                db.execute("UPDATE jobs SET lease = ? WHERE owner = ? AND status IN ('queued', 'running')",
+                           (time.time() + self.lease_s, self.owner))
+
+    def _save(self, job: ImportJob):
+        db = self._db()
+        with db:
+            # an interrupted job stays that way even if its thread outlives shutdown()
+            db.execute("UPDATE jobs SET status = ?, done = ?, total = ?, error = ?"
+                       " WHERE id = ? AND status IN ('queued', 'running')",
+                       (job.status, job.done, job.total, job.error, job.id))
+
+    def submit(self, name: str, text: str) -> ImportJob:
+        """Queue an import; raises DeckExists when the deck's file is taken."""
+        job = ImportJob(deck_slug(name))
+        if (persistence.DECKS_DIR / f"{job.name}.json").exists():
+            raise DeckExists(job.name)
+        db = self._db()
+        self._expire(db)
+        try:
+            with db:
+                db.execute("INSERT INTO jobs (id, name, status, done, total, error, owner, lease)"
+                           " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                           (job.id, job.name, job.status, job.done, job.total, job.error,
+                            self.owner, time.time() + self.lease_s))
+                db.execute("DELETE FROM jobs WHERE status IN ('done', 'error') AND rowid NOT IN"
+                           " (SELECT rowid FROM jobs WHERE status IN ('done', 'error') ORDER BY rowid DESC LIMIT ?)",
+                           (self.keep,))
+        except sqlite3.IntegrityError:
+            raise DeckExists(job.name) from None
+        if self._beat is None:
+            self._beat = threading.Thread(target=self._renew, name="deck-import-lease", daemon=True)
+            self._beat.start()
+        self.pool.submit(self._run, job, text)
+        return job
+
+    def get(self, job_id: str) -> ImportJob | None:
+        db = self._db()
+        self._expire(db)
+        row = db.execute("SELECT name, id, status, done, total, error FROM jobs WHERE id = ?",
+                         (job_id,)).fetchone()
+        return None if row is None else ImportJob(*row)
+
+    def _run(self, job: ImportJob, text: str):
+        import deck_download  # the importer script at the project root
+
+        def progress(done: int, total: int):
+            job.done, job.total = done, total
+            self._save(job)
+
+        job.status = "running"
+        self._save(job)
+        try:
+            deck_download.fetch_and_save_deck(text, job.name, progress=progress, overwrite=False)
+            job.status = "done"
+        except FileExistsError:
+            job.error = f"A deck named {job.name!r} already exists"
+            job.status = "error"
+        except Exception as e:
+            job.error = str(e) or type(e).__name__
+            job.status = "error"
+        self._save(job)
+
+    def shutdown(self):
+        self._stop.set()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        # whatever was queued or still running will not finish in this process
+        self._expire(self._db(), self.owner)
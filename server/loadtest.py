@@ -0,0 +1,265 @@
+"""Websocket load generator: how many rooms can one server process carry?
+
+Starts a server (or targets one with --url), opens N rooms with two scripted
+seats each (join with a deck, draw, move to the battlefield, drag with
+set_card_pos, tap, pass the turn) and reports:
+
+  - actions per second across all rooms
+  - p50/p95/p99 latency from sending an action to receiving the patch that shows it
+  - average bytes per frame received
+  - server RSS growth per room (Linux, when the server's pid is known)
+
+    python -m server.loadtest --rooms 50 --seconds 20 --save baseline.json
+    python -m server.loadtest --rooms 50 --seconds 20 --compare baseline.json
+"""
+import argparse, asyncio, json, math, os, random, shutil, socket, statistics, subprocess, sys, tempfile, time
+from pathlib import Path
+
+import websockets
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+ROOT = Path(__file__).resolve().parent.parent
+
+class Stats:
+    def __init__(self):
+        self.latencies: list[float] = []
+        self.actions = 0
+        self.lost = 0
+        self.frames = 0
+        self.bytes = 0
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]  # nearest rank
+
+class Seat:
+    """One scripted player: mirrors its own view of the room to pick card ids."""
+
+    def __init__(self, url: str, room: str, pid: str, deck: str, encoding: str, stats: Stats):
+        self.url = url
+        self.room = room
+        self.pid = pid
+        self.deck = deck
+        self.encoding = encoding
+        self.stats = stats
+        self.state = None
+        self.waiting = None  # (predicate, future) for the action in flight
+
+    def decode(self, data) -> dict:
+        self.stats.frames += 1
+        self.stats.bytes += len(data)
+        return msgpack.unpackb(data) if isinstance(data, bytes) else json.loads(data)
+
+    def send(self, ws, msg: dict):
+        data = msgpack.packb(msg) if self.encoding == "msgpack" else json.dumps(msg)
+        return ws.send(data)
+
+    def apply(self, msg: dict):
+        if msg["kind"] == "state":
+            self.state = msg["state"]
+        elif msg["kind"] == "patch" and self.state is not None:
+            if msg["base"] != self.state["version"]:
+                self.state = None  # gap: wait for the snapshot we ask for below
+                return
+            self.state.update(msg["room"])
+            for cid, card in msg["cards"].items():
+                if card is None:
+                    self.state["cards"].pop(cid, None)
+                else:
+                    self.state["cards"][cid] = card
+            for pid, fields in msg["players"].items():
+                self.state["players"][pid].update(fields)
+            self.state["version"] = msg["version"]
+        if msg["kind"] == "patch" and self.waiting and self.waiting[0](msg):
+            self.waiting[1].set_result(time.perf_counter())
+            self.waiting = None
+
+    async def reader(self, ws):
+        async for data in ws:
+            msg = self.decode(data)
+            self.apply(msg)
+            if self.state is None:
+                await self.send(ws, {"kind": "resync"})
+
+    def next_action(self, rng: random.Random):
+        me = self.state["players"][self.pid]
+        hand, field = me["hand"], me["battlefield"]
+        roll = rng.random()
+        if field and roll < 0.45:
+            cid = rng.choice(field)
+            pos = {"card_id": cid, "x": rng.randrange(800), "y": rng.randrange(400), "z": 1}
+            return "set_card_pos", pos, lambda m: cid in m["cards"]
+        if field and roll < 0.6:
+            cid = rng.choice(field)
+            return "tap_toggle", {"card_id": cid}, lambda m: cid in m["cards"]
+        if hand and roll < 0.8:
+            cid = rng.choice(hand)
+            return ("move", {"player_id": self.pid, "card_id": cid, "to": "battlefield"},
+                    lambda m: cid in m["cards"])
+        if roll < 0.95 or self.state["turn"] != self.pid:
+            pid = self.pid
+            return "draw", {"player_id": pid, "n": 1}, lambda m: "hand" in m["players"].get(pid, {})
+        return "pass_turn", {}, lambda m: "turn" in m["room"]
+
+    async def run(self, deadline: float, rate: float, rng: random.Random):
+        async with websockets.connect(f"{self.url}/ws/{self.room}", max_size=None) as ws:
+            await ws.send(json.dumps({"kind": "hello", "room_id": self.room, "player_id": self.pid,
+                                      "deck": self.deck, "encoding": self.encoding}))
+            reader = asyncio.ensure_future(self.reader(ws))
+            try:
+                while self.state is None:
+                    await asyncio.sleep(0.01)
+                while time.perf_counter() < deadline:
+                    await asyncio.sleep(rng.expovariate(rate))
+                    if self.state is None:
+                        continue
+                    action_type, payload, shows = self.next_action(rng)
+                    fut = asyncio.get_running_loop().create_future()
+                    self.waiting = (shows, fut)
+                    t0 = time.perf_counter()
+                    await self.send(ws, {"kind": "action", "type": action_type, "payload": payload})
+                    self.stats.actions += 1
+                    try:
+                        t1 = await asyncio.wait_for(fut, 5)
+                        self.stats.latencies.append(t1 - t0)
+                    except asyncio.TimeoutError:
+                        self.stats.lost += 1
+                        self.waiting = None
+            finally:
+                reader.cancel()
+
+def rss_kb(pid: int | None) -> int | None:
+    if pid is None:
+        return None
+    try:
+        for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+async def _wait_listening(port: int, timeout: float = 15):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        try:
+            _, w = await asyncio.open_connection("127.0.0.1", port)
+            w.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+async def run_load(url: str, rooms: int, seconds: float, rate: float, deck: str,
+                   encoding: str, server_pid: int | None = None, seed: int = 1) -> dict:
+    stats = Stats()
+    rng = random.Random(seed)
+    rss_before = rss_kb(server_pid)
+    tag = f"LT{os.getpid()}-{int(time.time())}"
+    deadline = time.perf_counter() + seconds
+    seats = [Seat(url, f"{tag}-{r}", pid, deck, encoding, stats) for r in range(rooms) for pid in ("A", "B")]
+    started = time.perf_counter()
+    results = await asyncio.gather(*(s.run(deadline, rate, random.Random(rng.random())) for s in seats),
+                                   return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    rss_after = rss_kb(server_pid)
+    errors = [r for r in results if isinstance(r, Exception)]
+    lat = [x * 1000 for x in stats.latencies]
+    return {
+        "rooms": rooms,
+        "seconds": round(elapsed, 2),
+        "encoding": encoding,
+        "actions": stats.actions,
+        "actions_per_s": round(stats.actions / elapsed, 1),
+        "lost": stats.lost,
+        "errors": len(errors),
+        "p50_ms": round(percentile(lat, 50), 2),
+        "p95_ms": round(percentile(lat, 95), 2),
+        "p99_ms": round(percentile(lat, 99), 2),
+        "mean_ms": round(statistics.fmean(lat), 2) if lat else 0.0,
+        "bytes_per_frame": round(stats.bytes / stats.frames, 1) if stats.frames else 0.0,
+        "rss_kb_per_room": (round((rss_after - rss_before) / rooms, 1)
+                            if rss_before is not None and rss_after is not None else None),
+    }
+
+# result key -> True when bigger is better
+METRICS = {"actions_per_s": True, "p50_ms": False, "p95_ms": False, "p99_ms": False,
+           "bytes_per_frame": False, "rss_kb_per_room": False}
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Print a side-by-side table; return the metrics that got worse by more than tolerance %."""
+    worse = []
+    for key in ("rooms", "encoding"):
+        if baseline.get(key) != result.get(key):
+            print(f"note: baseline ran with {key}={baseline.get(key)}, this run with {key}={result.get(key)}")
+    print(f"{'metric':<18}{'baseline':>12}{'now':>12}{'change':>10}")
+    for key, higher_is_better in METRICS.items():
+        old, new = baseline.get(key), result.get(key)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old * 100 if old else 0.0
+        print(f"{key:<18}{old:>12}{new:>12}{change:>+9.1f}%")
+        if (-change if higher_is_better else change) > tolerance:
+            worse.append(key)
+    return worse
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m server.loadtest", description=__doc__.split("\n\n")[0])
+    ap.add_argument("--url", help="ws://host:port of a running server (default: start one)")
+    ap.add_argument("--pid", type=int, help="pid of the --url server, for RSS per room")
+    ap.add_argument("--rooms", type=int, default=20)
+    ap.add_argument("--seconds", type=float, default=10)
+    ap.add_argument("--rate", type=float, default=5, help="actions per second per seat")
+    ap.add_argument("--deck", default="loadtest", help="deck name (missing decks get 40 generic cards)")
+    ap.add_argument("--encoding", choices=("json", "msgpack"), default="json")
+    ap.add_argument("--save", metavar="FILE", help="write the results as a baseline")
+    ap.add_argument("--compare", metavar="FILE", help="compare against a saved baseline")
+    ap.add_argument("--tolerance", type=float, default=10, help="%% regression that fails --compare")
+    args = ap.parse_args(argv)
+    if args.encoding == "msgpack" and msgpack is None:
+        ap.error("msgpack is not installed")
+
+    server = None
+    url, pid = args.url, args.pid
+    if url is None:
+        port = _free_port()
+        # the throwaway rooms are persisted like real ones, just not next to them
+        rooms_dir = tempfile.mkdtemp(prefix="cgr-loadtest-")
+        server = subprocess.Popen([sys.executable, "-m", "uvicorn", "server.app:app", "--port", str(port),
+                                   "--log-level", "warning"], cwd=ROOT,
+                                  env={**os.environ, "CGR_ROOMS_DIR": rooms_dir})
+        url, pid = f"ws://127.0.0.1:{port}", server.pid
+    try:
+        if server is not None:
+            asyncio.run(_wait_listening(int(url.rsplit(":", 1)[1])))
+        result = asyncio.run(run_load(url, args.rooms, args.seconds, args.rate, args.deck,
+                                      args.encoding, pid))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+            shutil.rmtree(rooms_dir, ignore_errors=True)
+
+    print(json.dumps(result, indent=2))
+    if args.save:
+        Path(args.save).write_text(json.dumps(result, indent=2) + "\n")
+    if args.compare:
+        worse = compare(result, json.loads(Path(args.compare).read_text()), args.tolerance)
+        if worse:
+            print(f"Regressed beyond {args.tolerance}%: {', '.join(worse)}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,196 @@
-from typing import Dict, List, Optional, Literal
-from pydantic import BaseModel, Field
+import bisect, hashlib, random
+from collections import OrderedDict, deque
+from typing import Annotated, Any, Dict, Iterable, List, Optional, Literal, Union
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr, TypeAdapter, create_model, model_validator
+from pydantic_core import core_schema
+
+from . import config
 
 Phase = Literal["Untap","Upkeep","Draw","Main","Combat","Second Main","End"]
 
-class CardInstance(BaseModel):
-    id: str
+class Zone:
+    """Ordered card ids with O(1) membership, removal by id and insertion at either end.
+
+    The end of the zone is its top (libraries draw with pop()). Each id keeps an
+    ordinal that only grows towards the top, so order_key() is O(1) too.
+    On the wire a Zone is a plain list, bottom first.
+
+    Between start_log() and stop_log() every edit also appends how to take it
+    back, in O(1): ("add", cid), ("del", cid, ordinal) or, for a clear or
+    shuffle, ("all", ((cid, ordinal), ...), lo, hi), after which the log stops
+    since the whole zone is kept. Undo puts ids back at their old ordinals, so
+    the ordinals of every other id stay valid for older log entries.
+    """
+    __slots__ = ("_ids", "_lo", "_hi", "_log")
+
+    def __init__(self, ids: Iterable[str] = ()):
+        self._ids: "OrderedDict[str, int]" = OrderedDict()
+        self._lo = self._hi = 0
+        self._log: Optional[list] = None
+        self.extend(ids)
+
+    def start_log(self) -> list:
+        self._log = []
+        return self._log
+
+    def stop_log(self):
+        self._log = None
+
+    def append(self, cid: str):
+        old = self._ids.pop(cid, None)
+        if self._log is not None:
+            if old is not None:
+                self._log.append(("del", cid, old))
+            self._log.append(("add", cid))
+        self._hi += 1
+        self._ids[cid] = self._hi
+
+    def appendleft(self, cid: str):
+        old = self._ids.pop(cid, None)
+        if self._log is not None:
+            if old is not None:
+                self._log.append(("del", cid, old))
+            self._log.append(("add", cid))
+        self._lo -= 1
+        self._ids[cid] = self._lo
+        self._ids.move_to_end(cid, last=False)
+
+    def extend(self, ids: Iterable[str]):
+        for cid in ids:
+            self.append(cid)
+
+    def insert(self, cid: str, ordinal: int):
+        """Put cid, which is in no zone, back at the ordinal it had; O(n) unless it
+        lands at an end. Only undo needs it."""
+        ids = self._ids
+        if not ids or ordinal > ids[next(reversed(ids))]:
+            ids[cid] = ordinal
+        elif ordinal < ids[next(iter(ids))]:
+            ids[cid] = ordinal
+            ids.move_to_end(cid, last=False)
+        else:
+            items = list(ids.items())
+            at = bisect.bisect([o for _, o in items], ordinal)
+            items.insert(at, (cid, ordinal))
+            self._ids = OrderedDict(items)
+        self._lo = min(self._lo, ordinal)
+        self._hi = max(self._hi, ordinal)
+        if self._log is not None:
+            self._log.append(("add", cid))
+
+    def pop(self) -> str:
+        if not self._ids:
+            raise IndexError("pop from empty zone")
+        cid, ordinal = self._ids.popitem()
+        if self._log is not None:
+            self._log.append(("del", cid, ordinal))
+        return cid
+
+    def remove(self, cid: str):
+        ordinal = self._ids.pop(cid, None)
+        if ordinal is None:
+            raise ValueError(f"{cid!r} not in zone")
+        if self._log is not None:
+            self._log.append(("del", cid, ordinal))
+
+    def discard(self, cid: str):
+        ordinal = self._ids.pop(cid, None)
+        if ordinal is not None and self._log is not None:
+            self._log.append(("del", cid, ordinal))
+
+    def keep_all(self) -> tuple:
+        """The log entry that puts the whole zone back as it is now."""
+        return "all", tuple(self._ids.items()), self._lo, self._hi
+
+    def clear(self):
+        if self._log is not None:
+            self._log.append(self.keep_all())
+            self._log = None
+        self._ids.clear()
+        self._lo = self._hi = 0
+
+    def ordinals(self) -> tuple:
+        """(lo, hi, ordinal of each id bottom first); with set_ordinals, keeps undo logs
+        valid across a save and load, which would otherwise renumber the zone."""
+        return self._lo, self._hi, list(self._ids.values())
+
+    def set_ordinals(self, lo: int, hi: int, ordinals: Iterable[int]):
+        self._ids = OrderedDict(zip(self._ids, ordinals))
+        self._lo, self._hi = lo, hi
+
+    def shuffle(self, rng=random):
+        ids = list(self._ids)
+        rng.shuffle(ids)
+        self.clear()
+        self.extend(ids)
+
+    def order_key(self, cid: str) -> int:
+        """Sorts cid against the zone's other ids (higher is nearer the top).
+        Not an index: keys have gaps and can be negative."""
+        return self._ids[cid]
+
+    def __getitem__(self, i):
+        if i == -1 and self._ids:
+            return next(reversed(self._ids))
+        if i == 0 and self._ids:
+            return next(iter(self._ids))
+        return list(self._ids)[i]
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __reversed__(self):
+        return reversed(self._ids)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, cid):
+        return cid in self._ids
+
+    def __eq__(self, other):
+        if isinstance(other, Zone):
+            return list(self._ids) == list(other._ids)
+        if isinstance(other, (list, tuple)):
+            return list(self._ids) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return f"Zone({list(self._ids)!r})"
+
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source, handler):
+        from_list = core_schema.no_info_after_validator_function(
+            cls, core_schema.list_schema(core_schema.str_schema()))
+        return core_schema.union_schema(
+            [core_schema.is_instance_schema(cls), from_list],
+            serialization=core_schema.plain_serializer_function_ser_schema(
+                list, return_schema=core_schema.list_schema(core_schema.str_schema())),
+        )
+
+DEF_FIELDS = ("name", "image", "scryfall_id", "set", "collector_number")
+
+class CardDef(BaseModel):
+    """What every copy of a card shares. Rooms keep one per distinct card in
+    RoomState.defs and each CardInstance points at it through def_id."""
     name: str
-    tapped: bool = False
-    counters: Dict[str, int] = Field(default_factory=dict)
     image: Optional[str] = None
     scryfall_id: Optional[str] = None
     set: Optional[str] = None
     collector_number: Optional[str] = None
+
+    @staticmethod
+    def ident(fields: tuple) -> str:
+        """Stable short id for the DEF_FIELDS values of a card."""
+        key = "\x1f".join(str(v or "") for v in fields)
+        return hashlib.blake2b(key.encode("utf-8"), digest_size=6).hexdigest()
+
+class CardInstance(BaseModel):
+    id: str
+    def_id: Optional[str] = None  # key into RoomState.defs; None for tokens
+    name: Optional[str] = None    # tokens only; cards take theirs from the definition
+    tapped: bool = False
+    counters: Dict[str, int] = Field(default_factory=dict)
     pos: Optional[Dict[str, int]] = None  # {"x": int, "y": int, "z": int}
     # Token support fields
     is_token: bool = False
@@ -20,6 +199,9 @@ class CardInstance(BaseModel):
     text: Optional[str] = None
 
 class PlayerState(BaseModel):
+    # keeps zones as Zone even when a plain list is assigned
+    model_config = ConfigDict(validate_assignment=True)
+
     id: Literal["A","B"]
     name: str = "Player"
     life: int = 20
@@ -30,36 +212,225 @@ class PlayerState(BaseModel):
     # Privacy: zones that shouldn't show top card due to recent hand swaps
     hide_graveyard_top: bool = False
     hide_exile_top: bool = False  
-    library: List[str] = Field(default_factory=list)
-    hand: List[str] = Field(default_factory=list)
-    battlefield: List[str] = Field(default_factory=list)
-    graveyard: List[str] = Field(default_factory=list)
-    exile: List[str] = Field(default_factory=list)
+    library: Zone = Field(default_factory=Zone)
+    hand: Zone = Field(default_factory=Zone)
+    battlefield: Zone = Field(default_factory=Zone)
+    graveyard: Zone = Field(default_factory=Zone)
+    exile: Zone = Field(default_factory=Zone)
+
+class History:
+    """A room's undo and redo steps (state.Changes holding pre-images), latest last."""
+    __slots__ = ("undo", "redo")
+
+    def __init__(self, depth: int | None = None):
+        self.undo: deque = deque(maxlen=config.UNDO_DEPTH if depth is None else depth)
+        self.redo: list = []
 
 class RoomState(BaseModel):
     room_id: str
+    version: int = 0  # bumped by every apply_action that changes something
     turn: Literal["A","B"] = "A"
     phase: Phase = "Main"
+    defs: Dict[str, CardDef] = Field(default_factory=dict)
     cards: Dict[str, CardInstance] = Field(default_factory=dict)
     players: Dict[Literal["A","B"], PlayerState] = Field(default_factory=dict)
+    # card_id -> (player_id, zone name); maintained by state.py, rebuilt on demand
+    _loc: Optional[Dict[str, tuple]] = PrivateAttr(default=None)
+    # every shuffle comes from here, so a logged room replays identically
+    _rng: random.Random = PrivateAttr(default_factory=random.Random)
+    # card and token ids: players see those, so they must tell nothing about _rng
+    _idrng: random.Random = PrivateAttr(default_factory=random.Random)
+    # what undo/redo can put back; snapshots save it (state.history_data) so replay can use it
+    _history: "History" = PrivateAttr(default_factory=lambda: History())
+
+    @model_validator(mode="before")
+    @classmethod
+    def _split_card_defs(cls, data):
+        # Rooms saved before definitions existed carry name/image/... on every card
+        if not isinstance(data, dict) or "defs" in data:
+            return data
+        defs, cards = {}, {}
+        for cid, c in (data.get("cards") or {}).items():
+            if isinstance(c, dict) and not c.get("is_token") and c.get("name"):
+                fields = tuple(c.get(k) for k in DEF_FIELDS)
+                did = CardDef.ident(fields)
+                defs[did] = dict(zip(DEF_FIELDS, fields))
+                c = {k: v for k, v in c.items() if k not in DEF_FIELDS}
+                c["def_id"] = did
+            cards[cid] = c
+        return {**data, "defs": defs, "cards": cards}
 
 class ClientHello(BaseModel):
     kind: Literal["hello"]
     room_id: str
-    player_id: Literal["A","B"]
+    role: Literal["player","spectator"] = "player"
+    player_id: Optional[Literal["A","B"]] = None  # required for players
     name: Optional[str] = None
     deck: Optional[str] = None  # NEW
+    encoding: Literal["json","msgpack"] = "json"  # wire format for everything after the hello
+    # Random id the client keeps for its seat. Joining again with the id of the seat's latest
+    # join resumes: no reseat or rename, and with last_version only the missed changes are sent
+    session: Optional[str] = Field(None, max_length=64)
+    last_version: Optional[int] = None
+
+    @model_validator(mode="after")
+    def _players_need_a_seat(self):
+        if self.role == "player" and self.player_id is None:
+            raise ValueError("player_id is required to play")
+        if self.role == "spectator":
+            self.player_id = None  # spectators get the public view, whatever seat they name
+        return self
+
+class DeckImport(BaseModel):
+    """POST /api/decks/import: a decklist (text or URL mtg_parser understands) to save as name."""
+    name: str = Field(min_length=1, max_length=80)
+    text: str = Field(min_length=1, max_length=200_000)
 
 class ClientAction(BaseModel):
     kind: Literal["action"]
     type: str
     payload: Dict
 
+# ---- action payloads, one model per action type (handlers live in state.py)
+
+ZoneName = Literal["library","hand","battlefield","graveyard","exile"]
+
+# More cards than any library holds; bounds draw/mulligan counts so one message cannot stall a room
+LIBRARY_CAP = 500
+
+class PlayerPayload(BaseModel):
+    player_id: Literal["A","B"]
+
+class CardPayload(BaseModel):
+    card_id: str
+
+class EmptyPayload(BaseModel):
+    pass
+
+class DrawPayload(PlayerPayload):
+    n: int = Field(1, ge=0, le=LIBRARY_CAP)
+
+class MovePayload(PlayerPayload):
+    card_id: str
+    to: ZoneName
+
+class DeltaPayload(PlayerPayload):
+    delta: int
+
+class PhasePayload(BaseModel):
+    phase: Phase
+
+class MulliganPayload(PlayerPayload):
+    n: int = Field(7, ge=0, le=LIBRARY_CAP)
+
+class SwapZonePayload(PlayerPayload):
+    zone: Literal["graveyard","exile","library"]
+
+class CardPosPayload(CardPayload):
+    x: int = 0
+    y: int = 0
+    z: int = 1
+
+class CreateTokenPayload(PlayerPayload):
+    name: str = "Token"
+    creature: bool = False
+    text: Optional[str] = None
+
+class UpdateTokenPayload(CardPayload):
+    text: Optional[str] = None  # left out: keep the current text
+
+class PlayerCardPayload(PlayerPayload):
+    card_id: str
+
+class NamePayload(PlayerPayload):
+    name: str
+
+class SeatDeckPayload(PlayerPayload):
+    deck: List[Any]  # card names or deck-file card dicts
+
+# Everything a client may send as {"kind": "action", "type": ..., "payload": ...}
+CLIENT_ACTIONS: Dict[str, type[BaseModel]] = {
+    "draw": DrawPayload,
+    "move": MovePayload,
+    "tap_toggle": CardPayload,
+    "life": DeltaPayload,
+    "wins": DeltaPayload,
+    "pass_turn": EmptyPayload,
+    "set_phase": PhasePayload,
+    "shuffle_library": PlayerPayload,
+    "mulligan": MulliganPayload,
+    "swap_zone_with_hand": SwapZonePayload,
+    "swap_opponent_zone_with_hand": SwapZonePayload,
+    "set_card_pos": CardPosPayload,
+    "create_token": CreateTokenPayload,
+    "update_token": UpdateTokenPayload,
+    "remove_token": CardPayload,
+    "put_on_bottom": PlayerCardPayload,
+    "toggle_show_hand": PlayerPayload,
+    "set_name": NamePayload,
+    "toggle_show_top": PlayerPayload,
+    "undo": EmptyPayload,
+    "redo": EmptyPayload,
+}
+
 class ServerState(BaseModel):
     kind: Literal["state"]
     state: RoomState
 
+class ServerPatch(BaseModel):
+    """Changes between two consecutive versions of a RoomState.
+
+    Clients apply a patch only when ``base`` equals their current version and
+    ask for a ``resync`` otherwise. ``cards`` maps ids to the new card (or None
+    when the card was removed); ``players`` carries only the changed fields,
+    zone lists included.
+    """
+    kind: Literal["patch"]
+    base: int
+    version: int
+    room: Dict[str, Any] = Field(default_factory=dict)
+    defs: Dict[str, CardDef] = Field(default_factory=dict)  # definitions the peer hasn't seen yet
+    cards: Dict[str, Optional[CardInstance]] = Field(default_factory=dict)
+    players: Dict[str, Dict[str, Any]] = Field(default_factory=dict)
+
+class ClientDrag(BaseModel):
+    """Drag preview: relayed to the other peers, never applied to RoomState."""
+    kind: Literal["drag"]
+    card_id: str
+    x: int
+    y: int
+    z: int = 1
+
+class ServerDrag(BaseModel):
+    kind: Literal["drag"]
+    version: int  # room version the preview was relayed at
+    player_id: Literal["A","B"]
+    card_id: str
+    x: int
+    y: int
+    z: int = 1
+
+class ClientResync(BaseModel):
+    kind: Literal["resync"]
+
 class ServerAck(BaseModel):
     kind: Literal["ack"]
     ok: bool
     msg: Optional[str] = None
+    version: Optional[int] = None  # room version when the ack was sent
+
+def _action_message(action_type: str, payload: type[BaseModel]) -> type[ClientAction]:
+    return create_model(f"ClientAction_{action_type}", __base__=ClientAction,
+                        type=(Literal[action_type], ...), payload=(payload, ...))
+
+# Any message a seated client sends after its hello. Validating the raw frame
+# against this parses, dispatches on kind/type and checks the payload in one go.
+ClientMessage = TypeAdapter(Annotated[
+    Union[
+        ClientDrag,
+        ClientResync,
+        Annotated[Union[tuple(_action_message(t, m) for t, m in CLIENT_ACTIONS.items())],
+                  Field(discriminator="type")],
+    ],
+    Field(discriminator="kind"),
+])
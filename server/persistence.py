@@ -1,9 +1,15 @@
-import json
+import asyncio, json, logging, os, sqlite3, threading
 from pathlib import Path
+from pydantic import BaseModel
+from . import config
+from .metrics import PERSIST_ERRORS, PERSIST_SECONDS
 from .models import RoomState
+from .state import apply_action, history_data, load_history
+
+log = logging.getLogger(__name__)
 
 DATA_DIR = Path(__file__).parent / "data"
-ROOMS_DIR = DATA_DIR / "rooms"
+ROOMS_DIR = Path(config.ROOMS_DIR) if config.ROOMS_DIR else DATA_DIR / "rooms"
 DECKS_DIR = DATA_DIR / "decks"
 ROOMS_DIR.mkdir(parents=True, exist_ok=True)
 DECKS_DIR.mkdir(parents=True, exist_ok=True)
@@ -44,29 +50,265 @@ def _norm_image(path: str | None) -> str | None:
     # fallback: treat as bare filename
     return f"/images/{p.split('/')[-1]}"
 
+class RoomStore:
+    """Where room snapshots and action logs live.
+
+    write() is the only mutator and is atomic per call: a new snapshot (if
+    given) replaces the old one and the log it supersedes, then the entries
+    are appended. Entries are JSON lines; a torn last one is ignored on read.
+    """
+
+    def write(self, room_id: str, snapshot: str | None, entries: list[str]):
+        raise NotImplementedError
+
+    def read(self, room_id: str) -> tuple[str | None, list[str]]:
+        raise NotImplementedError
+
+class FileRoomStore(RoomStore):
+    """One {room_id}.json snapshot and one {room_id}.log.jsonl log per room."""
+
+    def __init__(self, root: Path | None = None):
+        self.root = root
+
+    def _files(self, room_id: str) -> tuple[Path, Path]:
+        root = self.root or ROOMS_DIR
+        return root / f"{room_id}.json", root / f"{room_id}.log.jsonl"
+
+    def write(self, room_id, snapshot, entries):
+        snap, log = self._files(room_id)
+        if snapshot is not None:
+            tmp = snap.with_suffix(".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(snapshot)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, snap)
+            # entries left behind by a crash right here are older than the snapshot and skipped on replay
+            log.unlink(missing_ok=True)
+        if entries:
+            with open(log, "a", encoding="utf-8") as f:
+                f.write("".join(e + "\n" for e in entries))
+
+    def read(self, room_id):
+        snap, log = self._files(room_id)
+        if not snap.exists():
+            return None, []
+        entries = log.read_text(encoding="utf-8").splitlines() if log.exists() else []
+        return snap.read_text(encoding="utf-8"), entries
+
+class SqliteRoomStore(RoomStore):
+    """All rooms in one SQLite database in WAL mode; every write is one transaction."""
+
+    def __init__(self, path: Path | None = None):
+        self.path = path or (Path(config.ROOMS_DIR) if config.ROOMS_DIR else DATA_DIR) / "rooms.sqlite3"
+        self._local = threading.local()
+
+    def _db(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("CREATE TABLE IF NOT EXISTS snapshots (room_id TEXT PRIMARY KEY, data TEXT NOT NULL)")
+            db.execute("CREATE TABLE IF NOT EXISTS log (room_id TEXT NOT NULL, seq INTEGER PRIMARY KEY AUTOINCREMENT, entry TEXT NOT NULL)")
+            db.execute("CREATE INDEX IF NOT EXISTS log_room ON log (room_id, seq)")
+        return db
+
+    def write(self, room_id, snapshot, entries):
+        db = self._db()
+        with db:
+            if snapshot is not None:
+                db.execute("INSERT OR REPLACE INTO snapshots (room_id, data) VALUES (?, ?)", (room_id, snapshot))
+                db.execute("DELETE FROM log WHERE room_id = ?", (room_id,))
+            db.executemany("INSERT INTO log (room_id, entry) VALUES (?, ?)", [(room_id, e) for e in entries])
+
+    def read(self, room_id):
+        db = self._db()
+        row = db.execute("SELECT data FROM snapshots WHERE room_id = ?", (room_id,)).fetchone()
+        if row is None:
+            return None, []
+        entries = [e for (e,) in db.execute("SELECT entry FROM log WHERE room_id = ? ORDER BY seq", (room_id,))]
+        return row[0], entries
+
+_STORE: RoomStore | None = None
+
+def room_store() -> RoomStore:
+    """The process-wide store picked by CGR_ROOM_STORE ("file" or "sqlite")."""
+    global _STORE
+    if _STORE is None:
+        _STORE = SqliteRoomStore() if config.ROOM_STORE == "sqlite" else FileRoomStore()
+    return _STORE
+
+def _log_failure(task: asyncio.Future):
+    if not task.cancelled() and task.exception() is not None:
+        log.error("room write-behind failed", exc_info=task.exception())
+
+class WriteBehind:
+    """Batches room writes and hands them to a worker thread, off the event loop.
+
+    Callers only queue; pending entries of a room are dropped when a snapshot
+    that covers them is queued. Batches are written in order by one thread.
+    """
+
+    def __init__(self, store: RoomStore | None = None, delay_ms: int | None = None):
+        self.store = store
+        self.delay = (config.PERSIST_FLUSH_MS if delay_ms is None else delay_ms) / 1000
+        self.dirty: dict[str, list] = {}  # room_id -> [snapshot | None, entries]
+        self._timer = None
+        self._lock = asyncio.Lock()
+
+    def submit(self, room_id: str, snapshot: str | None = None, entries: list[str] = ()):
+        pending = self.dirty.setdefault(room_id, [None, []])
+        if snapshot is not None:
+            pending[0], pending[1] = snapshot, []
+        pending[1].extend(entries)
+        if self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.delay, self._kick)
+
+    def _kick(self):
+        self._timer = None
+        asyncio.ensure_future(self._drain()).add_done_callback(_log_failure)
+
+    async def _drain(self):
+        async with self._lock:  # one batch in flight keeps writes in order
+            while self.dirty:
+                batch, self.dirty = self.dirty, {}
+                try:
+                    await asyncio.to_thread(self._write, batch)
+                except Exception as e:
+                    PERSIST_ERRORS.inc()
+                    log.error("room writes failed, %d room(s) queued again: %r", len(batch), e)
+                    self._requeue(batch)
+                    if self._timer is None:
+                        self._timer = asyncio.get_running_loop().call_later(max(self.delay, 1.0), self._kick)
+                    return
+
+    def _write(self, batch: dict):
+        """Write batch, removing each room once it is stored; what is left on error was not."""
+        store = self.store or room_store()
+        with PERSIST_SECONDS.time("write"):
+            for room_id in list(batch):
+                snapshot, entries = batch[room_id]
+                store.write(room_id, snapshot, entries)
+                del batch[room_id]
+
+    def _requeue(self, batch: dict):
+        """Put unwritten rooms back in front of whatever was queued for them since."""
+        for room_id, (snapshot, entries) in batch.items():
+            newer = self.dirty.get(room_id)
+            if newer is None:
+                self.dirty[room_id] = [snapshot, entries]
+            elif newer[0] is None:
+                # only entries since: they still build on the old snapshot and entries
+                self.dirty[room_id] = [snapshot, entries + newer[1]]
+            # else a newer snapshot covers everything the failed write held
+
+    async def flush(self):
+        """Write everything queued so far; used on shutdown and before reloading a room."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await self._drain()
+
+def snapshot_text(state: RoomState) -> str:
+    """Compact snapshot: the state plus its shuffle and id RNGs and undo history."""
+    with PERSIST_SECONDS.time("snapshot"):
+        rng = json.dumps(state._rng.getstate(), separators=(",", ":"))
+        ids = json.dumps(state._idrng.getstate(), separators=(",", ":"))
+        history = json.dumps(history_data(state), separators=(",", ":"))
+        return f'{{"rng":{rng},"ids":{ids},"history":{history},"state":{state.model_dump_json()}}}'
+
 def save_room(state: RoomState):
-    f = ROOMS_DIR / f"{state.room_id}.json"
-    f.write_text(state.model_dump_json(indent=2), encoding="utf-8")
+    """Synchronously write a snapshot of state, replacing its log."""
+    room_store().write(state.room_id, snapshot_text(state), [])
 
 def load_room(room_id: str) -> RoomState | None:
-    f = ROOMS_DIR / f"{room_id}.json"
-    if not f.exists():
+    """Latest snapshot plus whatever the action log recorded after it."""
+    with PERSIST_SECONDS.time("load"):
+        return _load_room(room_id)
+
+def _load_room(room_id: str) -> RoomState | None:
+    snapshot, entries = room_store().read(room_id)
+    if snapshot is None:
         return None
-    data = json.loads(f.read_text(encoding="utf-8"))
-    return RoomState.model_validate(data)
+    data = json.loads(snapshot)
+    if "state" not in data:
+        # plain RoomState written before snapshots carried the RNG
+        return RoomState.model_validate(data)
+    state = RoomState.model_validate(data["state"])
+    for attr, key in (("_rng", "rng"), ("_idrng", "ids")):
+        if key in data:  # snapshots before ids had their own RNG keep a fresh one
+            version, internal, gauss = data[key]
+            getattr(state, attr).setstate((version, tuple(internal), gauss))
+    if "history" in data:
+        load_history(state, data["history"])
+    for line in entries:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            break  # torn final append
+        if entry["v"] <= state.version:
+            continue  # already part of the snapshot
+        apply_action(state, entry["type"], entry["payload"], actor=entry.get("by"))
+    return state
 
-def load_deck(name: str) -> list[dict]:
-    """Supports:
-       A) legacy: ["Card A", ...]
-       B) rich: {"cards": [{"name":"...", "qty":3, "image":"images/..jpg", ...}]}
+class RoomJournal:
+    """Append-only action log for one room, compacted into a snapshot every N entries.
+
+    With a WriteBehind the writes are queued; without one they hit the store
+    immediately.
     """
+
+    def __init__(self, room_id: str, writer: WriteBehind | None = None, every: int | None = None):
+        self.room_id = room_id
+        self.writer = writer
+        self.every = every or config.SNAPSHOT_EVERY
+        self.count = 0
+
+    def _write(self, snapshot: str | None, entries: list[str]):
+        if self.writer is not None:
+            self.writer.submit(self.room_id, snapshot, entries)
+        else:
+            room_store().write(self.room_id, snapshot, entries)
+
+    def start(self, state: RoomState):
+        """Begin a fresh log on top of a snapshot of state."""
+        self._write(snapshot_text(state), [])
+        self.count = 0
+
+    def record(self, state: RoomState, action_type: str, payload, actor: str | None = None):
+        """Log an action that was just applied to state (state.version is its result) by seat actor."""
+        self.count += 1
+        if self.count >= self.every:
+            self.start(state)
+            return
+        if isinstance(payload, BaseModel):
+            payload = payload.model_dump(mode="json", exclude_unset=True)
+        entry = {"v": state.version, "type": action_type, "payload": payload}
+        if actor is not None:
+            entry["by"] = actor
+        line = json.dumps(entry, separators=(",", ":"))
+        self._write(None, [line])
+
+# deck file -> (mtime_ns, normalized and qty-expanded card templates)
+_DECKS: dict[Path, tuple[int, list[dict]]] = {}
+
+def _deck_path(name: str) -> Path:
     deck_file = name if name.lower().endswith(".json") else f"{name}.json"
-    p = DECKS_DIR / deck_file
-    if not p.exists():
-        # fallback: 40 generic cards
-        return [{"name": f"Card {i+1}"} for i in range(40)]
-    data = json.loads(p.read_text(encoding="utf-8"))
+    return DECKS_DIR / deck_file
 
+def _cached_deck(p: Path) -> list[dict] | None:
+    hit = _DECKS.get(p)
+    if hit is None:
+        return None
+    try:
+        if p.stat().st_mtime_ns != hit[0]:
+            return None
+    except OSError:
+        return None
+    return list(hit[1])
+
+def _parse_deck(data) -> list[dict]:
     # legacy list
     if isinstance(data, list):
         return [{"name": n} if isinstance(n, str) else n for n in data]
@@ -82,6 +324,31 @@ def load_deck(name: str) -> list[dict]:
             "set": c.get("set"),
             "collector_number": c.get("collector_number"),
         }
-        cards.extend([base.copy() for _ in range(qty)])
+        # copies share one template; card templates are never mutated
+        cards.extend([base] * qty)
     return cards
 
+def load_deck(name: str) -> list[dict]:
+    """Supports:
+       A) legacy: ["Card A", ...]
+       B) rich: {"cards": [{"name":"...", "qty":3, "image":"images/..jpg", ...}]}
+
+    Parsed decks are cached until their file's mtime changes. The returned
+    list is the caller's, the card dicts in it are shared and read-only.
+    """
+    p = _deck_path(name)
+    hit = _cached_deck(p)
+    if hit is not None:
+        return hit
+    try:
+        mtime = p.stat().st_mtime_ns
+    except OSError:
+        # fallback: 40 generic cards
+        return [{"name": f"Card {i+1}"} for i in range(40)]
+    cards = _parse_deck(json.loads(p.read_text(encoding="utf-8")))
+    _DECKS[p] = (mtime, cards)
+    return list(cards)
+
+async def load_deck_async(name: str) -> list[dict]:
+    """load_deck from a worker thread: even a cache hit stats the file, which may block."""
+    return await asyncio.to_thread(load_deck, name)
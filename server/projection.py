@@ -0,0 +1,98 @@
+"""What each seat is allowed to see.
+
+Hidden cards are sent as HIDDEN placeholders in their zone lists and left out
+of `cards`, so counts stay right without leaking identities or library order:
+  - libraries are hidden from everyone, except the top card while show_top is on
+  - hands are visible to their owner, and to everyone while show_hand is on
+  - graveyard/exile are hidden from everyone while hide_graveyard_top/hide_exile_top is on
+  - battlefields are public
+viewer is a seat id, or None for the public (no seat) view.
+"""
+from typing import Dict
+
+from .models import PlayerState, RoomState, ServerPatch
+from .state import ZONES, Changes, locate
+
+HIDDEN = "?"
+
+# player flag -> zone whose visibility it controls
+FLAG_ZONES = {
+    "show_hand": "hand",
+    "show_top": "library",
+    "hide_graveyard_top": "graveyard",
+    "hide_exile_top": "exile",
+}
+
+def _visible_count(pl: PlayerState, zone: str, viewer: str | None) -> int | None:
+    """How many cards from the top of zone the viewer may see (None = all)."""
+    if zone == "library":
+        return 1 if pl.show_top else 0
+    if zone == "hand":
+        return None if (viewer == pl.id or pl.show_hand) else 0
+    if zone == "graveyard" and pl.hide_graveyard_top:
+        return 0
+    if zone == "exile" and pl.hide_exile_top:
+        return 0
+    return None
+
+def zone_view(pl: PlayerState, zone: str, viewer: str | None) -> list:
+    z = getattr(pl, zone)
+    n = _visible_count(pl, zone, viewer)
+    if n is None:
+        return list(z)
+    if n == 0 or not z:
+        return [HIDDEN] * len(z)
+    return [HIDDEN] * (len(z) - 1) + [z[-1]]
+
+def is_visible(s: RoomState, cid: str, viewer: str | None) -> bool:
+    loc = locate(s, cid)
+    if loc is None:
+        return True  # not in any zone (e.g. just removed)
+    pid, zone, _ = loc
+    pl = s.players[pid]
+    n = _visible_count(pl, zone, viewer)
+    if n is None:
+        return True
+    return n == 1 and getattr(pl, zone)[-1] == cid
+
+def project_state(s: RoomState, viewer: str | None) -> RoomState:
+    """A shallow copy of s with hidden cards replaced; card objects are shared, not copied."""
+    players = {}
+    cards = {}
+    for pid, pl in s.players.items():
+        views = {zone: zone_view(pl, zone, viewer) for zone in ZONES}
+        players[pid] = pl.model_copy(update=views)
+        for ids in views.values():
+            for cid in ids:
+                if cid != HIDDEN and cid in s.cards:
+                    cards[cid] = s.cards[cid]
+    return s.model_copy(update={"players": players, "cards": cards})
+
+def project_patch(s: RoomState, ch: Changes, base: int, viewer: str | None) -> ServerPatch:
+    zones = set(ch.zones)
+    revealed = set()
+    players: Dict[str, Dict[str, object]] = {}
+    for pid, name in ch.fields:
+        players.setdefault(pid, {})[name] = getattr(s.players[pid], name)
+        if name in FLAG_ZONES:
+            # a visibility flag flipped: resend that zone and any cards it now shows
+            zones.add((pid, FLAG_ZONES[name]))
+            revealed.add((pid, FLAG_ZONES[name]))
+    cards = {cid: s.cards.get(cid) for cid in ch.cards if is_visible(s, cid, viewer)}
+    for pid, zone in zones:
+        pl = s.players[pid]
+        view = zone_view(pl, zone, viewer)
+        players.setdefault(pid, {})[zone] = view
+        if zone == "library" or (pid, zone) in revealed:
+            for cid in view:
+                if cid != HIDDEN and cid in s.cards:
+                    cards[cid] = s.cards[cid]
+    return ServerPatch(
+        kind="patch",
+        base=base,
+        version=s.version,
+        room={k: getattr(s, k) for k in ch.room},
+        defs={did: s.defs[did] for did in ch.defs},
+        cards=cards,
+        players=players,
+    )
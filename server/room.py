@@ -0,0 +1,297 @@
+import asyncio, logging, time
+from collections import deque
+from typing import Deque, Dict, Tuple
+
+from . import config, metrics
+from .broadcast import Peer, fan_out
+from .codec import Frame
+from .models import ClientDrag, RoomState, ServerAck, ServerDrag, ServerState
+from .persistence import RoomJournal
+from .projection import is_visible, project_patch, project_state
+from .state import SERVER_ACTIONS, ZONES, Changes, apply_action, parse_payload
+
+log = logging.getLogger(__name__)
+
+class Room:
+    """A live room: its state plus the peers watching it.
+
+    Client actions are not applied by the connection that received them but
+    submitted to the room's actor task, which applies everything queued in
+    arrival order and broadcasts one patch per drain cycle.
+
+    Every peer gets the projection of the state its seat may see (see
+    projection.py); frames are built once per viewer, not once per peer.
+    Spectators sit on a separate tier: their changes are merged and sent as
+    one shared public patch at most config.SPECTATOR_FPS times a second.
+
+    The Changes of the last config.RESUME_BUFFER broadcasts are kept, so a
+    player who reconnects with their session id gets one patch covering
+    what they missed (catch_up) rather than a full snapshot.
+    """
+
+    def __init__(self, state: RoomState, journal: RoomJournal | None = None):
+        self.state = state
+        self.journal = journal
+        self.peers: Dict[object, Peer] = {}
+        # Per-card drag traffic waiting for the next tick
+        self.pending_pos: Dict[str, tuple] = {}  # card id -> (payload, actor)
+        self.pending_drag: Dict[str, Tuple[Peer, ServerDrag]] = {}
+        self._tick = None
+        self.inbox: Deque[Tuple[str, dict, Peer | None]] = deque()
+        self._wake = asyncio.Event()
+        self._actor: asyncio.Task | None = None
+        self.spectators: Dict[object, Peer] = {}
+        # Changes since the spectators' last frame, which was built at version _spec_base
+        self._spec_changes: Changes | None = None
+        self._spec_base = 0
+        self._spec_tick = None
+        # viewer -> (state, version, snapshot frame); state too, since load() swaps it out
+        self._snapshots: Dict[str | None, Tuple[RoomState, int, Frame]] = {}
+        # (base, version, changes) per broadcast, oldest first; viewer independent
+        self.recent: Deque[Tuple[int, int, Changes]] = deque(maxlen=config.RESUME_BUFFER)
+        self._resume_floor = state.version  # catch_up never starts below this version
+        self.sessions: Dict[str, str] = {}  # seat -> session id of its latest join
+
+    def snapshot(self, viewer: str | None = None) -> Frame:
+        cached = self._snapshots.get(viewer)
+        if cached and cached[0] is self.state and cached[1] == self.state.version:
+            return cached[2]
+        frame = Frame(ServerState(kind="state", state=project_state(self.state, viewer)))
+        self._snapshots[viewer] = (self.state, self.state.version, frame)
+        return frame
+
+    def join(self, ws, encoding: str = "json", viewer: str | None = None, first: Frame | None = None) -> Peer:
+        """Add a peer; its first frame is first (a catch_up patch) or else its snapshot."""
+        peer = self.peers[ws] = Peer(ws, lambda: self.snapshot(viewer), encoding, viewer=viewer)
+        peer.push(first or self.snapshot(viewer))
+        return peer
+
+    def resumes(self, pid: str, session: str | None) -> bool:
+        """Whether session is the seat's latest join; a different one takes the seat over."""
+        if session is None:
+            return False
+        if self.sessions.get(pid) == session:
+            return True
+        self.sessions[pid] = session
+        return False
+
+    def catch_up(self, viewer: str | None, since: int) -> Frame | None:
+        """One patch from version since to now, or None when the buffer no longer reaches back that far."""
+        if since < self._resume_floor or since > self.state.version:
+            return None
+        merged, version = Changes(), since
+        for base, to, ch in self.recent:
+            if to <= since:
+                continue
+            if base != version:
+                return None  # rolled past since
+            merged.merge(ch)
+            version = to
+        if version != self.state.version:
+            return None
+        return Frame(project_patch(self.state, merged, since, viewer))
+
+    def forget_history(self):
+        """The state was replaced: versions up to now may mean something else than clients think."""
+        self.recent.clear()
+        self._resume_floor = self.state.version + 1
+
+    def watch(self, ws, encoding: str = "json") -> Peer:
+        """Add a spectator: public view only, throttled, never acts."""
+        peer = self.spectators[ws] = Peer(ws, self.snapshot, encoding)
+        peer.push(self.snapshot())
+        return peer
+
+    def leave(self, ws):
+        spectator = self.spectators.pop(ws, None)
+        if spectator:
+            spectator.close()
+            return
+        peer = self.peers.pop(ws, None)
+        if peer:
+            peer.close()
+        if not self.peers:
+            self.drain()
+            self.flush()
+
+    def broadcast(self, frame: Frame | None = None):
+        """Queue one frame (default: each viewer's snapshot) for every peer; each encoding is built once."""
+        if frame is not None:
+            self._drop(fan_out(self.peers.values(), frame))
+            return
+        for viewer, peers in self._viewers().items():
+            self._drop(fan_out(peers, self.snapshot(viewer)))
+        if self.spectators:
+            # the snapshot supersedes whatever the spectators were waiting for
+            self._spec_changes = None
+            self._drop_spectators(fan_out(self.spectators.values(), self.snapshot()))
+
+    def broadcast_changes(self, ch: Changes, base: int):
+        if not ch:
+            return
+        self.recent.append((base, self.state.version, ch))
+        t0 = time.perf_counter()
+        for viewer, peers in self._viewers().items():
+            self._drop(fan_out(peers, Frame(project_patch(self.state, ch, base, viewer))))
+        metrics.BROADCAST_SECONDS.observe(time.perf_counter() - t0, "players")
+        if self.spectators:
+            if self._spec_changes is None:
+                self._spec_changes, self._spec_base = Changes(), base
+            self._spec_changes.merge(ch)
+            if self._spec_tick is None:
+                self._spec_tick = asyncio.get_running_loop().call_later(
+                    1 / max(config.SPECTATOR_FPS, 1), self._send_spectators)
+
+    def _send_spectators(self):
+        self._spec_tick = None
+        ch, self._spec_changes = self._spec_changes, None
+        if ch and self.spectators:
+            t0 = time.perf_counter()
+            frame = Frame(project_patch(self.state, ch, self._spec_base, None))
+            self._drop_spectators(fan_out(self.spectators.values(), frame))
+            metrics.BROADCAST_SECONDS.observe(time.perf_counter() - t0, "spectators")
+
+    def _drop_spectators(self, peers):
+        for peer in peers:
+            self.spectators.pop(peer.ws, None)
+
+    def _viewers(self) -> Dict[str | None, list]:
+        groups: Dict[str | None, list] = {}
+        for peer in self.peers.values():
+            groups.setdefault(peer.viewer, []).append(peer)
+        return groups
+
+    def _drop(self, peers):
+        for peer in peers:
+            self.peers.pop(peer.ws, None)
+
+    def submit(self, action_type: str, payload, peer: Peer | None = None):
+        """Queue a client action for the room's actor; peer, if given, hears about it failing."""
+        self.inbox.append((action_type, payload, peer))
+        self._wake.set()
+        if self._actor is None:
+            self._actor = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            self.drain()
+
+    def drain(self):
+        """Apply every queued action in order and broadcast their combined patch."""
+        if not self.inbox:
+            return
+        base = self.state.version
+        ch = Changes()
+        failed = []
+        while self.inbox:
+            action_type, payload, peer = self.inbox.popleft()
+            try:
+                self.apply(action_type, payload, ch, None if peer is None else peer.viewer)
+            except Exception as e:
+                # a broken payload must not take the room down; the client that sent it is told
+                metrics.ACTION_ERRORS.inc(action_type)
+                log.debug("room %s: %s failed: %r", self.state.room_id, action_type, e)
+                if peer is not None:
+                    failed.append((peer, action_type))
+        self.broadcast_changes(ch, base)
+        # after the patch, so the ack's version never runs ahead of what the peer holds
+        for peer, action_type in failed:
+            if peer.ws in self.peers:
+                peer.push(Frame(ServerAck(kind="ack", ok=False, msg=f"{action_type} failed",
+                                          version=self.state.version)))
+
+    def close(self):
+        """Stop the actor and tick; the room is going away."""
+        self.drain()
+        self.flush()
+        if self._spec_tick is not None:
+            self._spec_tick.cancel()
+            self._spec_tick = None
+        if self._actor is not None:
+            self._actor.cancel()
+            self._actor = None
+
+    def apply(self, action_type: str, payload, ch: Changes | None = None, actor: str | None = None):
+        """Apply a client action sent by seat actor; without ch its patch is broadcast right away."""
+        if action_type in SERVER_ACTIONS:
+            return
+        payload = parse_payload(action_type, payload)
+        if action_type == "set_card_pos" and config.POS_COALESCE_MS > 0:
+            self.pending_pos[payload.card_id] = (payload, actor)
+            self._schedule()
+            return
+        own = ch is None
+        base = self.state.version
+        ch = Changes() if own else ch
+        # Anything else may depend on where cards ended up, so settle positions first
+        self.flush(ch)
+        self._commit(action_type, payload, ch, actor)
+        if own:
+            self.broadcast_changes(ch, base)
+
+    def seat(self, pid: str, deck: list | None, name: str | None):
+        """A player (re)joins: optionally replace their cards with deck and rename them."""
+        self.drain()  # actions that arrived before the join come first
+        base = self.state.version
+        ch = Changes()
+        self.flush(ch)
+        if deck:
+            self._commit("seat_deck", {"player_id": pid, "deck": deck}, ch)
+        if name:
+            self._commit("set_name", {"player_id": pid, "name": name}, ch)
+        # Peers already seated only need what the joiner changed
+        self.broadcast_changes(ch, base)
+
+    def seat_is_empty(self, pid: str) -> bool:
+        pl = self.state.players[pid]
+        return not any(len(getattr(pl, zone)) for zone in ZONES)
+
+    def _commit(self, action_type: str, payload, ch: Changes, actor: str | None = None):
+        version = self.state.version
+        t0 = time.perf_counter()
+        apply_action(self.state, action_type, payload, ch, actor)
+        metrics.ACTION_SECONDS.observe(time.perf_counter() - t0, action_type)
+        if self.journal and self.state.version != version:
+            self.journal.record(self.state, action_type, payload, actor)
+
+    def drag(self, peer: Peer, pid: str, msg: ClientDrag):
+        if msg.card_id not in self.state.cards:
+            return
+        self.pending_drag[msg.card_id] = (peer, ServerDrag(kind="drag", version=self.state.version, player_id=pid,
+                                                           card_id=msg.card_id, x=msg.x, y=msg.y, z=msg.z))
+        self._schedule()
+
+    def _schedule(self):
+        if self._tick is None:
+            self._tick = asyncio.get_running_loop().call_later(config.POS_COALESCE_MS / 1000, self.flush)
+
+    def flush(self, ch: Changes | None = None):
+        """Send the latest drag preview per card and commit pending positions.
+
+        The positions go into ch when given, else out as a patch of their own.
+        """
+        if self._tick is not None:
+            self._tick.cancel()
+            self._tick = None
+        drags, self.pending_drag = self.pending_drag, {}
+        for cid, (sender, frame) in drags.items():
+            if cid in self.pending_pos:
+                continue  # the committed position supersedes the preview
+            data = Frame(frame)
+            for peer in list(self.peers.values()):
+                if peer is sender or not is_visible(self.state, cid, peer.viewer):
+                    continue
+                if not peer.push(data):
+                    self.peers.pop(peer.ws, None)
+        if not self.pending_pos:
+            return
+        pending, self.pending_pos = self.pending_pos, {}
+        own = ch is None
+        base = self.state.version
+        ch = Changes() if own else ch
+        for payload, actor in pending.values():
+            self._commit("set_card_pos", payload, ch, actor)
+        if own:
+            self.broadcast_changes(ch, base)
@@ -0,0 +1,291 @@
+"""Multi-process room sharding.
+
+Every room is owned by one shard worker process, picked by a stable hash of
+its id unless a move pinned it elsewhere. The web processes running
+server.app relay websocket frames and room calls to the owner over a Unix
+socket, and the owner runs the room in its own RoomHost. Moving a room makes
+the old owner persist and forget it; the new owner loads it from the shared
+room store on the next connection.
+
+    python -m server.sharding serve --shards 4 --workers 4
+    python -m server.sharding move ROOM_ID SHARD
+"""
+import argparse, asyncio, json, logging, multiprocessing, os, zlib
+from pathlib import Path
+
+from . import config
+from .host import RoomHost
+
+log = logging.getLogger(__name__)
+
+# Frames on a shard socket: 1 byte kind, 4 byte big-endian length, payload
+TEXT, BINARY, CLOSE = b"T", b"B", b"C"
+
+# Calls a web process may make on the owner of a room
+OPS = ("save", "load", "state", "release", "readmit", "scrape")
+
+async def read_frame(reader: asyncio.StreamReader) -> tuple[bytes, bytes]:
+    head = await reader.readexactly(5)
+    return head[:1], await reader.readexactly(int.from_bytes(head[1:], "big"))
+
+def write_frame(writer: asyncio.StreamWriter, kind: bytes, data: bytes):
+    writer.write(kind + len(data).to_bytes(4, "big") + data)
+
+def shard_for(room_id: str, shards: int) -> int:
+    return zlib.crc32(room_id.encode("utf-8")) % shards
+
+class ShardRoutes:
+    """Room -> shard. Pins written by moves live in a JSON file so every process agrees."""
+
+    def __init__(self, shards: int, path: Path | None = None):
+        self.shards = shards
+        self.path = path
+        self._pins: dict[str, int] = {}
+        self._mtime = None
+
+    def _refresh(self):
+        if self.path is None:
+            return
+        try:
+            mtime = self.path.stat().st_mtime_ns
+        except OSError:
+            self._pins, self._mtime = {}, None
+            return
+        if mtime != self._mtime:
+            self._pins = json.loads(self.path.read_text(encoding="utf-8"))
+            self._mtime = mtime
+
+    def owner(self, room_id: str) -> int:
+        self._refresh()
+        return self._pins.get(room_id, shard_for(room_id, self.shards))
+
+    def pin(self, room_id: str, shard: int):
+        self._refresh()
+        self._pins = dict(self._pins)
+        if shard == shard_for(room_id, self.shards):
+            self._pins.pop(room_id, None)
+        else:
+            self._pins[room_id] = shard
+        if self.path is not None:
+            tmp = self.path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(self._pins), encoding="utf-8")
+            os.replace(tmp, self.path)
+            self._mtime = self.path.stat().st_mtime_ns
+
+class StreamConnection:
+    """The shard side of a relayed websocket, with the WebSocket methods RoomHost uses."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    async def receive(self) -> dict:
+        kind, data = await read_frame(self.reader)
+        if kind == TEXT:
+            return {"type": "websocket.receive", "text": data.decode("utf-8")}
+        if kind == BINARY:
+            return {"type": "websocket.receive", "bytes": data}
+        return {"type": "websocket.disconnect"}
+
+    async def receive_text(self) -> str:
+        kind, data = await read_frame(self.reader)
+        if kind != TEXT:
+            raise ConnectionError("client went away")
+        return data.decode("utf-8")
+
+    async def send_text(self, text: str):
+        write_frame(self.writer, TEXT, text.encode("utf-8"))
+        await self.writer.drain()
+
+    async def send_bytes(self, data: bytes):
+        write_frame(self.writer, BINARY, data)
+        await self.writer.drain()
+
+    async def close(self, code: int = 1000):
+        write_frame(self.writer, CLOSE, code.to_bytes(2, "big"))
+        await self.writer.drain()
+        self.writer.close()
+
+class LocalBroker:
+    """In-process stand-in for shard workers: one RoomHost per shard, same routing."""
+
+    def __init__(self, hosts: list[RoomHost], routes: ShardRoutes | None = None):
+        self.hosts = hosts
+        self.routes = routes or ShardRoutes(len(hosts))
+
+    async def relay(self, ws, room_id: str):
+        await self.hosts[self.routes.owner(room_id)].serve(ws, room_id)
+
+    async def call(self, room_id: str, op: str, shard: int | None = None) -> dict:
+        owner = self.routes.owner(room_id) if shard is None else shard
+        return await getattr(self.hosts[owner], op)(room_id)
+
+    async def move(self, room_id: str, shard: int):
+        await _move(self, room_id, shard)
+
+class UnixBroker:
+    """Routes rooms to shard worker processes listening on Unix sockets."""
+
+    def __init__(self, routes: ShardRoutes, socket_dir: Path):
+        self.routes = routes
+        self.socket_dir = socket_dir
+
+    async def _open(self, room_id: str, op: str, shard: int | None = None):
+        owner = self.routes.owner(room_id) if shard is None else shard
+        reader, writer = await asyncio.open_unix_connection(socket_path(self.socket_dir, owner))
+        write_frame(writer, TEXT, json.dumps({"op": op, "room_id": room_id}).encode("utf-8"))
+        await writer.drain()
+        return reader, writer
+
+    async def call(self, room_id: str, op: str, shard: int | None = None) -> dict:
+        reader, writer = await self._open(room_id, op, shard)
+        try:
+            _, data = await read_frame(reader)
+            return json.loads(data)
+        finally:
+            writer.close()
+
+    async def move(self, room_id: str, shard: int):
+        await _move(self, room_id, shard)
+
+    async def relay(self, ws, room_id: str):
+        """Pipe an accepted Starlette WebSocket to the room's owner until either side closes."""
+        try:
+            reader, writer = await self._open(room_id, "serve")
+        except OSError:
+            await ws.close(code=1011)
+            return
+
+        async def upstream():
+            while True:
+                msg = await ws.receive()
+                if msg["type"] == "websocket.disconnect":
+                    write_frame(writer, CLOSE, b"")
+                    await writer.drain()
+                    return
+                if msg.get("text") is not None:
+                    write_frame(writer, TEXT, msg["text"].encode("utf-8"))
+                elif msg.get("bytes") is not None:
+                    write_frame(writer, BINARY, msg["bytes"])
+                try:
+                    await writer.drain()
+                except ConnectionError:
+                    await ws.close(code=1011)
+                    return
+
+        async def downstream():
+            while True:
+                try:
+                    kind, data = await read_frame(reader)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    # The shard went away without a CLOSE frame; let the client reconnect
+                    await ws.close(code=1011)
+                    return
+                if kind == TEXT:
+                    await ws.send_text(data.decode("utf-8"))
+                elif kind == BINARY:
+                    await ws.send_bytes(data)
+                else:
+                    await ws.close(code=int.from_bytes(data, "big") if data else 1000)
+                    return
+
+        tasks = [asyncio.ensure_future(upstream()), asyncio.ensure_future(downstream())]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for t in tasks:
+                t.cancel()
+            for r in await asyncio.gather(*tasks, return_exceptions=True):
+                if isinstance(r, Exception):
+                    log.warning("room %s: relay failed: %r", room_id, r)
+            writer.close()
+
+async def _move(broker, room_id: str, shard: int):
+    old = broker.routes.owner(room_id)
+    if old == shard:
+        return
+    # Old owner snapshots the room and turns its connections away...
+    await broker.call(room_id, "release", old)
+    # ...new connections go to the new owner, which loads the snapshot on first join
+    broker.routes.pin(room_id, shard)
+    await broker.call(room_id, "readmit", old)
+
+def socket_path(socket_dir: Path, shard: int) -> str:
+    return str(Path(socket_dir) / f"shard-{shard}.sock")
+
+def make_broker() -> UnixBroker:
+    socket_dir = Path(config.SHARD_DIR)
+    return UnixBroker(ShardRoutes(config.SHARDS, socket_dir / "routes.json"), socket_dir)
+
+async def run_shard(index: int, socket_dir: Path, host: RoomHost | None = None):
+    """Serve the rooms of one shard on its Unix socket until cancelled."""
+    host = host or RoomHost()
+
+    async def handle(reader, writer):
+        try:
+            _, data = await read_frame(reader)
+            req = json.loads(data)
+            if req["op"] == "serve":
+                await host.serve(StreamConnection(reader, writer), req["room_id"])
+            elif req["op"] in OPS:
+                result = await getattr(host, req["op"])(req["room_id"])
+                write_frame(writer, TEXT, json.dumps(result).encode("utf-8"))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    path = socket_path(socket_dir, index)
+    Path(socket_dir).mkdir(parents=True, exist_ok=True)
+    if os.path.exists(path):
+        os.unlink(path)
+    server = await asyncio.start_unix_server(handle, path)
+    sweeper = asyncio.ensure_future(host.sweep())
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        sweeper.cancel()
+        await host.writer.flush()
+
+def _shard_main(index: int, socket_dir: str):
+    try:
+        asyncio.run(run_shard(index, Path(socket_dir)))
+    except KeyboardInterrupt:
+        pass
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m server.sharding")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    serve = sub.add_parser("serve", help="start shard workers plus the web front")
+    serve.add_argument("--shards", type=int, default=os.cpu_count() or 1)
+    serve.add_argument("--workers", type=int, default=1, help="uvicorn web workers")
+    serve.add_argument("--host", default="0.0.0.0")
+    serve.add_argument("--port", type=int, default=8000)
+    move = sub.add_parser("move", help="hand a room over to another shard")
+    move.add_argument("room_id")
+    move.add_argument("shard", type=int)
+    args = ap.parse_args(argv)
+
+    if args.cmd == "move":
+        if not config.SHARDS:
+            ap.error("set CGR_SHARDS to the shard count of the running server")
+        asyncio.run(make_broker().move(args.room_id, args.shard))
+        return
+
+    import uvicorn
+    os.environ["CGR_SHARDS"] = str(args.shards)
+    os.environ["CGR_SHARD_DIR"] = config.SHARD_DIR
+    procs = [multiprocessing.Process(target=_shard_main, args=(i, config.SHARD_DIR), daemon=True)
+             for i in range(args.shards)]
+    for p in procs:
+        p.start()
+    try:
+        uvicorn.run("server.app:app", host=args.host, port=args.port, workers=args.workers)
+    finally:
+        for p in procs:
+            p.terminate()
+
+if __name__ == "__main__":
+    main()
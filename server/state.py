@@ -1,235 +1,575 @@
-import random, uuid
-from typing import Dict, List
-from .models import RoomState, PlayerState, CardInstance
+import random
+from typing import Callable, Dict, List, Set, Tuple
+from pydantic import BaseModel
+from .models import (DEF_FIELDS, Zone, CLIENT_ACTIONS, RoomState, PlayerState, CardDef, CardInstance, ServerPatch,
+                     CardPayload, CardPosPayload, CreateTokenPayload, DeltaPayload, DrawPayload, EmptyPayload,
+                     MovePayload, MulliganPayload, NamePayload, PhasePayload, PlayerCardPayload, PlayerPayload,
+                     SeatDeckPayload, SwapZonePayload, UpdateTokenPayload)
 
-def _uid() -> str:
-    return uuid.uuid4().hex[:12]
+ZONES = ("library", "hand", "battlefield", "graveyard", "exile")
 
-def _mk_card(desc) -> CardInstance:
+# Actions the server issues itself (joins, restores); never accepted from clients
+SERVER_ACTIONS = {"seat_deck"}
+
+def _uid(rng=random) -> str:
+    return f"{rng.getrandbits(48):012x}"
+
+# Definitions are interned process-wide, so rooms playing the same decks share them
+_DEFS: Dict[tuple, Tuple[str, CardDef]] = {}
+
+def _intern(fields: tuple) -> Tuple[str, CardDef]:
+    hit = _DEFS.get(fields)
+    if hit is None:
+        hit = _DEFS[fields] = (CardDef.ident(fields), CardDef(**dict(zip(DEF_FIELDS, fields))))
+    return hit
+
+def _mk_card(s: RoomState, desc, ch: "Changes | None" = None) -> CardInstance:
     if isinstance(desc, str):
-        return CardInstance(id=_uid(), name=desc)
-    return CardInstance(
-        id=_uid(),
-        name=desc.get("name","Card"),
-        image=desc.get("image"),
-        scryfall_id=desc.get("scryfall_id"),
-        set=desc.get("set"),
-        collector_number=desc.get("collector_number"),
+        fields = (desc, None, None, None, None)
+    else:
+        fields = (desc.get("name", "Card"),) + tuple(desc.get(k) for k in DEF_FIELDS[1:])
+    did, d = _intern(fields)
+    if did not in s.defs:
+        s.defs[did] = d
+        if ch is not None:
+            ch.defs.add(did)
+    return CardInstance(id=_uid(s._idrng), def_id=did)
+
+class Changes:
+    """What a single apply_action call touched.
+
+    Handlers mark cards, zones and fields before they mutate them; build_patch
+    turns the record into a ServerPatch holding just those parts. Made with
+    the state (Changes(s)) it also keeps the pre-image of every part on first
+    touch: a card copy, a field value, and for a zone the log of its edits
+    (Zone.start_log), i.e. the ids that moved and where they sat. That is all
+    undo needs, so a history step costs memory in proportion to what the
+    action changed. Zones replaced as a whole (swaps) keep all their ids.
+    Cards passed as moved only changed zones and get no pre-image; cards that
+    are created, edited or removed must be marked with card().
+    """
+
+    def __init__(self, s: RoomState | None = None):
+        self.cards: Set[str] = set()
+        self.defs: Set[str] = set()
+        self.zones: Set[Tuple[str, str]] = set()
+        self.fields: Set[Tuple[str, str]] = set()
+        self.room: Set[str] = set()
+        self._s = s
+        # ("card", cid) | ("zone", pid, zone) | ("field", pid, name) | ("room", name) -> value before
+        self.before: Dict[tuple, object] = {}
+        self._logging: List[Zone] = []
+        self.actor: str | None = None  # the seat whose action this is; set by apply_action
+
+    def __bool__(self):
+        return bool(self.cards or self.zones or self.fields or self.room)
+
+    def _keep(self, key: tuple, read: Callable[[], object]):
+        if self._s is not None and key not in self.before:
+            self.before[key] = read()
+
+    def card(self, cid: str):
+        def read():
+            c = self._s.cards.get(cid)
+            return None if c is None else c.model_copy()
+        self._keep(("card", cid), read)
+        self.cards.add(cid)
+
+    def zone(self, pid: str, zone: str, moved=(), whole: bool = False):
+        """Mark a zone; pass whole=True when it is about to be swapped out rather than edited."""
+        key = ("zone", pid, zone)
+        if self._s is not None and key not in self.before:
+            z = getattr(self._s.players[pid], zone)
+            if whole:
+                self.before[key] = [z.keep_all()]
+            else:
+                self.before[key] = z.start_log()
+                self._logging.append(z)
+        self.zones.add((pid, zone))
+        self.cards.update(moved)
+
+    def field(self, pid: str, name: str):
+        self._keep(("field", pid, name), lambda: getattr(self._s.players[pid], name))
+        self.fields.add((pid, name))
+
+    def room_field(self, *names: str):
+        for name in names:
+            self._keep(("room", name), lambda: getattr(self._s, name))
+            self.room.add(name)
+
+    def close(self):
+        """Done recording; the history must not keep reading (or logging) the live state."""
+        for z in self._logging:
+            z.stop_log()
+        self._logging = []
+        self._s = None
+
+    def merge(self, other: "Changes"):
+        """Take over other's marks (not its pre-images)."""
+        self.cards |= other.cards
+        self.defs |= other.defs
+        self.zones |= other.zones
+        self.fields |= other.fields
+        self.room |= other.room
+
+def _index(s: RoomState) -> Dict[str, tuple]:
+    if s._loc is None:
+        s._loc = {cid: (pid, zone)
+                  for pid, pl in s.players.items()
+                  for zone in ZONES
+                  for cid in getattr(pl, zone)}
+    return s._loc
+
+def locate(s: RoomState, cid: str) -> Tuple[str, str, int] | None:
+    """Where a card is: (player_id, zone, order key) or None when it is in no zone.
+
+    The order key only compares cards in the same zone (Zone.order_key); it is not an index.
+    """
+    loc = _index(s).get(cid)
+    if loc is None:
+        return None  # every edit that takes a card out of all zones drops its entry
+    if cid not in getattr(s.players[loc[0]], loc[1]):
+        # zones were edited behind the index's back; rebuild once
+        s._loc = None
+        loc = _index(s).get(cid)
+        if loc is None:
+            return None
+    pid, zone = loc
+    return pid, zone, getattr(s.players[pid], zone).order_key(cid)
+
+def _put(s: RoomState, pid: str, zone: str, cid: str, bottom: bool = False):
+    z = getattr(s.players[pid], zone)
+    if bottom:
+        z.appendleft(cid)
+    else:
+        z.append(cid)
+    _index(s)[cid] = (pid, zone)
+
+def _take(s: RoomState, cid: str, loc: Tuple[str, str, int] | None = None) -> Tuple[str, str] | None:
+    """Remove cid from its zone; pass loc when the caller already located it."""
+    loc = loc or locate(s, cid)
+    if loc is None:
+        return None
+    pid, zone, _ = loc
+    getattr(s.players[pid], zone).remove(cid)
+    del s._loc[cid]
+    return pid, zone
+
+def _reindex(s: RoomState, pid: str, zone: str):
+    idx = _index(s)
+    for cid in getattr(s.players[pid], zone):
+        idx[cid] = (pid, zone)
+
+def build_patch(s: RoomState, ch: Changes, base: int) -> ServerPatch:
+    players: Dict[str, Dict[str, object]] = {}
+    for pid, zone in ch.zones:
+        players.setdefault(pid, {})[zone] = list(getattr(s.players[pid], zone))
+    for pid, name in ch.fields:
+        players.setdefault(pid, {})[name] = getattr(s.players[pid], name)
+    return ServerPatch(
+        kind="patch",
+        base=base,
+        version=s.version,
+        room={k: getattr(s, k) for k in ch.room},
+        defs={did: s.defs[did] for did in ch.defs},
+        cards={cid: s.cards.get(cid) for cid in ch.cards},
+        players=players,
     )
 
-def new_room(room_id: str, deckA: List[dict] | None = None, deckB: List[dict] | None = None) -> RoomState:
-    pA = PlayerState(id="A")
-    pB = PlayerState(id="B")
-    cards: Dict[str, CardInstance] = {}
+def seat_deck(s: RoomState, pid: str, deck: List[dict], ch: Changes | None = None) -> RoomState:
+    """Replace a seat's zones with a freshly shuffled library built from deck."""
+    return apply_action(s, "seat_deck", {"player_id": pid, "deck": deck}, ch)
 
-    def load_into(deck: List[dict] | None):
-        nonlocal cards
+def new_room(room_id: str, deckA: List[dict] | None = None, deckB: List[dict] | None = None) -> RoomState:
+    s = RoomState(room_id=room_id, players={"A": PlayerState(id="A"), "B": PlayerState(id="B")})
+    for pid, deck in (("A", deckA), ("B", deckB)):
         if not deck:
-            return []
+            continue
         ids = []
         for d in deck:
-            c = _mk_card(d)
-            cards[c.id] = c
+            c = _mk_card(s, d)
+            s.cards[c.id] = c
             ids.append(c.id)
-        random.shuffle(ids)
-        return ids
-
-    pA.library = load_into(deckA or [])
-    pB.library = load_into(deckB or [])
-    # draw opening hands
-    for _ in range(7):
-        if pA.library:
-            pA.hand.append(pA.library.pop())
-    for _ in range(7):
-        if pB.library:
-            pB.hand.append(pB.library.pop())
-
-    # FIX: correct field name is room_id (not id)
-    return RoomState(room_id=room_id, players={"A": pA, "B": pB}, cards=cards)
-
-def apply_action(s: RoomState, action_type: str, p: dict) -> RoomState:
-    if action_type == "draw":
-        pid = p["player_id"]; n = int(p.get("n",1))
+        s._rng.shuffle(ids)
         pl = s.players[pid]
-        for _ in range(n):
+        pl.library = ids
+        # draw opening hands
+        for _ in range(7):
             if pl.library:
                 pl.hand.append(pl.library.pop())
+    return s
+
+# action type -> (payload model, handler); filled in by @handles below
+HANDLERS: Dict[str, Tuple[type[BaseModel], Callable]] = {}
+
+def handles(action_type: str, model: type[BaseModel] | None = None):
+    def register(fn):
+        HANDLERS[action_type] = (model or CLIENT_ACTIONS[action_type], fn)
+        return fn
+    return register
+
+def parse_payload(action_type: str, p) -> BaseModel:
+    """The validated payload for action_type; raises KeyError/ValidationError before anything changes."""
+    model, _ = HANDLERS[action_type]
+    return p if isinstance(p, model) else model.model_validate(p)
+
+def apply_action(s: RoomState, action_type: str, p, ch: Changes | None = None,
+                 actor: str | None = None) -> RoomState:
+    """Apply one action in place; pass ch to learn what it touched.
+
+    p is the action's payload model or a plain dict to validate into one.
+    actor is the seat that sent it; undo and redo only take back that seat's
+    own steps. Unknown action types change nothing.
+    """
+    ch = ch if ch is not None else Changes()
+    entry = HANDLERS.get(action_type)
+    if entry is None:
         return s
-    if action_type == "move":
-        pid = p["player_id"]; cid = p["card_id"]; to = p["to"]
-        target_player = s.players[pid]
-        zones = ["hand","battlefield","graveyard","exile","library"]
-        
-        # Find the card in ANY player's zones (not just the target player)
-        found_in_player = None
-        found_in_zone = None
-        for player_id, player in s.players.items():
-            for zone_name in zones:
-                zone_cards = getattr(player, zone_name)
-                if cid in zone_cards:
-                    found_in_player = player
-                    found_in_zone = zone_cards
-                    break
-            if found_in_player:
-                break
-        
-        # Remove from current location and add to target
-        if found_in_zone is not None:
-            found_in_zone.remove(cid)
-            getattr(target_player, to).append(cid)
-
-        # Position handling: only relevant on battlefield
-        if to != "battlefield":
-            if cid in s.cards:
-                s.cards[cid].pos = None
+    model, fn = entry
+    step = Changes(s)
+    step.actor = actor
+    try:
+        fn(s, p if isinstance(p, model) else model.model_validate(p), step)
+    except BaseException:
+        step.close()
+        _restore(s, step, Changes())  # a handler that fails halfway leaves nothing behind
+        raise
+    finally:
+        step.close()
+    if step:
+        s.version += 1
+        ch.merge(step)
+        _remember(s, action_type, step)
+    return s
+
+# ---- undo/redo: one shared history per room, kept on the state so journal replay rebuilds it
+
+def _remember(s: RoomState, action_type: str, step: Changes):
+    h = s._history
+    if action_type == "undo":
+        h.redo.append(step)
+    elif action_type == "redo":
+        h.undo.append(step)
+    elif action_type in SERVER_ACTIONS:
+        # a reseated deck starts a new game; nothing before it can be put back
+        h.undo.clear(); h.redo.clear()
+    else:
+        h.undo.append(step)  # the deque drops the oldest step past config.UNDO_DEPTH
+        if h.redo:
+            h.redo.clear()
+
+def _restore(s: RoomState, step: Changes, ch: Changes):
+    """Put back step's pre-images; ch (made with s) records the current values, i.e. the way back."""
+    out: List[str] = []                   # ids taken out of a zone
+    back: List[Tuple[str, str, str]] = []  # (cid, pid, zone) put back in one
+    for key, value in step.before.items():
+        if key[0] == "card":
+            cid = key[1]
+            ch.card(cid)
+            if value is None:
+                s.cards.pop(cid, None)
+            else:
+                s.cards[cid] = value
+        elif key[0] == "zone":
+            _, pid, zone = key
+            ch.zone(pid, zone)
+            z = getattr(s.players[pid], zone)
+            moved = []
+            for op in reversed(value):  # the zone's edits, last first
+                if op[0] == "add":
+                    z.discard(op[1])
+                    moved.append(op[1])
+                    out.append(op[1])
+                elif op[0] == "del":
+                    z.insert(op[1], op[2])
+                    moved.append(op[1])
+                    back.append((op[1], pid, zone))
+                else:
+                    _, items, lo, hi = op
+                    out.extend(z)
+                    moved.extend(z)
+                    z.clear()
+                    z.extend(cid for cid, _ in items)
+                    z.set_ordinals(lo, hi, [o for _, o in items])
+                    moved.extend(cid for cid, _ in items)
+                    back.extend((cid, pid, zone) for cid, _ in items)
+            ch.zone(pid, zone, moved)
+        elif key[0] == "field":
+            _, pid, name = key
+            ch.field(pid, name)
+            setattr(s.players[pid], name, value)
         else:
-            if cid in s.cards and not s.cards[cid].pos:
-                s.cards[cid].pos = {"x": 0, "y": 0, "z": 1}
-        return s
+            ch.room_field(key[1])
+            setattr(s, key[1], value)
+    if out or back:
+        idx = _index(s)
+        for cid in out:
+            idx.pop(cid, None)
+        for cid, pid, zone in back:
+            idx[cid] = (pid, zone)
+
+# The history is shared, so only its latest step can be taken back, and only by the seat
+# that took it: anything older may have been built on by the other seat since.
+
+@handles("undo")
+def _undo_last(s: RoomState, p: EmptyPayload, ch: Changes):
+    h = s._history
+    if h.undo and h.undo[-1].actor == ch.actor:
+        _restore(s, h.undo.pop(), ch)
+
+@handles("redo")
+def _redo_last(s: RoomState, p: EmptyPayload, ch: Changes):
+    h = s._history
+    if h.redo and h.redo[-1].actor == ch.actor:
+        _restore(s, h.redo.pop(), ch)
+
+def _step_data(step: Changes) -> dict:
+    rows = []
+    for key, value in step.before.items():
+        if key[0] == "card" and value is not None:
+            value = value.model_dump(mode="json")
+        rows.append([*key, value])
+    return {"by": step.actor, "before": rows}
+
+def _load_step(data: dict) -> Changes:
+    step = Changes()
+    step.actor = data["by"]
+    for *key, value in data["before"]:
+        if key[0] == "card" and value is not None:
+            value = CardInstance.model_validate(value)
+        elif key[0] == "zone":
+            value = [("all", tuple(map(tuple, op[1])), op[2], op[3]) if op[0] == "all" else tuple(op)
+                     for op in value]
+        step.before[tuple(key)] = value
+    return step
+
+def history_data(s: RoomState) -> dict:
+    """The undo/redo steps as JSON-able data, for snapshots.
+
+    The steps name zone positions by ordinal, so the zones' ordinals go along.
+    """
+    h = s._history
+    if not h.undo and not h.redo:
+        return {}
+    return {"undo": [_step_data(st) for st in h.undo], "redo": [_step_data(st) for st in h.redo],
+            "ordinals": {pid: {zone: getattr(pl, zone).ordinals() for zone in ZONES}
+                         for pid, pl in s.players.items()}}
+
+def load_history(s: RoomState, data: dict):
+    h = s._history
+    h.undo.clear(); h.redo.clear()
+    h.undo.extend(_load_step(step) for step in data.get("undo", ()))
+    h.redo.extend(_load_step(step) for step in data.get("redo", ()))
+    for pid, zones in data.get("ordinals", {}).items():
+        for zone, (lo, hi, ordinals) in zones.items():
+            getattr(s.players[pid], zone).set_ordinals(lo, hi, ordinals)
+
+@handles("seat_deck", SeatDeckPayload)
+def _seat_deck(s: RoomState, p: SeatDeckPayload, ch: Changes):
+    pid = p.player_id
+    pl = s.players[pid]
+    idx = _index(s)
+    for zone in ZONES:
+        ch.zone(pid, zone)
+        for cid in getattr(pl, zone):
+            idx.pop(cid, None)
+            if cid in s.cards:
+                ch.card(cid)
+                del s.cards[cid]
+        getattr(pl, zone).clear()
+    for d in p.deck:
+        c = _mk_card(s, d, ch)
+        ch.card(c.id)
+        s.cards[c.id] = c
+        _put(s, pid, "library", c.id)
+    pl.library.shuffle(s._rng)
+
+@handles("draw")
+def _draw(s: RoomState, p: DrawPayload, ch: Changes):
+    pid = p.player_id
+    pl = s.players[pid]
+    for _ in range(p.n):
+        if pl.library:
+            ch.zone(pid, "library"); ch.zone(pid, "hand", (pl.library[-1],))
+            _put(s, pid, "hand", pl.library.pop())
+
+@handles("move")
+def _move(s: RoomState, p: MovePayload, ch: Changes):
+    pid = p.player_id; cid = p.card_id; to = p.to
 
-    if action_type == "tap_toggle":
-        cid = p["card_id"]
+    # The card may come from ANY player's zones (not just the target player)
+    found = locate(s, cid)
+    if found is not None:
+        ch.zone(*found[:2]); ch.zone(pid, to, (cid,))
+        _take(s, cid, found)
+        _put(s, pid, to, cid)
+
+    # Position handling: only relevant on battlefield
+    if to != "battlefield":
+        if cid in s.cards and s.cards[cid].pos is not None:
+            ch.card(cid)
+            s.cards[cid].pos = None
+    else:
+        if cid in s.cards and not s.cards[cid].pos:
+            ch.card(cid)
+            s.cards[cid].pos = {"x": 0, "y": 0, "z": 1}
+
+@handles("tap_toggle")
+def _tap_toggle(s: RoomState, p: CardPayload, ch: Changes):
+    cid = p.card_id
+    if cid in s.cards:
+        ch.card(cid)
         s.cards[cid].tapped = not s.cards[cid].tapped
-        return s
-    if action_type == "life":
-        pid = p["player_id"]; delta = int(p["delta"])
-        s.players[pid].life += delta
-        return s
-    if action_type == "wins":
-        pid = p["player_id"]; delta = int(p["delta"])
-        s.players[pid].wins = max(0, s.players[pid].wins + delta)
-        return s
-    if action_type == "pass_turn":
-        s.turn = "B" if s.turn == "A" else "A"
-        s.phase = "Main"
-        return s
-    if action_type == "set_phase":
-        s.phase = str(p["phase"])
-        return s
-    if action_type == "shuffle_library":
-        pid = p["player_id"]
-        random.shuffle(s.players[pid].library)
-        return s
-    if action_type == "mulligan":
-        pid = p["player_id"]; n = int(p.get("n", 7))
-        pl = s.players[pid]
-        # return hand to library and shuffle
-        pl.library.extend(pl.hand)
-        pl.hand.clear()
-        random.shuffle(pl.library)
-        # draw n cards
-        for _ in range(n):
-            if pl.library:
-                pl.hand.append(pl.library.pop())
-        return s
-    if action_type == "swap_zone_with_hand":
-        pid = p["player_id"]; zone = p["zone"]
-        assert zone in ("graveyard","exile","library")
-        pl = s.players[pid]
-        other = getattr(pl, zone)
-        
-        # Toggle privacy flags for graveyard/exile
-        if zone == "graveyard":
-            if pl.hide_graveyard_top:
-                # Already hidden, turn privacy OFF
-                pl.hide_graveyard_top = False
-            elif len(pl.hand) > 0:
-                # Not hidden and hand has cards, turn privacy ON
-                pl.hide_graveyard_top = True
-        elif zone == "exile":
-            if pl.hide_exile_top:
-                # Already hidden, turn privacy OFF
-                pl.hide_exile_top = False
-            elif len(pl.hand) > 0:
-                # Not hidden and hand has cards, turn privacy ON
-                pl.hide_exile_top = True
-            
-        pl.hand, other[:] = other[:], pl.hand[:]
-        setattr(pl, zone, other)
-        return s
-    if action_type == "swap_opponent_zone_with_hand":
-        # Swap my hand with opponent's specified zone
-        my_pid = p["player_id"]
-        opp_pid = "B" if my_pid == "A" else "A"
-        zone = p["zone"]
-        assert zone in ("graveyard","exile","library")
-        
-        my_player = s.players[my_pid]
-        opp_player = s.players[opp_pid]
-        opp_zone = getattr(opp_player, zone)
-        
-        # Toggle privacy flags on opponent's zones
-        if zone == "graveyard":
-            if opp_player.hide_graveyard_top:
-                # Already hidden, turn privacy OFF
-                opp_player.hide_graveyard_top = False
-            elif len(my_player.hand) > 0:
-                # Not hidden and my hand has cards, turn privacy ON
-                opp_player.hide_graveyard_top = True
-        elif zone == "exile":
-            if opp_player.hide_exile_top:
-                # Already hidden, turn privacy OFF
-                opp_player.hide_exile_top = False
-            elif len(my_player.hand) > 0:
-                # Not hidden and my hand has cards, turn privacy ON
-                opp_player.hide_exile_top = True
-        
-        # Swap my hand with opponent's zone
-        my_player.hand, opp_zone[:] = opp_zone[:], my_player.hand[:]
-        setattr(opp_player, zone, opp_zone)
-        return s
-    if action_type == "set_card_pos":
-        cid = p["card_id"]
-        if cid in s.cards:
-            x = int(p.get("x", 0)); y = int(p.get("y", 0)); z = int(p.get("z", 1))
-            s.cards[cid].pos = {"x": x, "y": y, "z": z}
-        return s
-    # -- Token management actions --
-    if action_type == "create_token":
-        pid = p["player_id"]
-        tid = _uid()
-        kind = "creature" if p.get("creature") else "chip"
-        tok = CardInstance(id=tid,
-                           name=p.get("name", "Token"),
-                           is_token=True,
-                           token_kind=kind,
-                           text=p.get("text", None))
-        s.cards[tid] = tok
-        # always place tokens onto battlefield
-        s.players[pid].battlefield.append(tid)
-        return s
-    if action_type == "update_token":
-        cid = p["card_id"]
-        tok = s.cards.get(cid)
-        if tok and tok.is_token:
-            tok.text = p.get("text", tok.text)
-        return s
-    if action_type == "remove_token":
-        pid = p.get("player_id")
-        cid = p.get("card_id")
-        # remove from battlefield
-        pl = s.players[pid]
-        if cid in pl.battlefield:
-            pl.battlefield.remove(cid)
-        s.cards.pop(cid, None)
-        return s
-    if action_type == "put_on_bottom":
-        pid = p["player_id"]
-        cid = p["card_id"]
-        pl = s.players[pid]
-        # Remove card from hand
-        if cid in pl.hand:
-            pl.hand.remove(cid)
-            # Put card at the bottom of library (beginning of the list since we pop from the end)
-            pl.library.insert(0, cid)
-        return s
-    if action_type == "toggle_show_hand":
-        pid = p["player_id"]
-        s.players[pid].show_hand = not s.players[pid].show_hand
-        return s
-    if action_type == "toggle_show_top":
-        pid = p["player_id"]
-        s.players[pid].show_top = not s.players[pid].show_top
-        return s
 
-    return s
+@handles("life")
+def _life(s: RoomState, p: DeltaPayload, ch: Changes):
+    ch.field(p.player_id, "life")
+    s.players[p.player_id].life += p.delta
+
+@handles("wins")
+def _wins(s: RoomState, p: DeltaPayload, ch: Changes):
+    pl = s.players[p.player_id]
+    ch.field(p.player_id, "wins")
+    pl.wins = max(0, pl.wins + p.delta)
+
+@handles("pass_turn")
+def _pass_turn(s: RoomState, p: EmptyPayload, ch: Changes):
+    ch.room_field("turn", "phase")
+    s.turn = "B" if s.turn == "A" else "A"
+    s.phase = "Main"
+
+@handles("set_phase")
+def _set_phase(s: RoomState, p: PhasePayload, ch: Changes):
+    ch.room_field("phase")
+    s.phase = p.phase
+
+@handles("shuffle_library")
+def _shuffle_library(s: RoomState, p: PlayerPayload, ch: Changes):
+    ch.zone(p.player_id, "library")
+    s.players[p.player_id].library.shuffle(s._rng)
+
+@handles("mulligan")
+def _mulligan(s: RoomState, p: MulliganPayload, ch: Changes):
+    pid = p.player_id
+    pl = s.players[pid]
+    ch.zone(pid, "library"); ch.zone(pid, "hand")
+    # return hand to library and shuffle
+    for cid in pl.hand:
+        _put(s, pid, "library", cid)
+    pl.hand.clear()
+    pl.library.shuffle(s._rng)
+    # draw n cards
+    for _ in range(p.n):
+        if pl.library:
+            _put(s, pid, "hand", pl.library.pop())
+    ch.zone(pid, "library"); ch.zone(pid, "hand", pl.hand)
+
+def _toggle_privacy(owner: PlayerState, zone: str, hand: Zone, ch: Changes):
+    """Swapping a hand into graveyard/exile hides that zone's top; swapping again reveals it."""
+    flag = {"graveyard": "hide_graveyard_top", "exile": "hide_exile_top"}.get(zone)
+    if flag is None:
+        return
+    ch.field(owner.id, flag)
+    if getattr(owner, flag):
+        # Already hidden, turn privacy OFF
+        setattr(owner, flag, False)
+    elif len(hand) > 0:
+        # Not hidden and hand has cards, turn privacy ON
+        setattr(owner, flag, True)
+
+@handles("swap_zone_with_hand")
+def _swap_zone_with_hand(s: RoomState, p: SwapZonePayload, ch: Changes):
+    pid = p.player_id; zone = p.zone
+    pl = s.players[pid]
+    ch.zone(pid, "hand", whole=True); ch.zone(pid, zone, whole=True)
+    other = getattr(pl, zone)
+    _toggle_privacy(pl, zone, pl.hand, ch)
+    pl.hand, other = other, pl.hand
+    setattr(pl, zone, other)
+    _reindex(s, pid, "hand"); _reindex(s, pid, zone)
+    ch.zone(pid, "hand", pl.hand); ch.zone(pid, zone, other)
+
+@handles("swap_opponent_zone_with_hand")
+def _swap_opponent_zone_with_hand(s: RoomState, p: SwapZonePayload, ch: Changes):
+    # Swap my hand with opponent's specified zone
+    my_pid = p.player_id
+    opp_pid = "B" if my_pid == "A" else "A"
+    zone = p.zone
+    my_player = s.players[my_pid]
+    opp_player = s.players[opp_pid]
+    ch.zone(my_pid, "hand", whole=True); ch.zone(opp_pid, zone, whole=True)
+    opp_zone = getattr(opp_player, zone)
+    # Privacy flags toggle on the opponent's zone
+    _toggle_privacy(opp_player, zone, my_player.hand, ch)
+    my_player.hand, opp_zone = opp_zone, my_player.hand
+    setattr(opp_player, zone, opp_zone)
+    _reindex(s, my_pid, "hand"); _reindex(s, opp_pid, zone)
+    ch.zone(my_pid, "hand", my_player.hand); ch.zone(opp_pid, zone, opp_zone)
+
+@handles("set_card_pos")
+def _set_card_pos(s: RoomState, p: CardPosPayload, ch: Changes):
+    if p.card_id in s.cards:
+        ch.card(p.card_id)
+        s.cards[p.card_id].pos = {"x": p.x, "y": p.y, "z": p.z}
+
+# -- Token management actions --
+
+@handles("create_token")
+def _create_token(s: RoomState, p: CreateTokenPayload, ch: Changes):
+    tid = _uid(s._idrng)
+    tok = CardInstance(id=tid,
+                       name=p.name,
+                       is_token=True,
+                       token_kind="creature" if p.creature else "chip",
+                       text=p.text)
+    ch.card(tid); ch.zone(p.player_id, "battlefield")
+    s.cards[tid] = tok
+    # always place tokens onto battlefield
+    _put(s, p.player_id, "battlefield", tid)
+
+@handles("update_token")
+def _update_token(s: RoomState, p: UpdateTokenPayload, ch: Changes):
+    tok = s.cards.get(p.card_id)
+    if tok and tok.is_token and "text" in p.model_fields_set:
+        ch.card(p.card_id)
+        tok.text = p.text
+
+@handles("remove_token")
+def _remove_token(s: RoomState, p: CardPayload, ch: Changes):
+    cid = p.card_id
+    # remove from wherever it ended up (usually the battlefield)
+    found = locate(s, cid)
+    if found is not None:
+        ch.zone(*found[:2])
+        _take(s, cid, found)
+    if cid in s.cards:
+        ch.card(cid)
+        del s.cards[cid]
+
+@handles("put_on_bottom")
+def _put_on_bottom(s: RoomState, p: PlayerCardPayload, ch: Changes):
+    pid = p.player_id; cid = p.card_id
+    # Only from the player's own hand
+    loc = locate(s, cid)
+    if loc is not None and loc[:2] == (pid, "hand"):
+        ch.zone(pid, "hand"); ch.zone(pid, "library", (cid,))
+        _take(s, cid, loc)
+        # Put card at the bottom of library (beginning of the list since we pop from the end)
+        _put(s, pid, "library", cid, bottom=True)
+
+@handles("toggle_show_hand")
+def _toggle_show_hand(s: RoomState, p: PlayerPayload, ch: Changes):
+    ch.field(p.player_id, "show_hand")
+    pl = s.players[p.player_id]
+    pl.show_hand = not pl.show_hand
+
+@handles("set_name")
+def _set_name(s: RoomState, p: NamePayload, ch: Changes):
+    ch.field(p.player_id, "name")
+    s.players[p.player_id].name = p.name
+
+@handles("toggle_show_top")
+def _toggle_show_top(s: RoomState, p: PlayerPayload, ch: Changes):
+    ch.field(p.player_id, "show_top")
+    pl = s.players[p.player_id]
+    pl.show_top = not pl.show_top
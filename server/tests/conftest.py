@@ -0,0 +1,8 @@
+import pytest
+
+from server import persistence
+
+@pytest.fixture(autouse=True)
+def _rooms_dir(tmp_path, monkeypatch):
+    # keep room snapshots and logs written during tests out of server/data
+    monkeypatch.setattr(persistence, "ROOMS_DIR", tmp_path)
@@ -0,0 +1,146 @@
+from fastapi.testclient import TestClient
+
+from server import app as app_module
+
+client = TestClient(app_module.app)
+
+def _hello(ws, pid, room="WS1", **kw):
+    ws.send_json({"kind": "hello", "room_id": room, "player_id": pid, **kw})
+    return ws.receive_json()
+
+def test_join_gets_snapshot_then_patches():
+    app_module.rooms.clear()
+    with client.websocket_connect("/ws/WS1") as a:
+        first = _hello(a, "A", name="Ann")
+        assert first["kind"] == "state"
+        assert first["state"]["players"]["A"]["name"] == "Ann"
+        v = first["state"]["version"]
+        a.send_json({"kind": "action", "type": "life", "payload": {"player_id": "A", "delta": -2}})
+        patch = a.receive_json()
+        assert patch["kind"] == "patch"
+        assert patch["base"] == v and patch["version"] == v + 1
+        assert patch["players"] == {"A": {"life": 18}}
+        assert patch["cards"] == {}
+
+def test_resync_returns_snapshot():
+    app_module.rooms.clear()
+    with client.websocket_connect("/ws/WS2") as a:
+        _hello(a, "A", room="WS2")
+        a.send_json({"kind": "resync"})
+        assert a.receive_json()["kind"] == "state"
+
+def test_msgpack_clients_get_binary_frames_and_may_send_them():
+    import msgpack
+    app_module.rooms.clear()
+    with client.websocket_connect("/ws/WS3") as a, client.websocket_connect("/ws/WS3") as b:
+        _hello(a, "A", room="WS3")
+        b.send_json({"kind": "hello", "room_id": "WS3", "player_id": "B", "encoding": "msgpack"})
+        first = msgpack.unpackb(b.receive_bytes())
+        assert first["kind"] == "state"
+        b.send_bytes(msgpack.packb({"kind": "action", "type": "life", "payload": {"player_id": "B", "delta": 1}}))
+        assert msgpack.unpackb(b.receive_bytes())["players"] == {"B": {"life": 21}}
+        # the JSON peer gets the same patch as text
+        patch = a.receive_json()
+        while patch["kind"] != "patch" or "B" not in patch["players"] or "life" not in patch["players"]["B"]:
+            patch = a.receive_json()
+        assert patch["players"]["B"]["life"] == 21
+
+def test_malformed_actions_are_rejected_without_touching_the_room():
+    app_module.rooms.clear()
+    with client.websocket_connect("/ws/WS4") as a:
+        v = _hello(a, "A", room="WS4")["state"]["version"]
+        for bad in ({"kind": "action", "type": "no_such_action", "payload": {}},
+                    {"kind": "action", "type": "life", "payload": {"player_id": "A", "delta": "lots"}},
+                    {"kind": "action", "type": "seat_deck", "payload": {"player_id": "A", "deck": []}}):
+            a.send_json(bad)
+            ack = a.receive_json()
+            assert ack["kind"] == "ack" and not ack["ok"]
+        a.send_text("not json")
+        assert a.receive_json()["kind"] == "ack"
+        a.send_json({"kind": "action", "type": "life", "payload": {"player_id": "A", "delta": -1}})
+        patch = a.receive_json()
+        assert patch["base"] == v and patch["players"] == {"A": {"life": 19}}
+
+def test_http_state_reuses_the_public_snapshot():
+    app_module.rooms.clear()
+    assert client.get("/api/state/WS5").status_code == 404
+    with client.websocket_connect("/ws/WS5") as a:
+        v = _hello(a, "A", room="WS5")["state"]["version"]
+        r = client.get("/api/state/WS5")
+        assert r.status_code == 200 and r.json()["state"]["version"] == v
+        # hidden information stays hidden over HTTP too
+        assert all(cid == "?" for cid in r.json()["state"]["players"]["A"]["hand"])
+        assert r.text == app_module.rooms["WS5"].snapshot().json()
+        assert client.get("/api/state/WS5", headers={"If-None-Match": r.headers["etag"]}).status_code == 304
+        # same version, different content (e.g. reloaded from another snapshot): no 304
+        room = app_module.rooms["WS5"]
+        room.state = room.state.model_copy(deep=True)
+        room.state.players["A"].life = 3
+        assert client.get("/api/state/WS5", headers={"If-None-Match": r.headers["etag"]}).status_code == 200
+
+def test_spectators_watch_but_cannot_act():
+    app_module.rooms.clear()
+    with client.websocket_connect("/ws/WS6") as a, client.websocket_connect("/ws/WS6") as s:
+        _hello(a, "A", room="WS6")
+        s.send_json({"kind": "hello", "room_id": "WS6", "role": "spectator"})
+        first = s.receive_json()
+        assert first["kind"] == "state" and not first["state"]["cards"]
+        s.send_json({"kind": "action", "type": "life", "payload": {"player_id": "A", "delta": -20}})
+        ack = s.receive_json()
+        assert ack["kind"] == "ack" and not ack["ok"]
+        assert app_module.rooms["WS6"].state.players["A"].life == 20
+
+def test_spectator_naming_a_seat_still_gets_the_public_view():
+    app_module.rooms.clear()
+    with client.websocket_connect("/ws/WS9") as a, client.websocket_connect("/ws/WS9") as s:
+        hand = _hello(a, "A", room="WS9", deck="no-such-deck")["state"]["players"]["A"]["hand"]
+        assert hand and "?" not in hand
+        s.send_json({"kind": "hello", "room_id": "WS9", "role": "spectator", "player_id": "A"})
+        assert set(s.receive_json()["state"]["players"]["A"]["hand"]) == {"?"}
+        s.send_json({"kind": "resync"})
+        assert set(s.receive_json()["state"]["players"]["A"]["hand"]) == {"?"}
+
+def test_spectators_cannot_open_rooms(tmp_path, monkeypatch):
+    from server import persistence
+    monkeypatch.setattr(persistence, "_STORE", persistence.FileRoomStore(tmp_path))
+    app_module.rooms.clear()
+    with client.websocket_connect("/ws/NOBODY") as s:
+        s.send_json({"kind": "hello", "room_id": "NOBODY", "role": "spectator"})
+        ack = s.receive_json()
+        assert ack["kind"] == "ack" and not ack["ok"]
+    assert "NOBODY" not in app_module.rooms
+    assert persistence.load_room("NOBODY") is None
+
+def test_metrics_endpoint_counts_rooms_and_actions():
+    app_module.rooms.clear()
+    with client.websocket_connect("/ws/WS7") as a:
+        _hello(a, "A", room="WS7")
+        a.send_json({"kind": "action", "type": "life", "payload": {"player_id": "A", "delta": -1}})
+        a.receive_json()
+        body = client.get("/metrics").text
+    assert 'cgr_rooms{state="active"} 1' in body
+    assert 'cgr_peers{role="player"} 1' in body
+    assert "# TYPE cgr_action_seconds histogram" in body
+    count = next(line for line in body.splitlines() if line.startswith('cgr_action_seconds_count{type="life"}'))
+    assert int(count.split()[-1]) >= 1
+    assert 'cgr_frame_bytes_count{encoding="json"}' in body
+
+def test_reconnect_with_the_same_session_gets_only_missed_changes():
+    app_module.rooms.clear()
+    with client.websocket_connect("/ws/WS8") as b:
+        _hello(b, "B", room="WS8")
+        with client.websocket_connect("/ws/WS8") as a:
+            state = _hello(a, "A", room="WS8", deck="no-such-deck", name="Ann", session="s1")["state"]
+        b.send_json({"kind": "action", "type": "life", "payload": {"player_id": "B", "delta": -4}})
+        with client.websocket_connect("/ws/WS8") as a:
+            first = _hello(a, "A", room="WS8", deck="no-such-deck", name="Bob", session="s1",
+                           last_version=state["version"])
+            assert first["kind"] == "patch" and first["base"] == state["version"]
+            assert first["players"]["B"]["life"] == 16
+        room = app_module.rooms["WS8"]
+        # resuming never reseats or renames
+        assert room.state.players["A"].hand == state["players"]["A"]["hand"]
+        assert room.state.players["A"].name == "Ann"
+        with client.websocket_connect("/ws/WS8") as a:
+            # another session takes the seat over with a snapshot
+            assert _hello(a, "A", room="WS8", session="s2", last_version=0)["kind"] == "state"
@@ -0,0 +1,33 @@
+import json
+
+from server import bench, persistence
+
+def test_every_action_type_is_benchmarked():
+    from server.state import HANDLERS
+    s = bench._board(*bench.BOARDS["midgame"])
+    covered = {name.split()[1] for name in bench._pairs(s)}
+    assert {t for t in HANDLERS} <= {part for name in covered for part in name.split("+")}
+
+def test_boards_keep_their_shape_across_repeats():
+    s = bench._board(*bench.BOARDS["midgame"])
+    before = s.model_dump(exclude={"version", "cards", "turn", "phase"})
+    for fn in bench._pairs(s).values():
+        fn(), fn()
+    after = s.model_dump(exclude={"version", "cards", "turn", "phase"})
+    for pid in ("A", "B"):
+        for zone in ("library", "hand", "battlefield", "graveyard", "exile"):
+            assert len(after["players"][pid][zone]) == len(before["players"][pid][zone]), (pid, zone)
+
+def test_quick_run_saves_and_compares(tmp_path, capsys):
+    rooms_dir = persistence.ROOMS_DIR
+    out = tmp_path / "bench.json"
+    args = ["--board", "small", "--repeat", "2", "--min-time", "0.001"]
+    assert bench.main(args + ["--save", str(out)]) == 0
+    assert persistence.ROOMS_DIR == rooms_dir
+    result = json.loads(out.read_text())
+    assert result["small: action draw+put_on_bottom"]["us"] > 0
+    assert "small: load_room" in result
+
+    slow = {name: {**r, "us": r["us"] / 100} for name, r in result.items()}
+    out.write_text(json.dumps(slow))
+    assert bench.main(args + ["--filter", "new_room", "--compare", str(out), "--threshold", "50"]) == 1
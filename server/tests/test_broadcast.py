@@ -0,0 +1,49 @@
+import asyncio
+
+from server.broadcast import Peer, fan_out
+
+class SlowWS:
+    def __init__(self):
+        self.sent = []
+        self.gate = asyncio.Event()
+        self.closed_with = None
+
+    async def send_text(self, data):
+        await self.gate.wait()
+        self.sent.append(data)
+
+    async def close(self, code=1000):
+        self.closed_with = code
+
+def test_overflow_merges_backlog_into_snapshot():
+    async def run():
+        ws = SlowWS()
+        peer = Peer(ws, lambda: "snap", queue_size=2, max_overflows=1)
+        for i in range(4):
+            assert peer.push(f"f{i}")
+        ws.gate.set()
+        await asyncio.sleep(0.01)
+        peer.close()
+        return ws.sent
+    sent = asyncio.run(run())
+    # f0..f2 overflowed the queue and collapsed into one snapshot
+    assert sent == ["snap", "f3"]
+
+def test_persistent_laggard_is_dropped_without_blocking_others():
+    async def run():
+        slow, fast = SlowWS(), SlowWS()
+        fast.gate.set()
+        peers = [Peer(slow, lambda: "snap", queue_size=1, max_overflows=1),
+                 Peer(fast, lambda: "snap", queue_size=1, max_overflows=1)]
+        dropped = []
+        for i in range(6):
+            for peer in fan_out(peers, f"f{i}"):
+                peers.remove(peer)
+                dropped.append(peer)
+            await asyncio.sleep(0)
+        await asyncio.sleep(0.01)
+        return dropped, slow, fast
+    dropped, slow, fast = asyncio.run(run())
+    assert [p.ws for p in dropped] == [slow]
+    assert slow.closed_with == 1013
+    assert fast.sent[-1] == "f5"
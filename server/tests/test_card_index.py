@@ -0,0 +1,55 @@
+import json
+
+from card_index import CardIndex, normalize
+
+def _card(cid, name, **kw):
+    return {"id": cid, "name": name, "image_uris": {"normal": f"https://img/{cid}.jpg"}, **kw}
+
+def test_names_are_normalized():
+    assert normalize("  Lim-Dûl's   VAULT ") == "lim-dul's vault"
+
+def test_lookup_by_name_face_and_id(tmp_path):
+    index = CardIndex(tmp_path / "cards.sqlite")
+    index.put(_card("d1", "Delver of Secrets // Insectile Aberration",
+                    card_faces=[{"name": "Delver of Secrets"}, {"name": "Insectile Aberration"}]))
+    assert index.get("delver of secrets")["id"] == "d1"
+    assert index.get("Insectile Aberration")["id"] == "d1"
+    assert index.by_id("d1")["name"].startswith("Delver")
+    assert index.get("Tarmogoyf") is None
+    assert index.fuzzy("Delvr of Secrets")["id"] == "d1"
+    assert index.fuzzy("Counterspell") is None
+
+def test_bulk_import_keeps_one_printing_per_name_and_marks_complete(tmp_path):
+    bulk = tmp_path / "default-cards.json"
+    bulk.write_text(json.dumps([_card("b1", "Lightning Bolt"), _card("b2", "Lightning Bolt"),
+                                {"id": "x", "name": "Art Card"}]))
+    index = CardIndex(tmp_path / "cards.sqlite")
+    assert not index.complete
+    assert index.import_bulk(bulk) == 1
+    assert index.complete and len(index) == 1
+    assert index.get("lightning bolt")["id"] == "b1"
+    # a live lookup replaces the bulk printing
+    index.put(_card("b3", "Lightning Bolt"))
+    assert index.get("Lightning Bolt")["id"] == "b3"
+
+def test_fuzzy_lookups_race_safely_with_writes(tmp_path):
+    import threading
+    index = CardIndex(tmp_path / "cards.sqlite")
+    index.put(_card("g1", "Tarmogoyf"))
+    errors = []
+
+    def look():
+        try:
+            for _ in range(300):
+                assert index.fuzzy("Tarmogoy")["id"] == "g1"
+        except Exception as e:
+            errors.append(e)
+
+    readers = [threading.Thread(target=look) for _ in range(3)]
+    for t in readers:
+        t.start()
+    for i in range(300):
+        index.put(_card(f"c{i}", f"Card {i}"))  # each write drops the fuzzy keys
+    for t in readers:
+        t.join()
+    assert errors == []
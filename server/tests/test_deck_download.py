@@ -0,0 +1,123 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+import deck_download
+from card_index import CardIndex
+
+CARDS = {
+    "Lightning Bolt": "bolt",
+    "Delver of Secrets // Insectile Aberration": "delver",
+    "Tarmogoyf": "goyf",
+}
+
+class FakeScryfall(BaseHTTPRequestHandler):
+    hits: list = []
+    flaky = {"/img/goyf.jpg"}  # fails once with 503 before serving
+
+    def log_message(self, *args):
+        pass
+
+    def _card(self, name):
+        cid = CARDS[name]
+        base = f"http://{self.headers['Host']}"
+        card = {"id": cid, "name": name, "set": "tst", "collector_number": "1",
+                "image_uris": {"normal": f"{base}/img/{cid}.jpg"}}
+        if " // " in name:
+            card["card_faces"] = [{"name": face} for face in name.split(" // ")]
+        return card
+
+    def _send(self, code, body=b"", ctype="application/json"):
+        self.send_response(code)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        if code == 503:
+            self.send_header("Retry-After", "0")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.hits.append(("POST", self.path))
+        ids = json.loads(self.rfile.read(int(self.headers["Content-Length"])))["identifiers"]
+        full = {face: n for n in CARDS for face in n.split(" // ")}
+        data = [self._card(full[i["name"]]) for i in ids if i["name"] in full]
+        missing = [i for i in ids if i["name"] not in full]
+        self._send(200, json.dumps({"data": data, "not_found": missing}).encode())
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        self.hits.append(("GET", url.path))
+        if url.path in self.flaky:
+            self.flaky.discard(url.path)
+            return self._send(503)
+        if url.path.startswith("/img/"):
+            return self._send(200, b"jpeg:" + url.path.encode(), "image/jpeg")
+        q = parse_qs(url.query)
+        if "fuzzy" in q and q["fuzzy"][0].lower().startswith("lightnin"):
+            return self._send(200, json.dumps(self._card("Lightning Bolt")).encode())
+        self._send(404, b'{"object":"error"}')
+
+@pytest.fixture
+def scryfall(tmp_path, monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeScryfall)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    FakeScryfall.hits = []
+    monkeypatch.setattr(deck_download, "SCRYFALL_API", f"http://127.0.0.1:{server.server_port}")
+    monkeypatch.setattr(deck_download, "LIMITER", deck_download.TokenBucket(1000, 1000))
+    monkeypatch.setattr(deck_download, "OUT_DIR", tmp_path)
+    monkeypatch.setattr(deck_download, "IMG_DIR", tmp_path)
+    monkeypatch.setattr(deck_download, "_INDEX", CardIndex(tmp_path / "cards.sqlite"))
+    yield server
+    server.shutdown()
+
+def test_deck_resolves_in_one_batch_and_downloads_images(scryfall, tmp_path, monkeypatch):
+    deck = [{"name": "Delver of Secrets", "qty": 4}, {"name": "Lightnin Bolt", "qty": 4},
+            {"name": "Tarmogoyf", "qty": 2}, {"name": "No Such Card", "qty": 1}]
+    monkeypatch.setattr(deck_download, "parse_deck_any", lambda url: deck)
+    seen = []
+    out = deck_download.fetch_and_save_deck("list", "test", progress=lambda done, total: seen.append(done))
+
+    cards = {c["name"]: c for c in json.loads(out.read_text())["cards"]}
+    assert cards["Delver of Secrets"]["scryfall_id"] == "delver"
+    assert cards["Lightnin Bolt"]["scryfall_id"] == "bolt"  # fuzzy fallback
+    assert cards["No Such Card"]["image"] is None and cards["No Such Card"]["qty"] == 1
+    assert (tmp_path / "goyf-0.jpg").read_bytes() == b"jpeg:/img/goyf.jpg"  # after one retry
+    assert seen[-1] == 4
+    assert FakeScryfall.hits.count(("POST", "/cards/collection")) == 1
+
+def test_token_bucket_paces_requests():
+    import time
+    bucket = deck_download.TokenBucket(rate=50, burst=1)
+    t = time.monotonic()
+    for _ in range(6):
+        bucket.take()
+    assert time.monotonic() - t >= 0.09
+
+def test_repeat_imports_need_no_network(scryfall, tmp_path, monkeypatch):
+    deck = [{"name": "Insectile Aberration", "qty": 1}, {"name": "Tarmogoyf", "qty": 4}]
+    monkeypatch.setattr(deck_download, "parse_deck_any", lambda url: deck)
+    deck_download.fetch_and_save_deck("list", "first")
+    scryfall.shutdown()
+    scryfall.server_close()
+    FakeScryfall.hits = []
+    monkeypatch.setattr(deck_download, "RETRIES", 0)
+
+    deck.append({"name": "Tarmogoyff", "qty": 1})  # misspelled: matched against the local index
+    out = deck_download.fetch_and_save_deck("list", "again")
+    cards = {c["name"]: c for c in json.loads(out.read_text())["cards"]}
+    assert cards["Insectile Aberration"]["scryfall_id"] == "delver"
+    assert cards["Tarmogoyff"]["scryfall_id"] == "goyf"
+    assert cards["Tarmogoyf"]["image"].endswith("goyf-0.jpg")
+    assert FakeScryfall.hits == []
+
+def test_imports_can_refuse_to_replace_a_deck(scryfall, tmp_path, monkeypatch):
+    monkeypatch.setattr(deck_download, "parse_deck_any", lambda url: [{"name": "Tarmogoyf", "qty": 1}])
+    (tmp_path / "taken.json").write_text("{}")
+    with pytest.raises(FileExistsError):
+        deck_download.fetch_and_save_deck("list", "taken", overwrite=False)
+    assert (tmp_path / "taken.json").read_text() == "{}"
+    deck_download.fetch_and_save_deck("list", "fresh", overwrite=False)
+    assert not list(tmp_path.glob("*.part"))
@@ -0,0 +1,44 @@
+import asyncio
+
+from server import config
+from server.host import RoomHost
+from server.persistence import WriteBehind
+from server.state import apply_action, new_room
+
+def _host():
+    return RoomHost(WriteBehind(delay_ms=0))
+
+def test_idle_rooms_are_evicted_and_come_back_on_load(monkeypatch):
+    monkeypatch.setattr(config, "ROOM_IDLE_S", 60)
+
+    async def run():
+        host = _host()
+        st = new_room("E1", [f"c{i}" for i in range(20)])
+        room = host._open_room(st)
+        apply_action(st, "life", {"player_id": "A", "delta": -4})
+        host.idle["E1"] = 0.0
+        assert host.evict_idle(now=30) == []
+        assert host.evict_idle(now=60) == ["E1"]
+        assert "E1" not in host.rooms and room._actor is None
+        assert (await host.load("E1"))["ok"]
+        return host
+    host = asyncio.run(run())
+    back = host.rooms["E1"].state
+    assert back.players["A"].life == 16 and len(back.cards) == 20
+
+def test_memory_budget_evicts_least_recently_used_idle_rooms(monkeypatch):
+    monkeypatch.setattr(config, "ROOM_BUDGET_MB", 0)
+
+    async def run():
+        host = _host()
+        for rid in ("R1", "R2", "R3"):
+            host._open_room(new_room(rid, ["x"] * 10))
+        # R2 still has someone connected (not idle); R3 went idle before R1
+        host.idle["R3"] = 1.0
+        host.idle["R1"] = 2.0
+        evicted = host.evict_idle(now=3)
+        await host.writer.flush()
+        return host, evicted
+    host, evicted = asyncio.run(run())
+    assert evicted == ["R3", "R1"]
+    assert list(host.rooms) == ["R2"]
@@ -0,0 +1,32 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from server import app as app_module, images
+
+client = TestClient(app_module.app)
+
+@pytest.fixture
+def img_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(images, "IMG_DIR", tmp_path)
+    return tmp_path
+
+def test_unknown_sizes_and_zoom_get_the_original(img_dir):
+    (img_dir / "card.jpg").write_bytes(b"not really a jpeg")
+    for url in ("/images/card.jpg", "/images/card.jpg?size=zoom", "/images/card.jpg?size=huge"):
+        r = client.get(url)
+        assert r.status_code == 200 and r.content == b"not really a jpeg"
+
+def test_missing_and_escaping_paths_are_404(img_dir):
+    (img_dir.parent / "secret.txt").write_text("no")
+    assert client.get("/images/nope.jpg").status_code == 404
+    assert client.get("/images/..%2Fsecret.txt").status_code == 404
+
+def test_thumbnails_are_resized_and_cached(img_dir):
+    Image = pytest.importorskip("PIL.Image")
+    Image.new("RGB", (488, 680), "red").save(img_dir / "card.jpg")
+    r = client.get("/images/card.jpg?size=thumb")
+    assert r.status_code == 200 and r.headers["content-type"] == "image/webp"
+    out = images.variant_path((img_dir / "card.jpg").resolve(), "thumb")
+    with Image.open(out) as im:
+        assert im.width == images.SIZES["thumb"]
+    assert len(r.content) < (img_dir / "card.jpg").stat().st_size
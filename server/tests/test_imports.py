@@ -0,0 +1,117 @@
+import threading, time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import deck_download
+from server import app as app_module
+from server import persistence
+from server.imports import DeckExists, ImportJobs
+
+client = TestClient(app_module.app)
+
+@pytest.fixture(autouse=True)
+def _jobs(tmp_path, monkeypatch):
+    # job status and decks go to a scratch directory, not server/data
+    monkeypatch.setattr(persistence, "DECKS_DIR", tmp_path)
+    jobs = ImportJobs(path=tmp_path / "imports.sqlite3")
+    monkeypatch.setattr(app_module, "imports", jobs)
+    yield jobs
+    jobs.shutdown()
+
+def _wait(job_id):
+    for _ in range(200):
+        job = client.get(f"/api/decks/import/{job_id}").json()
+        if job["status"] in ("done", "error"):
+            return job
+        time.sleep(0.01)
+    raise AssertionError("import did not finish")
+
+def test_import_runs_in_the_background_and_reports_progress(monkeypatch):
+    calls = []
+
+    def fake_import(text, name, progress=None, overwrite=True):
+        for i in range(1, 4):
+            progress(i, 3)
+        calls.append((text, name))
+
+    monkeypatch.setattr(deck_download, "fetch_and_save_deck", fake_import)
+    r = client.post("/api/decks/import", json={"name": "My Burn!", "text": "4 Lightning Bolt"})
+    assert r.status_code == 200
+    job = _wait(r.json()["job"]["id"])
+    assert job["status"] == "done" and (job["done"], job["total"]) == (3, 3)
+    assert calls == [("4 Lightning Bolt", "my-burn")]
+
+def test_failed_imports_report_the_error(monkeypatch):
+    def broken(text, name, progress=None, overwrite=True):
+        raise ValueError("could not parse decklist")
+
+    monkeypatch.setattr(deck_download, "fetch_and_save_deck", broken)
+    job_id = client.post("/api/decks/import", json={"name": "x", "text": "???"}).json()["job"]["id"]
+    job = _wait(job_id)
+    assert job["status"] == "error" and "parse" in job["error"]
+
+@pytest.mark.parametrize("body", [{"name": "!!!", "text": "1 Island"}, {"name": "ok", "text": ""}])
+def test_bad_requests_are_rejected(body):
+    assert client.post("/api/decks/import", json=body).status_code == 422
+
+def test_unknown_job_is_404():
+    assert client.get("/api/decks/import/nope").status_code == 404
+
+def test_any_worker_can_answer_the_poll(_jobs, tmp_path, monkeypatch):
+    monkeypatch.setattr(deck_download, "fetch_and_save_deck", lambda text, name, **kw: None)
+    job_id = client.post("/api/decks/import", json={"name": "Shared", "text": "1 Island"}).json()["job"]["id"]
+    _wait(job_id)
+    other = ImportJobs(path=tmp_path / "imports.sqlite3")  # another uvicorn worker's view
+    assert other.get(job_id).as_dict() == _jobs.get(job_id).as_dict()
+    other.shutdown()
+
+def test_imports_never_replace_a_deck(tmp_path, monkeypatch):
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow(text, name, progress=None, overwrite=True):
+        started.set()
+        release.wait(5)
+
+    monkeypatch.setattr(deck_download, "fetch_and_save_deck", slow)
+    (tmp_path / "burn.json").write_text("{}")
+    r = client.post("/api/decks/import", json={"name": "Burn", "text": "4 Lightning Bolt"})
+    assert r.status_code == 409
+    first = client.post("/api/decks/import", json={"name": "Elves", "text": "4 Llanowar Elves"})
+    started.wait(5)
+    assert client.post("/api/decks/import", json={"name": "elves", "text": "1 Forest"}).status_code == 409
+    release.set()
+    assert _wait(first.json()["job"]["id"])["status"] == "done"
+
+def _stuck(monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(deck_download, "fetch_and_save_deck", lambda text, name, **kw: release.wait(5))
+    return release
+
+def test_a_restart_gives_up_on_unfinished_jobs(tmp_path, monkeypatch):
+    release = _stuck(monkeypatch)
+    first = ImportJobs(path=tmp_path / "jobs.sqlite3")
+    running = first.submit("Burn", "4 Lightning Bolt")
+    queued = [first.submit(f"Deck {i}", "1 Island") for i in range(3)]  # more than the pool runs at once
+    first.shutdown()
+    again = ImportJobs(path=tmp_path / "jobs.sqlite3")
+    for job in [running] + queued:
+        assert (again.get(job.id).status, again.get(job.id).error) == ("error", "interrupted")
+    assert again.submit("Burn", "4 Lightning Bolt").name == "burn"  # no DeckExists
+    release.set()
+    again.shutdown()
+
+def test_jobs_of_a_worker_that_died_expire_with_their_lease(tmp_path, monkeypatch):
+    release = _stuck(monkeypatch)
+    dead = ImportJobs(path=tmp_path / "jobs.sqlite3", lease_s=0.05)
+    job = dead.submit("Burn", "4 Lightning Bolt")
+    dead._stop.set()  # stops renewing, as if the process were gone
+    alive = ImportJobs(path=tmp_path / "jobs.sqlite3")
+    with pytest.raises(DeckExists):
+        alive.submit("Burn", "4 Lightning Bolt")
+    time.sleep(0.1)
+    assert alive.get(job.id).status == "error"
+    alive.submit("Burn", "4 Lightning Bolt")
+    release.set()
+    dead.shutdown(); alive.shutdown()
@@ -0,0 +1,23 @@
+import json
+
+from server import loadtest
+
+def test_percentiles():
+    values = list(range(1, 101))
+    assert loadtest.percentile(values, 50) == 50
+    assert loadtest.percentile(values, 99) == 99
+    assert loadtest.percentile([], 95) == 0.0
+
+def test_compare_flags_regressions_beyond_tolerance():
+    base = {"rooms": 5, "actions_per_s": 100, "p95_ms": 10, "bytes_per_frame": 500}
+    now = {"rooms": 5, "actions_per_s": 95, "p95_ms": 13, "bytes_per_frame": 400}
+    assert loadtest.compare(now, base, tolerance=10) == ["p95_ms"]
+
+def test_short_run_against_a_spawned_server(tmp_path):
+    out = tmp_path / "baseline.json"
+    assert loadtest.main(["--rooms", "2", "--seconds", "1", "--rate", "20", "--save", str(out)]) == 0
+    result = json.loads(out.read_text())
+    assert result["errors"] == 0 and result["actions"] > 0
+    assert 0 < result["p50_ms"] <= result["p99_ms"]
+    assert loadtest.main(["--rooms", "2", "--seconds", "1", "--rate", "20",
+                          "--compare", str(out), "--tolerance", "100000"]) == 0
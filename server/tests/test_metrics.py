@@ -0,0 +1,24 @@
+from server import metrics
+
+def test_histogram_buckets_are_cumulative():
+    h = metrics.Histogram("t_latency_seconds", "test", ("type",), buckets=(0.1, 1.0))
+    metrics.REGISTRY.remove(h)
+    for v in (0.05, 0.1, 0.5, 3.0):
+        h.observe(v, "move")
+    text = metrics.render([{"name": h.name, "type": h.kind, "help": h.help, "samples": h.samples()}])
+    assert 't_latency_seconds_bucket{type="move",le="0.1"} 2' in text
+    assert 't_latency_seconds_bucket{type="move",le="1.0"} 3' in text
+    assert 't_latency_seconds_bucket{type="move",le="+Inf"} 4' in text
+    assert 't_latency_seconds_count{type="move"} 4' in text
+    assert 't_latency_seconds_sum{type="move"} 3.65' in text
+
+def test_shards_render_as_one_family_with_a_shard_label():
+    c = metrics.Counter("t_dropped_total", "test", ("reason",))
+    metrics.REGISTRY.remove(c)
+    c.inc("overflow")
+    c.inc("overflow", n=2)
+    family = [{"name": c.name, "type": c.kind, "help": c.help, "samples": c.samples()}]
+    text = metrics.render(metrics.relabel(family, shard="0") + metrics.relabel(family, shard="1"))
+    assert text.count("# TYPE t_dropped_total counter") == 1
+    assert 't_dropped_total{shard="0",reason="overflow"} 3' in text
+    assert 't_dropped_total{shard="1",reason="overflow"} 3' in text
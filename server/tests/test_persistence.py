@@ -0,0 +1,187 @@
+import asyncio
+
+import pytest
+
+from server import persistence
+from server.persistence import (FileRoomStore, RoomJournal, SqliteRoomStore, WriteBehind,
+                                load_room, room_store, save_room)
+from server.state import apply_action, new_room
+
+def _play(s, journal, actions):
+    for kind, payload in actions:
+        v = s.version
+        apply_action(s, kind, payload)
+        if s.version != v:
+            journal.record(s, kind, payload)
+
+ACTIONS = [
+    ("draw", {"player_id": "A", "n": 2}),
+    ("shuffle_library", {"player_id": "A"}),
+    ("mulligan", {"player_id": "B", "n": 5}),
+    ("create_token", {"player_id": "A", "name": "Elf", "creature": True}),
+    ("seat_deck", {"player_id": "B", "deck": [f"X{i}" for i in range(20)]}),
+    ("shuffle_library", {"player_id": "B"}),
+    ("life", {"player_id": "A", "delta": -4}),
+]
+
+def test_snapshot_plus_log_replays_identically():
+    s = new_room("P1", [f"A{i}" for i in range(30)], [f"B{i}" for i in range(30)])
+    journal = RoomJournal("P1", every=1000)
+    journal.start(s)
+    _play(s, journal, ACTIONS)
+    restored = load_room("P1")
+    assert restored.model_dump() == s.model_dump()
+    # the RNG picks up where it left off too
+    apply_action(s, "shuffle_library", {"player_id": "A"})
+    apply_action(restored, "shuffle_library", {"player_id": "A"})
+    assert restored.players["A"].library == s.players["A"].library
+
+def test_periodic_snapshot_truncates_log(tmp_path):
+    s = new_room("P2", [f"A{i}" for i in range(30)], [])
+    journal = RoomJournal("P2", every=3)
+    journal.start(s)
+    _play(s, journal, ACTIONS)
+    _, entries = room_store().read("P2")
+    assert len(entries) == journal.count < 3
+    assert load_room("P2").model_dump() == s.model_dump()
+
+def test_torn_last_line_is_ignored():
+    s = new_room("P3", [f"A{i}" for i in range(10)], [])
+    journal = RoomJournal("P3", every=1000)
+    journal.start(s)
+    _play(s, journal, ACTIONS[:1])
+    with open(persistence.ROOMS_DIR / "P3.log.jsonl", "a") as f:
+        f.write('{"v": 99, "type": "li')
+    assert load_room("P3").model_dump() == s.model_dump()
+
+def test_legacy_plain_snapshot_still_loads():
+    s = new_room("P4", ["a", "b"], [])
+    save_room(s)
+    (persistence.ROOMS_DIR / "P4.json").write_text(s.model_dump_json(indent=2))
+    assert load_room("P4").model_dump() == s.model_dump()
+
+@pytest.mark.parametrize("make", [FileRoomStore, lambda root: SqliteRoomStore(root / "rooms.sqlite3")])
+def test_stores_replace_log_with_snapshot(tmp_path, make):
+    store = make(tmp_path)
+    assert store.read("S") == (None, [])
+    store.write("S", "snap1", ["e1", "e2"])
+    store.write("S", None, ["e3"])
+    assert store.read("S") == ("snap1", ["e1", "e2", "e3"])
+    store.write("S", "snap2", ["e4"])
+    assert store.read("S") == ("snap2", ["e4"])
+
+def test_write_behind_batches_off_loop(tmp_path):
+    class Recording(FileRoomStore):
+        writes = []
+        def write(self, room_id, snapshot, entries):
+            self.writes.append((room_id, snapshot, list(entries)))
+            super().write(room_id, snapshot, entries)
+
+    async def run():
+        store = Recording(tmp_path)
+        writer = WriteBehind(store, delay_ms=10)
+        s = new_room("W", [f"A{i}" for i in range(10)], [])
+        journal = RoomJournal("W", writer, every=1000)
+        journal.start(s)
+        _play(s, journal, ACTIONS[:3])
+        assert store.writes == []  # nothing written synchronously
+        await asyncio.sleep(0.05)
+        await writer.flush()
+        return s, store
+    s, store = asyncio.run(run())
+    assert len(store.writes) == 1  # the snapshot and three entries went out as one batch
+    assert len(store.writes[0][2]) == 3
+
+def test_failed_batched_writes_are_queued_again(tmp_path):
+    class Flaky(FileRoomStore):
+        fail = True
+        def write(self, room_id, snapshot, entries):
+            if self.fail and room_id == "F2":
+                raise OSError("disk full")
+            super().write(room_id, snapshot, entries)
+
+    async def run():
+        store = Flaky(tmp_path)
+        writer = WriteBehind(store, delay_ms=0)
+        rooms = [new_room(rid, [f"A{i}" for i in range(10)], []) for rid in ("F1", "F2")]
+        journals = [RoomJournal(s.room_id, writer, every=1000) for s in rooms]
+        for s, journal in zip(rooms, journals):
+            journal.start(s)
+            _play(s, journal, ACTIONS[:2])
+        await writer.flush()  # F2 fails and stays queued
+        assert "F2" in writer.dirty and "F1" not in writer.dirty
+        _play(rooms[1], journals[1], ACTIONS[2:4])  # more entries on top of the unwritten ones
+        store.fail = False
+        await writer.flush()
+        return rooms
+    rooms = asyncio.run(run())
+    for s in rooms:
+        assert load_room(s.room_id).model_dump() == s.model_dump()
+
+def test_deck_cache_reparses_only_when_file_changes(tmp_path, monkeypatch):
+    import json, os
+    monkeypatch.setattr(persistence, "DECKS_DIR", tmp_path)
+    f = tmp_path / "burn.json"
+    f.write_text(json.dumps({"cards": [{"name": "Bolt", "qty": 4, "image": "C:\\\\x\\\\images\\\\b.jpg"}]}))
+    first = persistence.load_deck("burn")
+    assert len(first) == 4 and first[0]["image"] == "/images/b.jpg"
+    first.clear()  # callers own the list
+    assert persistence.load_deck("burn") == persistence.load_deck("burn.json")
+    assert len(persistence.load_deck("burn")) == 4
+    f.write_text(json.dumps({"cards": [{"name": "Bolt", "qty": 2}]}))
+    os.utime(f, ns=(1, 1))
+    assert len(asyncio.run(persistence.load_deck_async("burn"))) == 2
+    assert len(persistence.load_deck("missing")) == 40
+
+@pytest.mark.parametrize("every", [1000, 3])
+def test_undo_and_redo_replay_from_the_log(every):
+    s = new_room("P9", [f"A{i}" for i in range(30)], [f"B{i}" for i in range(30)])
+    journal = RoomJournal("P9", every=every)
+    journal.start(s)
+    _play(s, journal, ACTIONS + [("undo", {}), ("undo", {}), ("redo", {}), ("draw", {"player_id": "A", "n": 1}),
+                                 ("move", {"player_id": "A", "card_id": s.players["A"].hand[2], "to": "graveyard"}),
+                                 ("swap_zone_with_hand", {"player_id": "A", "zone": "graveyard"}),
+                                 ("undo", {})])
+    restored = load_room("P9")
+    assert restored.model_dump() == s.model_dump()
+    for _ in range(4):  # walks back past the snapshot the log was compacted into
+        apply_action(s, "undo", {})
+        apply_action(restored, "undo", {})
+        assert restored.model_dump() == s.model_dump()
+    apply_action(s, "redo", {})
+    apply_action(restored, "redo", {})
+    assert restored.model_dump() == s.model_dump()
+
+def test_replay_keeps_who_may_undo_what():
+    s = new_room("P11", [f"A{i}" for i in range(10)], [f"B{i}" for i in range(10)])
+    journal = RoomJournal("P11", every=2)
+    journal.start(s)
+    for pid, delta in (("A", -1), ("B", -2), ("A", -3)):
+        apply_action(s, "life", {"player_id": pid, "delta": delta}, actor=pid)
+        journal.record(s, "life", {"player_id": pid, "delta": delta}, pid)
+    restored = load_room("P11")
+    apply_action(restored, "undo", {}, actor="B")
+    assert restored.version == s.version  # A's action is on top
+    apply_action(restored, "undo", {}, actor="A")
+    assert restored.players["A"].life == 19
+
+def test_undo_puts_cards_back_in_place_after_a_reload():
+    s = new_room("P12", [f"A{i}" for i in range(20)], [])
+    hand = list(s.players["A"].hand)
+    apply_action(s, "move", {"player_id": "A", "card_id": hand[4], "to": "graveyard"})
+    apply_action(s, "move", {"player_id": "A", "card_id": hand[1], "to": "exile"})
+    apply_action(s, "draw", {"player_id": "A"})
+    save_room(s)
+    restored = load_room("P12")
+    for _ in range(3):
+        apply_action(restored, "undo", {})
+    assert list(restored.players["A"].hand) == hand
+
+def test_undo_after_a_compaction_replays_against_the_saved_history():
+    s = new_room("P10", [f"A{i}" for i in range(10)], [f"B{i}" for i in range(10)])
+    journal = RoomJournal("P10", every=3)
+    journal.start(s)
+    _play(s, journal, [("life", {"player_id": "A", "delta": -1})] * 3 + [("undo", {}), ("undo", {})])
+    assert (s.players["A"].life, s.version) == (19, 5)
+    restored = load_room("P10")
+    assert (restored.players["A"].life, restored.version) == (19, 5)
@@ -0,0 +1,72 @@
+import asyncio
+import json
+
+from server.projection import HIDDEN, project_patch, project_state
+from server.room import Room
+from server.state import Changes, apply_action, new_room
+
+def _room():
+    return new_room("R", [f"A{i}" for i in range(10)], [f"B{i}" for i in range(10)])
+
+def test_hidden_zones_are_placeholders():
+    s = _room()
+    view = project_state(s, "A")
+    a, b = view.players["A"], view.players["B"]
+    assert list(a.hand) == list(s.players["A"].hand)
+    assert list(b.hand) == [HIDDEN] * 7
+    assert list(a.library) == [HIDDEN] * 3
+    assert set(view.cards) == set(a.hand)
+    # the real state is untouched
+    assert HIDDEN not in s.players["B"].hand
+
+def test_public_view_hides_both_hands():
+    s = _room()
+    view = project_state(s, None)
+    assert not view.cards
+    assert all(cid == HIDDEN for pl in view.players.values() for cid in pl.hand)
+
+def test_flags_reveal_hand_and_library_top():
+    s = _room()
+    ch = Changes()
+    apply_action(s, "toggle_show_hand", {"player_id": "B"}, ch)
+    apply_action(s, "toggle_show_top", {"player_id": "B"}, ch)
+    patch = project_patch(s, ch, s.version - 2, "A")
+    top = s.players["B"].library[-1]
+    assert patch.players["B"]["hand"] == list(s.players["B"].hand)
+    assert patch.players["B"]["library"] == [HIDDEN, HIDDEN, top]
+    assert set(patch.cards) == set(s.players["B"].hand) | {top}
+
+def test_draw_is_only_shown_to_the_drawer():
+    s = _room()
+    ch = Changes()
+    apply_action(s, "draw", {"player_id": "A"}, ch)
+    drawn = s.players["A"].hand[-1]
+    mine, theirs = project_patch(s, ch, s.version - 1, "A"), project_patch(s, ch, s.version - 1, "B")
+    assert drawn in mine.cards and drawn in mine.players["A"]["hand"]
+    assert drawn not in theirs.cards and drawn not in theirs.players["A"]["hand"]
+
+class FakeWS:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, data):
+        self.sent.append(json.loads(data))
+
+    async def close(self, code=1000):
+        pass
+
+def test_room_sends_each_seat_its_own_view():
+    async def run():
+        room = Room(_room())
+        a, b = FakeWS(), FakeWS()
+        room.join(a, viewer="A")
+        room.join(b, viewer="B")
+        room.submit("draw", {"player_id": "B"})
+        await asyncio.sleep(0.01)
+        room.close()
+        return room, a, b
+    room, a, b = asyncio.run(run())
+    drawn = room.state.players["B"].hand[-1]
+    assert drawn not in a.sent[0]["state"]["cards"] and drawn not in a.sent[1]["cards"]
+    assert drawn in b.sent[1]["cards"]
+    assert room.snapshot("A") is room.snapshot("A")
@@ -0,0 +1,175 @@
+import asyncio
+import json
+
+from server import config
+from server.models import ClientDrag
+from server.room import Room
+from server.state import new_room
+
+class FakeWS:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, data):
+        self.sent.append(json.loads(data))
+
+    async def close(self, code=1000):
+        pass
+
+def _room():
+    st = new_room("R", [f"A{i}" for i in range(10)], [f"B{i}" for i in range(10)])
+    return Room(st)
+
+def test_set_card_pos_storm_is_coalesced(monkeypatch):
+    monkeypatch.setattr(config, "POS_COALESCE_MS", 20)
+
+    async def run():
+        room = _room()
+        ws = FakeWS()
+        room.join(ws)
+        cid = room.state.players["A"].hand[0]
+        room.apply("move", {"player_id": "A", "card_id": cid, "to": "battlefield"})
+        for i in range(100):
+            room.apply("set_card_pos", {"card_id": cid, "x": i, "y": i})
+        await asyncio.sleep(0.05)
+        return room, ws, cid
+    room, ws, cid = asyncio.run(run())
+    kinds = [m["kind"] for m in ws.sent]
+    assert kinds == ["state", "patch", "patch"]
+    assert ws.sent[-1]["cards"][cid]["pos"] == {"x": 99, "y": 99, "z": 1}
+    assert room.state.cards[cid].pos == {"x": 99, "y": 99, "z": 1}
+
+def test_other_actions_settle_pending_positions_first(monkeypatch):
+    monkeypatch.setattr(config, "POS_COALESCE_MS", 1000)
+
+    async def run():
+        room = _room()
+        cid = room.state.players["A"].hand[0]
+        room.apply("move", {"player_id": "A", "card_id": cid, "to": "battlefield"})
+        room.apply("set_card_pos", {"card_id": cid, "x": 5, "y": 5})
+        room.apply("move", {"player_id": "A", "card_id": cid, "to": "graveyard"})
+        await asyncio.sleep(0)
+        return room, cid
+    room, cid = asyncio.run(run())
+    assert room.state.cards[cid].pos is None
+    assert not room.pending_pos
+
+def test_drag_preview_is_relayed_but_not_applied(monkeypatch):
+    monkeypatch.setattr(config, "POS_COALESCE_MS", 10)
+
+    async def run():
+        room = _room()
+        cid = room.state.players["A"].hand[0]
+        room.apply("move", {"player_id": "A", "card_id": cid, "to": "battlefield"})
+        a, b = FakeWS(), FakeWS()
+        pa = room.join(a, viewer="A")
+        room.join(b, viewer="B")
+        v = room.state.version
+        for i in range(10):
+            room.drag(pa, "A", ClientDrag(kind="drag", card_id=cid, x=i, y=0))
+        await asyncio.sleep(0.03)
+        return room, a, b, v
+    room, a, b, v = asyncio.run(run())
+    assert room.state.version == v
+    assert [m["kind"] for m in a.sent] == ["state"]
+    assert [(m["kind"], m.get("x")) for m in b.sent] == [("state", None), ("drag", 9)]
+
+def test_actor_applies_queued_actions_in_order_with_one_broadcast():
+    async def run():
+        room = _room()
+        ws = FakeWS()
+        peer = room.join(ws)
+        v = room.state.version
+        room.submit("life", {"player_id": "A", "delta": -3})
+        room.submit("life", {"player_id": "B", "delta": -1})
+        room.submit("tap_toggle", {"card_id": "no-such-card"})  # changes nothing
+        room.submit("life", {"player_id": "Z", "delta": 1}, peer)  # fails alone, the rest still applies
+        room.submit("set_phase", {"phase": "Combat"})
+        room.submit("pass_turn", {})
+        await asyncio.sleep(0.01)
+        room.close()
+        return room, ws, v
+    room, ws, v = asyncio.run(run())
+    patches = [m for m in ws.sent if m["kind"] == "patch"]
+    assert len(patches) == 1
+    assert (patches[0]["base"], patches[0]["version"]) == (v, v + 4)
+    assert [(m["ok"], m["msg"]) for m in ws.sent if m["kind"] == "ack"] == [(False, "life failed")]
+    held = None  # an ack never claims a version the peer has not been sent yet
+    for m in ws.sent:
+        if m["kind"] in ("state", "patch"):
+            held = m["state"]["version"] if m["kind"] == "state" else m["version"]
+        elif m["kind"] == "ack":
+            assert m["version"] <= held
+    assert patches[0]["room"] == {"turn": "B", "phase": "Main"}
+    assert patches[0]["players"] == {"A": {"life": 17}, "B": {"life": 19}}
+
+def test_spectators_share_one_throttled_public_patch(monkeypatch):
+    monkeypatch.setattr(config, "SPECTATOR_FPS", 20)
+
+    async def run():
+        room = _room()
+        player = FakeWS()
+        room.join(player, viewer="A")
+        watchers = [FakeWS() for _ in range(3)]
+        for ws in watchers:
+            room.watch(ws)
+        v = room.state.version
+        for _ in range(5):
+            room.submit("draw", {"player_id": "A"})
+            await asyncio.sleep(0)
+        room.submit("life", {"player_id": "B", "delta": -2})
+        await asyncio.sleep(0.1)
+        room.close()
+        return room, player, watchers, v
+    room, player, watchers, v = asyncio.run(run())
+    assert len(player.sent) > 2
+    for ws in watchers:
+        assert [m["kind"] for m in ws.sent] == ["state", "patch"]
+        patch = ws.sent[1]
+        assert patch["base"] == v and patch["version"] == room.state.version
+        assert patch["players"]["B"]["life"] == 18
+        assert patch["cards"] == {}  # drawn cards stay hidden from the public
+        assert set(patch["players"]["A"]["hand"]) == {"?"}
+    assert watchers[0].sent[1] == watchers[1].sent[1]
+
+def test_catch_up_merges_missed_broadcasts_until_the_buffer_rolls(monkeypatch):
+    monkeypatch.setattr(config, "RESUME_BUFFER", 3)
+    room = _room()
+    v0 = room.state.version
+    for delta in (-1, -2, -3):
+        room.apply("life", {"player_id": "A", "delta": delta})
+    hand = room.state.players["A"].hand
+    room.apply("move", {"player_id": "A", "card_id": hand[0], "to": "battlefield"})
+    v = room.state.version
+
+    patch = json.loads(room.catch_up("B", v - 3).json())
+    assert (patch["base"], patch["version"]) == (v - 3, v)
+    assert patch["players"]["A"]["life"] == 14
+    # B sees the card that came onto the battlefield but not what is left in A's hand
+    assert set(patch["players"]["A"]["hand"]) == {"?"}
+    assert json.loads(room.catch_up("B", v).json())["players"] == {}
+    assert room.catch_up("B", v0) is None  # rolled past: snapshot instead
+    room.forget_history()
+    assert room.catch_up("B", room.state.version) is None
+
+def test_only_the_latest_session_of_a_seat_resumes():
+    room = _room()
+    assert not room.resumes("A", "s1")
+    assert room.resumes("A", "s1")
+    assert not room.resumes("A", "s2") and not room.resumes("A", "s1")
+    assert not room.resumes("B", None)
+
+def test_undo_is_per_seat_through_the_inbox():
+    async def run():
+        room = _room()
+        a, b = room.join(FakeWS(), viewer="A"), room.join(FakeWS(), viewer="B")
+        cid = room.state.players["A"].hand[0]
+        room.submit("move", {"player_id": "A", "card_id": cid, "to": "battlefield"}, a)
+        room.submit("undo", {}, b)
+        await asyncio.sleep(0.01)
+        held = cid in room.state.players["A"].battlefield
+        room.submit("undo", {}, a)
+        await asyncio.sleep(0.01)
+        room.close()
+        return held, cid in room.state.players["A"].hand
+    assert asyncio.run(run()) == (True, True)
@@ -0,0 +1,96 @@
+import asyncio
+import json
+
+from server.host import RoomHost
+from server.persistence import WriteBehind
+from server.sharding import LocalBroker, ShardRoutes, UnixBroker, run_shard, shard_for
+
+class BrowserWS:
+    """Scripted client side of a websocket, as both RoomHost and UnixBroker.relay see it."""
+
+    def __init__(self, messages):
+        self.inbox = asyncio.Queue()
+        for m in messages:
+            self.inbox.put_nowait(json.dumps(m))
+        self.sent = []
+        self.closed = None
+
+    async def receive_text(self):
+        return await self.inbox.get()
+
+    async def receive(self):
+        return {"type": "websocket.receive", "text": await self.inbox.get()}
+
+    async def send_text(self, data):
+        self.sent.append(json.loads(data))
+
+    async def close(self, code=1000):
+        self.closed = code
+        self.inbox.put_nowait(None)
+
+def _hello(room, pid="A"):
+    return {"kind": "hello", "room_id": room, "player_id": pid, "deck": "nope"}
+
+def _life(delta):
+    return {"kind": "action", "type": "life", "payload": {"player_id": "A", "delta": delta}}
+
+def test_routes_are_stable_and_pins_are_shared(tmp_path):
+    assert shard_for("ROOM", 4) == shard_for("ROOM", 4)
+    a = ShardRoutes(4, tmp_path / "routes.json")
+    b = ShardRoutes(4, tmp_path / "routes.json")
+    target = (a.owner("ROOM") + 1) % 4
+    a.pin("ROOM", target)
+    assert b.owner("ROOM") == target
+    a.pin("ROOM", shard_for("ROOM", 4))
+    assert b.owner("ROOM") == shard_for("ROOM", 4)
+
+def test_room_moves_between_shards_through_its_snapshot():
+    async def run():
+        hosts = [RoomHost(WriteBehind(delay_ms=1)) for _ in range(2)]
+        broker = LocalBroker(hosts)
+        first = broker.routes.owner("MOVE")
+        ws = BrowserWS([_hello("MOVE"), _life(-5)])
+        task = asyncio.ensure_future(broker.relay(ws, "MOVE"))
+        await asyncio.sleep(0.05)
+        await broker.move("MOVE", 1 - first)
+        await asyncio.wait_for(task, 1)
+        assert ws.closed == 1012 and "MOVE" not in hosts[first].rooms
+
+        ws2 = BrowserWS([_hello("MOVE")])
+        task = asyncio.ensure_future(broker.relay(ws2, "MOVE"))
+        await asyncio.sleep(0.05)
+        assert "MOVE" in hosts[1 - first].rooms
+        await ws2.close()
+        await task
+        return ws2.sent[0]
+    snap = asyncio.run(run())
+    assert snap["state"]["players"]["A"]["life"] == 15
+
+def test_unix_broker_relays_to_shard_process(tmp_path):
+    async def run():
+        server = asyncio.ensure_future(run_shard(0, tmp_path))
+        await asyncio.sleep(0.05)
+        broker = UnixBroker(ShardRoutes(1), tmp_path)
+        assert (await broker.call("U1", "save")) == {"ok": False, "msg": "Room not found"}
+        ws = BrowserWS([_hello("U1"), _life(-1)])
+        relay = asyncio.ensure_future(broker.relay(ws, "U1"))
+        await asyncio.sleep(0.1)
+        assert (await broker.call("U1", "save")) == {"ok": True}
+        relay.cancel()
+        server.cancel()
+        return ws.sent
+    sent = asyncio.run(run())
+    assert [m["kind"] for m in sent] == ["state", "patch"]
+    assert sent[1]["players"]["A"]["life"] == 19
+
+def test_relay_closes_client_when_shard_drops(tmp_path):
+    async def run():
+        async def crash(reader, writer):
+            await reader.read(1)
+            writer.close()
+        server = await asyncio.start_unix_server(crash, path=str(tmp_path / "shard-0.sock"))
+        ws = BrowserWS([_hello("EOF")])
+        await asyncio.wait_for(UnixBroker(ShardRoutes(1), tmp_path).relay(ws, "EOF"), 1)
+        server.close()
+        return ws.closed
+    assert asyncio.run(run()) == 1011
@@ -1,4 +1,4 @@
-from server.state import new_room, apply_action
+from server.state import Changes, new_room, apply_action, build_patch, seat_deck
 from server.models import RoomState
 
 def _make():
@@ -41,3 +41,210 @@ def test_swap_zone_with_hand():
     assert st.players["A"].hand == ["g1"]
     assert st.players["A"].graveyard == ["h1","h2"]
 
+
+def test_patch_carries_only_what_changed():
+    s = _make()
+    cid = s.players["A"].hand[0]
+    base = s.version
+    ch = Changes()
+    apply_action(s, "move", {"player_id":"A","to":"battlefield","card_id":cid}, ch)
+    patch = build_patch(s, ch, base)
+    assert (patch.base, patch.version) == (base, base + 1)
+    assert set(patch.cards) == {cid}
+    assert set(patch.players["A"]) == {"hand", "battlefield"}
+    assert patch.players["A"]["battlefield"] == [cid]
+    assert "B" not in patch.players
+
+def test_noop_action_keeps_version():
+    s = _make()
+    v = s.version
+    ch = Changes()
+    apply_action(s, "no_such_action", {}, ch)
+    assert not ch and s.version == v
+
+def test_draw_counts_are_bounded():
+    import pydantic, pytest
+    s = _make()
+    v = s.version
+    for kind, n in (("draw", 10**9), ("draw", -1), ("mulligan", 10**9)):
+        with pytest.raises(pydantic.ValidationError):
+            apply_action(s, kind, {"player_id": "A", "n": n})
+    assert s.version == v
+
+def test_location_index_survives_every_zone_action():
+    import random
+    from server.state import ZONES, locate
+    rng = random.Random(7)
+    s = new_room("IDX", [f"A{i}" for i in range(30)], [f"B{i}" for i in range(30)])
+    s = apply_action(s, "create_token", {"player_id": "B", "name": "Goblin", "creature": True})
+    for _ in range(300):
+        pid = rng.choice("AB")
+        cid = rng.choice(list(s.cards))
+        kind = rng.choice(["draw", "move", "mulligan", "shuffle_library", "put_on_bottom",
+                           "swap_zone_with_hand", "swap_opponent_zone_with_hand",
+                           "create_token", "remove_token", "undo", "redo"])
+        apply_action(s, kind, {"player_id": pid, "card_id": cid, "n": 2, "name": "Elf",
+                               "to": rng.choice(ZONES), "zone": rng.choice(["graveyard", "exile", "library"])})
+        placed = {}
+        for pl in s.players.values():
+            for zone in ZONES:
+                for c in getattr(pl, zone):
+                    assert s._loc[c] == (pl.id, zone)
+                    placed[c] = (pl.id, zone)
+        assert s._loc == placed  # nothing left behind for cards that are gone
+    assert sum(len(getattr(pl, z)) for pl in s.players.values() for z in ZONES) == len(s.cards)
+    bottom = s.players["A"].library[0]
+    assert locate(s, bottom)[:2] == ("A", "library")
+    index = s._loc
+    assert locate(s, "gone") is None and s._loc is index  # an unknown id costs no rebuild
+
+def test_put_on_bottom_and_wire_format():
+    s = _make()
+    cid = s.players["A"].hand[0]
+    apply_action(s, "put_on_bottom", {"player_id": "A", "card_id": cid})
+    assert s.players["A"].library[0] == cid
+    dumped = s.model_dump()
+    assert dumped["players"]["A"]["library"][0] == cid
+    assert RoomState.model_validate_json(s.model_dump_json()).players["A"].library == dumped["players"]["A"]["library"]
+
+def test_copies_share_one_definition():
+    deck = [{"name": "Bolt", "image": "/images/b.jpg", "set": "lea"}] * 4 + ["Island"] * 3
+    s = new_room("DEF", deck, deck)
+    assert len(s.defs) == 2
+    bolts = [c for c in s.cards.values() if s.defs[c.def_id].name == "Bolt"]
+    assert len(bolts) == 8 and bolts[0].name is None
+    assert "image" not in bolts[0].model_dump()
+
+def test_legacy_cards_are_split_into_definitions():
+    legacy = {"room_id": "L", "cards": {
+        "c1": {"id": "c1", "name": "Bolt", "image": "/images/b.jpg"},
+        "c2": {"id": "c2", "name": "Bolt", "image": "/images/b.jpg", "tapped": True},
+        "t1": {"id": "t1", "name": "Goblin", "is_token": True},
+    }}
+    s = RoomState.model_validate(legacy)
+    assert len(s.defs) == 1
+    assert s.cards["c1"].def_id == s.cards["c2"].def_id and s.cards["c2"].tapped
+    assert s.cards["t1"].def_id is None and s.cards["t1"].name == "Goblin"
+
+def test_seating_a_deck_ships_new_definitions_in_the_patch():
+    s = new_room("DEF2", ["a"] * 5, [])
+    base = s.version
+    ch = Changes()
+    seat_deck(s, "B", [{"name": "Forest"}] * 3, ch)
+    patch = build_patch(s, ch, base)
+    assert [d.name for d in patch.defs.values()] == ["Forest"]
+
+def test_payloads_are_validated_before_anything_changes():
+    import pydantic, pytest
+    s = new_room("V", ["a"] * 10)
+    v = s.version
+    with pytest.raises(pydantic.ValidationError):
+        apply_action(s, "move", {"player_id": "A", "card_id": s.players["A"].hand[0], "to": "nowhere"})
+    assert s.version == v and len(s.players["A"].hand) == 7
+
+def test_undo_puts_back_misclicks_and_redo_replays_them():
+    s = _make()
+    start = s.model_dump()
+    hand = list(s.players["A"].hand)
+    apply_action(s, "move", {"player_id": "A", "card_id": hand[0], "to": "battlefield"})
+    apply_action(s, "tap_toggle", {"card_id": hand[0]})
+    apply_action(s, "mulligan", {"player_id": "A", "n": 2})
+    apply_action(s, "create_token", {"player_id": "B", "name": "Elf", "creature": True})
+    apply_action(s, "swap_zone_with_hand", {"player_id": "B", "zone": "graveyard"})
+    end = s.model_dump()
+    for _ in range(5):
+        apply_action(s, "undo", {})
+    assert s.model_dump(exclude={"version"}) == {k: v for k, v in start.items() if k != "version"}
+    assert s.version == start["version"] + 10  # undo is an action like any other
+    v = s.version
+    apply_action(s, "undo", {})  # nothing left
+    assert s.version == v
+    for _ in range(5):
+        apply_action(s, "redo", {})
+    assert s.model_dump(exclude={"version"}) == {k: v for k, v in end.items() if k != "version"}
+    # the location index follows the restored zones
+    ch = Changes()
+    apply_action(s, "undo", {}); apply_action(s, "undo", {}); apply_action(s, "undo", {})
+    apply_action(s, "move", {"player_id": "A", "card_id": hand[0], "to": "exile"}, ch)
+    assert ("A", "battlefield") in ch.zones and hand[0] in s.players["A"].exile
+
+def test_undo_steps_keep_only_what_moved_and_where():
+    s = _make()
+    hand = list(s.players["A"].hand)
+    ordinal = s.players["A"].hand.order_key(hand[3])
+    apply_action(s, "move", {"player_id": "A", "card_id": hand[3], "to": "graveyard"})
+    step = s._history.undo[-1]
+    assert step.before[("zone", "A", "hand")] == [("del", hand[3], ordinal)]
+    assert step.before[("zone", "A", "graveyard")] == [("add", hand[3])]
+    apply_action(s, "undo", {})
+    assert list(s.players["A"].hand) == hand and not s.players["A"].graveyard
+    apply_action(s, "redo", {})
+    assert hand[3] not in s.players["A"].hand and list(s.players["A"].graveyard) == [hand[3]]
+
+def test_undo_patch_ships_restored_cards_and_new_actions_drop_redo():
+    s = _make()
+    apply_action(s, "create_token", {"player_id": "A", "name": "Elf"})
+    tid = s.players["A"].battlefield[-1]
+    ch = Changes()
+    apply_action(s, "undo", {}, ch)
+    patch = build_patch(s, ch, s.version - 1)
+    assert patch.cards == {tid: None} and patch.players["A"]["battlefield"] == []
+    apply_action(s, "life", {"player_id": "A", "delta": 1})
+    v = s.version
+    apply_action(s, "redo", {})
+    assert s.version == v and tid not in s.cards
+
+def test_undo_history_is_bounded(monkeypatch):
+    from server import config
+    monkeypatch.setattr(config, "UNDO_DEPTH", 3)
+    s = _make()
+    for _ in range(5):
+        apply_action(s, "life", {"player_id": "A", "delta": -1})
+    for _ in range(5):
+        apply_action(s, "undo", {})
+    assert s.players["A"].life == 18
+
+def test_new_ids_do_not_draw_from_the_shuffle_rng():
+    s = _make()
+    before = s._rng.getstate()
+    apply_action(s, "create_token", {"player_id": "A", "name": "Elf"})
+    assert s._rng.getstate() == before
+
+def test_a_handler_failing_halfway_leaves_no_trace(monkeypatch):
+    import pytest
+    from server.models import EmptyPayload
+    from server.state import HANDLERS, _put, _take
+    s = _make()
+    before = s.model_dump()
+    hand = s.players["A"].hand
+
+    def broken(s, p, ch):
+        cid = hand[0]
+        ch.zone("A", "hand"); ch.zone("A", "graveyard", (cid,)); ch.field("A", "life")
+        _take(s, cid)
+        _put(s, "A", "graveyard", cid)
+        s.players["A"].life = 1
+        raise RuntimeError("boom")
+
+    monkeypatch.setitem(HANDLERS, "broken", (EmptyPayload, broken))
+    with pytest.raises(RuntimeError):
+        apply_action(s, "broken", {})
+    assert s.model_dump() == before and not s._history.undo
+    assert hand._log is None and s.players["A"].graveyard._log is None
+    ch = Changes()
+    apply_action(s, "life", {"player_id": "A", "delta": -1}, ch)
+    assert not ch.zones and s._history.undo[-1].before == {("field", "A", "life"): 20}
+
+def test_a_seat_cannot_undo_the_other_seats_action():
+    s = _make()
+    cid = s.players["A"].hand[0]
+    apply_action(s, "move", {"player_id": "A", "card_id": cid, "to": "battlefield"}, actor="A")
+    v = s.version
+    apply_action(s, "undo", {}, actor="B")
+    assert s.version == v and cid in s.players["A"].battlefield
+    apply_action(s, "undo", {}, actor="A")
+    assert cid in s.players["A"].hand
+    apply_action(s, "redo", {}, actor="B")  # the redo is A's too
+    assert cid in s.players["A"].hand
+    apply_action(s, "redo", {}, actor="A")
+    assert cid in s.players["A"].battlefield